@@ -13,7 +13,8 @@ from django.core.asgi import get_asgi_application
 from channels.auth import AuthMiddlewareStack
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.security.websocket import AllowedHostsOriginValidator
-from multiplayer.routing import websocket_urlpatterns
+from multiplayer.routing import websocket_urlpatterns as multiplayer_urlpatterns
+from puzzle.routing import websocket_urlpatterns as puzzle_urlpatterns
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'AlgoBattles.settings')
 # Initialize Django ASGI application early to ensure the AppRegistry
@@ -24,7 +25,7 @@ application = ProtocolTypeRouter(
     {
         "http": django_asgi_app,
         "websocket": AllowedHostsOriginValidator(
-            URLRouter(websocket_urlpatterns)
+            URLRouter(multiplayer_urlpatterns + puzzle_urlpatterns)
         ),
     }
 )
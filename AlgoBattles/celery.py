@@ -1,5 +1,7 @@
 import os
+import time
 from celery import Celery
+from celery.signals import before_task_publish, task_prerun, celeryd_init, celeryd_after_setup, worker_ready
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'AlgoBattles.settings')
 
@@ -8,6 +10,56 @@ app = Celery('AlgoBattles')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 
+def worker_queue(hostname):
+    """Name of the queue consumed only by the worker hostname"""
+    return f"engine.{hostname}"
+
+@celeryd_after_setup.connect
+def add_worker_queue(sender, instance, **kwargs):
+    # Chains are pinned to the worker running their first task, see engine.tasks.build. Their test steps
+    # come first, as the attempt already waited in a shared queue
+    queues = instance.app.amqp.queues
+    name = worker_queue(sender)
+    queues.select_add(name)
+    queues.select([name, *(q for q in queues.consume_from if q != name)])
+
 @app.task(bind=True, ignore_result=True)
 def debug_task(self):
     print(f'Request: {self.request!r}')
+
+# Judge pipeline metrics: queue wait is measured from the time a task is published to the time a worker
+# starts running it. Workers expose their histograms on their own HTTP endpoint.
+
+@before_task_publish.connect
+def stamp_enqueue_time(headers=None, **kwargs):
+    if headers is not None:
+        headers["enqueued_at"] = time.time()
+
+@task_prerun.connect
+def observe_queue_wait(task=None, **kwargs):
+    from utils import metrics
+    from AlgoBattles import settings
+
+    request = task.request
+    enqueued_at = getattr(request, "enqueued_at", None) or (request.headers or {}).get("enqueued_at")
+    if enqueued_at is not None:
+        queue = (request.delivery_info or {}).get("routing_key") or "celery"
+        if queue not in (settings.ENGINE_CHALLENGE_QUEUE, settings.ENGINE_PRACTICE_QUEUE, "celery"):
+            queue = "worker"
+
+        metrics.observe(
+            "queue_wait", max(time.time() - enqueued_at, 0.0), task=task.name.rsplit(".", 1)[-1], queue=queue
+        )
+
+@celeryd_init.connect
+def set_metrics_component(**kwargs):
+    from utils import metrics
+    metrics.set_component("worker")
+
+@worker_ready.connect
+def serve_metrics(**kwargs):
+    from utils import metrics
+    from AlgoBattles import settings
+
+    if settings.METRICS_WORKER_PORT:
+        metrics.serve(settings.METRICS_WORKER_PORT)
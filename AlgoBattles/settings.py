@@ -14,6 +14,7 @@ from pathlib import Path
 import dj_database_url
 import os
 import sys
+from kombu import Queue
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -51,6 +52,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     "unique_user_email",
     'rest_framework',
     'rest_framework.authtoken',
@@ -169,6 +171,20 @@ REST_FRAMEWORK = {
 CELERY_RESULT_BACKEND = "django-db"
 CELERY_BROKER_URL = os.environ.get("REDIS_URL") if not DEBUG else "redis://localhost:6379/0"
 
+# Attempts of live challenges and practice attempts go to separate queues. Workers consume queues in the order
+# they are declared, always draining the challenge queue first, and reserve one task at a time so a burst of
+# practice attempts is not prefetched ahead of a challenge attempt
+ENGINE_CHALLENGE_QUEUE = "engine.challenge"
+ENGINE_PRACTICE_QUEUE = "engine.practice"
+
+CELERY_TASK_QUEUES = [
+    Queue(ENGINE_CHALLENGE_QUEUE),
+    Queue(ENGINE_PRACTICE_QUEUE),
+    Queue("celery"),
+]
+CELERY_BROKER_TRANSPORT_OPTIONS = {"queue_order_strategy": "priority"}
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
 if 'test' in sys.argv:
     CELERY_TASK_ALWAYS_EAGER = True
     CELERY_TASK_EAGER_PROPAGATES = True
@@ -186,4 +202,100 @@ if not DEBUG:
         "hosts": [os.environ.get("REDIS_URL")]
     }
 
+# Cache
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.environ.get("REDIS_URL") if not DEBUG else "redis://localhost:6379/0",
+        "KEY_PREFIX": "algobattles",
+    }
+}
+
+if 'test' in sys.argv:
+    CACHES["default"] = {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+
+# Featured puzzles payload, cached for FEATURED_CACHE_TIMEOUT seconds and invalidated when puzzles or categories
+# change. A single process rebuilds it on a miss, the others wait up to FEATURED_CACHE_LOCK_TIMEOUT seconds
+FEATURED_CACHE_TIMEOUT = int(os.environ.get("ALGOBATTLES_FEATURED_CACHE_TIMEOUT", 3600))
+FEATURED_CACHE_LOCK_TIMEOUT = 5
+
+# Title autocomplete. Each process caches the suggestions of AUTOCOMPLETE_CACHE_SIZE hot prefixes for
+# AUTOCOMPLETE_CACHE_TTL seconds
+AUTOCOMPLETE_CACHE_SIZE = int(os.environ.get("ALGOBATTLES_AUTOCOMPLETE_CACHE_SIZE", 1024))
+AUTOCOMPLETE_CACHE_TTL = int(os.environ.get("ALGOBATTLES_AUTOCOMPLETE_CACHE_TTL", 60))
+
 ENGINE_WORKDIR = "abengine-workdir" if DEBUG else os.environ.get("ALGOBATTLES_ENGINE_WORKDIR", "/usr/abengine")
+
+# Size in bytes of the in-memory cache of compiled artifacts (and compile errors) served to identical
+# resubmissions. Each worker process holds its own cache: a host uses up to concurrency times this size
+ENGINE_ARTIFACT_CACHE_SIZE = int(os.environ.get("ALGOBATTLES_ENGINE_ARTIFACT_CACHE_SIZE", 32 * 1024 * 1024))
+
+# Warm pool of compiler containers. Builds are run with exec inside long-lived containers instead of
+# creating a new one every time
+ENGINE_COMPILER_POOL = not bool(os.environ.get("ALGOBATTLES_ENGINE_DISABLE_POOL"))
+ENGINE_POOL_MIN_SIZE = int(os.environ.get("ALGOBATTLES_ENGINE_POOL_MIN_SIZE", 1))
+ENGINE_POOL_MAX_SIZE = int(os.environ.get("ALGOBATTLES_ENGINE_POOL_MAX_SIZE", 4))
+ENGINE_POOL_IDLE_TIMEOUT = int(os.environ.get("ALGOBATTLES_ENGINE_POOL_IDLE_TIMEOUT", 300))  # seconds
+ENGINE_POOL_ACQUIRE_TIMEOUT = 60    # seconds
+
+# Build and test each attempt in a single container of the algobattles-sandbox image, instead of
+# chaining a compiler container and a solver container
+ENGINE_FUSED_SANDBOX = bool(os.environ.get("ALGOBATTLES_ENGINE_FUSED_SANDBOX"))
+
+# Sandbox backend of the engine: "docker" runs every step in a container, "local" runs the compiler and
+# the solver as confined subprocesses (trusted hosts only)
+ENGINE_SANDBOX = os.environ.get("ALGOBATTLES_ENGINE_SANDBOX", "docker")
+ENGINE_LOCAL_COMPILE_TIMEOUT = 60   # seconds
+# The local sandbox confines attempts with bubblewrap, and refuses to start without it unless explicitly allowed
+ENGINE_LOCAL_UNCONFINED = bool(os.environ.get("ALGOBATTLES_ENGINE_LOCAL_UNCONFINED"))
+
+# Number of test cases the solver runs in parallel for each attempt (0 = one per available CPU)
+ENGINE_SOLVER_JOBS = int(os.environ.get("ALGOBATTLES_ENGINE_SOLVER_JOBS", 1))
+
+# Maximum size of the output of a single test, in bytes. Bigger outputs are killed (0 = no limit)
+ENGINE_OUTPUT_LIMIT = int(os.environ.get("ALGOBATTLES_ENGINE_OUTPUT_LIMIT", 64 * 1024 * 1024))
+
+# Worker-side store of puzzle test sets, copied into chunks. Must not be under ENGINE_WORKDIR, which solver
+# containers mount: it holds the expected outputs of every puzzle
+ENGINE_TESTSET_DIR = "abengine-testsets" if DEBUG else os.environ.get("ALGOBATTLES_ENGINE_TESTSET_DIR", "/var/cache/abengine/testsets")
+
+# Judge pipeline metrics, aggregated in Redis. Workers expose them over HTTP on METRICS_WORKER_PORT
+# (0 to disable), the web app on /metrics
+METRICS_REDIS_URL = os.environ.get("REDIS_URL") if not DEBUG else "redis://localhost:6379/0"
+METRICS_WORKER_PORT = int(os.environ.get("ALGOBATTLES_METRICS_WORKER_PORT", 9808))
+# Networks allowed to scrape /metrics on the web app, comma separated. Staff users are always allowed
+METRICS_ALLOWED_NETWORKS = os.environ.get("ALGOBATTLES_METRICS_ALLOWED_NETWORKS", "127.0.0.0/8,::1/128").split(",")
+
+# Chunk workspace. In production ENGINE_WORKDIR is a tmpfs volume, sized in docker-compose.yml. New chunks are
+# refused (and their task retried) while less than ENGINE_WORKDIR_RESERVE bytes are free. Chunks older than
+# ENGINE_CHUNK_MAX_AGE seconds are orphans, removed by a reaper running every ENGINE_REAP_INTERVAL seconds
+ENGINE_WORKDIR_RESERVE = int(os.environ.get("ALGOBATTLES_ENGINE_WORKDIR_RESERVE", 64 * 1024 * 1024))
+ENGINE_CHUNK_MAX_AGE = int(os.environ.get("ALGOBATTLES_ENGINE_CHUNK_MAX_AGE", 3600))
+ENGINE_REAP_INTERVAL = int(os.environ.get("ALGOBATTLES_ENGINE_REAP_INTERVAL", 60))
+
+# Copy chunks in and out of sandbox containers as tar archives, instead of sharing them through a volume.
+# Sandbox containers then need no filesystem shared with the worker
+ENGINE_ARCHIVE_TRANSFER = bool(os.environ.get("ALGOBATTLES_ENGINE_ARCHIVE_TRANSFER"))
+
+# Admission control of solver runs. Each host (ENGINE_HOST, shared by the workers using the same Docker daemon)
+# has a budget of CPU cores and memory in bytes, by default its cores and 80% of its memory. Runs reserve the
+# cores they test on and the puzzle memory constraint of each parallel test (ENGINE_DEFAULT_TEST_MEMORY when
+# unconstrained) plus ENGINE_SOLVER_OVERHEAD, and wait up to ENGINE_ADMISSION_WAIT seconds for room before
+# their task is retried
+ENGINE_ADMISSION = not bool(os.environ.get("ALGOBATTLES_ENGINE_DISABLE_ADMISSION"))
+ENGINE_HOST = os.environ.get("ALGOBATTLES_ENGINE_HOST", os.uname().nodename)
+ENGINE_HOST_CPUS = int(os.environ.get("ALGOBATTLES_ENGINE_HOST_CPUS", 0))
+ENGINE_HOST_MEMORY = int(os.environ.get("ALGOBATTLES_ENGINE_HOST_MEMORY", 0))
+ENGINE_DEFAULT_TEST_MEMORY = int(os.environ.get("ALGOBATTLES_ENGINE_DEFAULT_TEST_MEMORY", 256 * 1024 * 1024))
+ENGINE_SOLVER_OVERHEAD = int(os.environ.get("ALGOBATTLES_ENGINE_SOLVER_OVERHEAD", 64 * 1024 * 1024))
+ENGINE_ADMISSION_WAIT = int(os.environ.get("ALGOBATTLES_ENGINE_ADMISSION_WAIT", 30))
+ENGINE_ADMISSION_LEASE_TTL = int(os.environ.get("ALGOBATTLES_ENGINE_ADMISSION_LEASE_TTL", 600))
+# Redis holding the admission leases, by default the main one. Kept apart from the metrics Redis
+ENGINE_ADMISSION_REDIS_URL = (
+    os.environ.get("ALGOBATTLES_ENGINE_ADMISSION_REDIS_URL", os.environ.get("REDIS_URL")) if not DEBUG else "redis://localhost:6379/0"
+)
+
+# Lifecycle state of attempts being judged, kept in Redis for ATTEMPT_STATE_TTL seconds
+ATTEMPT_STATE_REDIS_URL = os.environ.get("REDIS_URL") if not DEBUG else "redis://localhost:6379/0"
+ATTEMPT_STATE_TTL = int(os.environ.get("ALGOBATTLES_ATTEMPT_STATE_TTL", 24 * 3600))
@@ -16,10 +16,12 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import include, path
+from utils.metrics import metrics_view
 
 urlpatterns = [
     path('api/', include("puzzle.urls")),
     path('admin/', admin.site.urls),
     path('api/auth/', include("restauth.urls")),
     path('api/user/', include("userprofile.urls")),
+    path('metrics', metrics_view),
 ]
@@ -0,0 +1,136 @@
+"""
+Admission control of solver runs on a sandbox host.
+
+Each host has a budget of CPU cores and memory. Before a solver starts, the engine reserves the cores it
+runs tests on and the memory its tests may use (the puzzle memory constraint for each parallel test), and
+waits while the host is full instead of oversubscribing it. Reservations are leases kept in Redis, shared by
+every worker process using the host and expiring on their own if a worker dies holding one.
+"""
+
+import os
+import time
+import uuid
+import logging
+from contextlib import contextmanager
+
+import redis
+
+from AlgoBattles import settings
+
+# Drops expired leases, then adds the lease if the host has room for it
+ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[1])
+for _, id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now)) do
+    redis.call('HDEL', KEYS[2], id)
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+
+local cpus, memory = 0, 0
+for _, lease in ipairs(redis.call('HVALS', KEYS[2])) do
+    local c, m = string.match(lease, '([^,]+),([^,]+)')
+    cpus = cpus + tonumber(c)
+    memory = memory + tonumber(m)
+end
+
+if cpus + tonumber(ARGV[3]) > tonumber(ARGV[5]) or memory + tonumber(ARGV[4]) > tonumber(ARGV[6]) then
+    return 0
+end
+
+redis.call('HSET', KEYS[2], ARGV[2], ARGV[3] .. ',' .. ARGV[4])
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[7]), ARGV[2])
+return 1
+"""
+
+
+class AdmissionTimeout(Exception):
+    pass
+
+
+class Demand():
+    """Resources reserved for a solver run: CPU cores and memory in bytes"""
+
+    def __init__(self, cpus, memory):
+        self.cpus = cpus
+        self.memory = memory
+
+    def __repr__(self):
+        return f"Demand(cpus={self.cpus}, memory={self.memory})"
+
+
+def host_memory():
+    """Total memory of the host in bytes"""
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+class AdmissionController():
+    def __init__(self, client, host, cpus, memory, lease_ttl=600, poll_interval=0.2):
+        self.client = client
+        self.host = host
+        self.cpus = cpus
+        self.memory = memory
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self.__acquire = client.register_script(ACQUIRE_SCRIPT)
+
+    @classmethod
+    def from_settings(cls):
+        client = redis.Redis.from_url(settings.ENGINE_ADMISSION_REDIS_URL, socket_connect_timeout=0.5, socket_timeout=0.5)
+        return cls(
+            client,
+            settings.ENGINE_HOST,
+            settings.ENGINE_HOST_CPUS or os.cpu_count(),
+            settings.ENGINE_HOST_MEMORY or int(host_memory() * 0.8),
+            settings.ENGINE_ADMISSION_LEASE_TTL
+        )
+
+    @property
+    def keys(self):
+        return [f"admission:{self.host}:expiry", f"admission:{self.host}:leases"]
+
+    def demand(self, memlimit, jobs):
+        """Resources of a solver running jobs tests in parallel, each limited to memlimit bytes (0 for no
+        limit). Capped to the whole host, so that any run can be admitted on an idle host."""
+        jobs = max(jobs or self.cpus, 1)
+        per_test = memlimit or settings.ENGINE_DEFAULT_TEST_MEMORY
+        memory = per_test * jobs + settings.ENGINE_SOLVER_OVERHEAD
+
+        return Demand(min(jobs, self.cpus), min(memory, self.memory))
+
+    def try_acquire(self, lease, demand: Demand) -> bool:
+        admitted = self.__acquire(
+            keys=self.keys,
+            args=[time.time(), lease, demand.cpus, demand.memory, self.cpus, self.memory, self.lease_ttl]
+        )
+        return bool(admitted)
+
+    def release(self, lease):
+        expiry, leases = self.keys
+        pipe = self.client.pipeline()
+        pipe.zrem(expiry, lease)
+        pipe.hdel(leases, lease)
+        pipe.execute()
+
+    @contextmanager
+    def reserve(self, demand: Demand, timeout=None):
+        """Hold demand for the enclosed block, waiting up to timeout seconds for the host to have room.
+        Raises AdmissionTimeout if it does not. If Redis is unavailable, runs are admitted without a lease."""
+        lease = uuid.uuid4().hex
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        try:
+            while not self.try_acquire(lease, demand):
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise AdmissionTimeout(f"{demand} not available on {self.host}")
+                time.sleep(self.poll_interval)
+        except redis.RedisError as e:
+            logging.warning(f"Admission control unavailable, admitting {demand}: {e}")
+            yield demand
+            return
+
+        try:
+            yield demand
+        finally:
+            try:
+                self.release(lease)
+            except redis.RedisError as e:
+                logging.warning(f"Cannot release lease {lease}, it will expire: {e}")
@@ -0,0 +1,226 @@
+"""
+Benchmark of the judge pipeline.
+
+Submits synthetic attempts to the engine at a given concurrency, against the Docker daemon or the
+in-process FakeDockerClient, and reports latency percentiles for each phase along with the throughput in
+attempts per second. Phases are timed by wrapping the Docker client, so the same figures come out of both.
+"""
+
+import math
+import time
+import uuid
+import base64
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from .engine import Engine, CompileTimeError
+from .sandbox import DockerSandbox
+from .tasks import test_chain
+
+SOURCE = """#include <stdio.h>
+int main() {
+    int a, b;
+    scanf("%d %d", &a, &b);
+    printf("%d\\n", a + b);
+    return 0;
+}
+"""
+
+PHASES = ("chunk", "create", "archive", "start", "wait", "logs", "remove", "exec", "compile", "test", "attempt")
+
+def percentile(samples, q):
+    """Nearest-rank percentile of a sorted list"""
+    if not samples:
+        return None
+
+    rank = max(math.ceil(q / 100 * len(samples)), 1)
+    return samples[rank - 1]
+
+
+class PhaseTimer():
+    """Thread-safe collection of durations by phase"""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def time(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(phase, time.perf_counter() - start)
+
+    def record(self, phase, seconds):
+        with self.lock:
+            self.samples[phase].append(seconds)
+
+    def summary(self):
+        summary = {}
+        with self.lock:
+            for phase in PHASES:
+                samples = sorted(self.samples.get(phase, []))
+                if samples:
+                    summary[phase] = {
+                        "count": len(samples),
+                        "p50": percentile(samples, 50),
+                        "p95": percentile(samples, 95),
+                        "p99": percentile(samples, 99),
+                    }
+
+        return summary
+
+
+class TimedContainer():
+    """Proxy of a container timing its lifecycle calls"""
+
+    PHASES = {
+        "start": "start",
+        "wait": "wait",
+        "logs": "logs",
+        "remove": "remove",
+        "exec_run": "exec",
+        "put_archive": "archive",
+        "get_archive": "archive",
+    }
+
+    def __init__(self, container, timer: PhaseTimer):
+        self._container = container
+        self._timer = timer
+
+    def __getattr__(self, name):
+        attr = getattr(self._container, name)
+        phase = self.PHASES.get(name)
+        if phase is None:
+            return attr
+
+        def timed(*args, **kwargs):
+            # Streamed logs are consumed while the container runs, that time is accounted to wait
+            if kwargs.get("stream"):
+                return attr(*args, **kwargs)
+
+            with self._timer.time(phase):
+                return attr(*args, **kwargs)
+
+        return timed
+
+
+class TimedContainers():
+    def __init__(self, containers, timer: PhaseTimer):
+        self._containers = containers
+        self._timer = timer
+
+    def create(self, *args, **kwargs):
+        with self._timer.time("create"):
+            container = self._containers.create(*args, **kwargs)
+
+        return TimedContainer(container, self._timer)
+
+
+class TimedClient():
+    """Proxy of a Docker client timing the lifecycle of the containers it creates"""
+
+    def __init__(self, client, timer: PhaseTimer):
+        self.containers = TimedContainers(client.containers, timer)
+
+
+class TimedEngine(Engine):
+    """Engine timing the setup of chunks: writing sources and tests"""
+
+    def __init__(self, sandbox, timer: PhaseTimer):
+        self.timer = timer
+        super().__init__(sandbox)
+
+    def _save_source(self, *args):
+        with self.timer.time("chunk"):
+            super()._save_source(*args)
+
+    def _put_tests(self, *args):
+        with self.timer.time("chunk"):
+            super()._put_tests(*args)
+
+
+def synthetic_tests(count):
+    return [(i, f"{i} {i}", str(2 * i)) for i in range(count)]
+
+
+class Benchmark():
+    """Runs attempts through the engine, either calling it directly ("engine" mode) or through the
+    Celery workers ("chain" mode, where only the whole attempt is timed).
+
+    Each attempt has a distinct source, to defeat the artifact cache, unless reuse_source is set."""
+
+    def __init__(self, client=None, attempts=100, concurrency=4, tests=10, mode="engine", reuse_source=False,
+                 timelimit=int(1e6), memlimit=256 * 1024 ** 2, chain_timeout=60):
+        if client is None:
+            import docker
+            client = docker.from_env()
+
+        self.timer = PhaseTimer()
+        self.attempts = attempts
+        self.concurrency = concurrency
+        self.tests = synthetic_tests(tests)
+        self.mode = mode
+        self.reuse_source = reuse_source
+        self.timelimit = timelimit
+        self.memlimit = memlimit
+        self.chain_timeout = chain_timeout
+        self.run_id = uuid.uuid4().hex[:8]
+
+        if mode == "engine":
+            self.engine = TimedEngine(DockerSandbox(TimedClient(client, self.timer)), self.timer)
+
+    def source(self, n):
+        src = SOURCE if self.reuse_source else f"{SOURCE}// attempt {self.run_id}-{n}\n"
+        return base64.b64encode(src.encode()).decode()
+
+    def attempt(self, n):
+        """Run an attempt, returns whether the solver completed"""
+        uid = f"bench-{self.run_id}-{n}"
+
+        with self.timer.time("attempt"):
+            if self.mode == "chain":
+                result = test_chain("c", self.source(n), uid, self.tests, self.timelimit, self.memlimit)
+                status, _ = result.get(timeout=self.chain_timeout)
+                return status == "solver_success"
+
+            try:
+                with self.timer.time("compile"):
+                    chunk = self.engine.compile("c", self.source(n), uid)
+            except CompileTimeError:
+                return False
+
+            with self.timer.time("test"):
+                status, _ = self.engine.test(chunk, uid, self.tests, self.timelimit, self.memlimit)
+
+            return status == "solver_success"
+
+    def _safe_attempt(self, n):
+        try:
+            return self.attempt(n)
+        except Exception:
+            return False
+
+    def run(self) -> dict:
+        start = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            completed = list(executor.map(self._safe_attempt, range(self.attempts)))
+
+        elapsed = time.perf_counter() - start
+
+        if self.mode == "engine":
+            for pool in self.engine.sandbox.pools.values():
+                pool.shutdown()
+
+        return {
+            "attempts": self.attempts,
+            "errors": completed.count(False),
+            "concurrency": self.concurrency,
+            "elapsed": elapsed,
+            "throughput": self.attempts / elapsed if elapsed > 0 else 0.0,
+            "phases": self.timer.summary(),
+        }
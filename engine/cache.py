@@ -0,0 +1,91 @@
+"""
+Content-addressed cache of compilation outcomes.
+
+Byte-identical resubmissions (retries after a timeout, flipping between two versions, multiplayer resubmits)
+are served from this cache instead of paying for a compiler container. Both successful artifacts and
+compile-time errors are stored, keyed by language, compiler command and source hash. The cache lives in the
+memory of each worker process.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class CompileResult():
+    """Outcome of a compilation: either the artifact bytes or the compiler error logs"""
+
+    def __init__(self, artifact=None, errors=None):
+        self.artifact = artifact
+        self.errors = errors
+
+    @property
+    def size(self):
+        payload = self.artifact if self.artifact is not None else (self.errors or "").encode("utf-8")
+        return len(payload)
+
+
+class ArtifactCache():
+    """Size-bounded LRU cache of compile results.
+
+    The bound is on the total number of bytes held (artifacts plus error logs). Entries bigger
+    than the whole cache are never stored.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def key(language, source):
+        h = hashlib.sha256()
+        h.update(language.name.encode("utf-8"))
+        h.update(b"\0")
+        h.update(language.compile_command.encode("utf-8"))
+        h.update(b"\0")
+        h.update(source.encode("utf-8"))
+        return h.hexdigest()
+
+    def get(self, key):
+        with self.__lock:
+            result = self.__entries.get(key)
+
+            if result is None:
+                self.misses += 1
+                return None
+
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key, result: CompileResult):
+        if result.size > self.max_size:
+            return
+
+        with self.__lock:
+            old = self.__entries.pop(key, None)
+            if old is not None:
+                self.size -= old.size
+
+            self.__entries[key] = result
+            self.size += result.size
+
+            while self.size > self.max_size:
+                _, evicted = self.__entries.popitem(last=False)
+                self.size -= evicted.size
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self),
+            "size": self.size,
+        }
@@ -0,0 +1,52 @@
+"""
+Worker-side cache of puzzle checkers.
+
+Like test sets, custom checkers are not shipped in Celery messages: tasks carry a reference to the checker,
+the puzzle id and the hash of its language and source. Workers load each version of a checker from the
+database once and keep it in memory, its compiled artifact is then served by the artifact cache.
+"""
+
+import base64
+import hashlib
+import logging
+
+from puzzle.cache import LocalLRU
+from puzzle.models import Puzzle
+
+def checker_hash(language, source):
+    return hashlib.md5(f"{language}\0{source}".encode("utf-8")).hexdigest()
+
+def checker_ref(puzzle: Puzzle):
+    """Reference to the checker of a puzzle, to be sent to the engine in place of its source. None if the
+    puzzle has no checker."""
+    if not puzzle.checker:
+        return None
+
+    return {"puzzle": puzzle.id, "hash": checker_hash(puzzle.checker_language, puzzle.checker)}
+
+
+class CheckerStore():
+    """In-memory cache of the checkers of recently judged puzzles, by puzzle id and checker hash"""
+
+    def __init__(self, max_entries=256):
+        self.__checkers = LocalLRU(max_entries)
+
+    def fetch(self, puzzle_id, digest):
+        """Returns the checker as a (language, base64 source) pair, loading it from the database on a miss.
+        None if the puzzle no longer has a checker."""
+        checker = self.__checkers.get((puzzle_id, digest))
+        if checker is not None:
+            return checker
+
+        language, source = Puzzle.objects.filter(pk=puzzle_id).values_list("checker_language", "checker").get()
+        if not source:
+            logging.warning(f"Checker of puzzle {puzzle_id} removed since submission")
+            return None
+
+        actual = checker_hash(language, source)
+        if actual != digest:
+            logging.warning(f"Checker of puzzle {puzzle_id} changed since submission: {digest} is now {actual}")
+
+        checker = (language, base64.b64encode(source.encode("utf-8")).decode())
+        self.__checkers.put((puzzle_id, actual), checker)
+        return checker
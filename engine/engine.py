@@ -1,6 +1,6 @@
 """
-The engine module interfaces with a Docker environment and is responsible for compiling and running the code
-in a sandboxed (containerized) environment.
+The engine module interfaces with a sandbox backend (Docker by default) and is responsible for compiling and
+running the code in a sandboxed (containerized) environment.
 
 This module communicates with Django using a message broker.
 """
@@ -8,16 +8,46 @@ This module communicates with Django using a message broker.
 import os
 import shutil
 import logging
-import docker
 import base64
 import json
-
-import docker.models
-import docker.models.containers
+import time
+from contextlib import contextmanager
 
 from .language import C, Cpp
+from .cache import ArtifactCache, CompileResult
+from .sandbox import Sandbox, get_sandbox
+from .testsets import TestSetStore, write_tests, copy_tests
+from .checkers import CheckerStore
+from .workspace import ensure_space
+from .admission import AdmissionController
 
 from AlgoBattles import settings
+from utils.metrics import span, observe
+
+# Exit status of the solver when the --build or --build-checker command fails (fused build and test)
+BUILD_FAILED_STATUS = 3
+CHECKER_BUILD_FAILED_STATUS = 4
+
+# Directory of the chunk where the solver builds the checker from source
+CHECKER_BUILD_DIR = "checker-build"
+
+PROGRESS_PREFIX = '{"progress"'
+
+def solver_results(stdout):
+    """Strip per-test progress records from the solver output, leaving only the final results"""
+    return "".join(line for line in stdout.splitlines(keepends=True) if not line.startswith(PROGRESS_PREFIX))
+
+def progress_listener(progress):
+    """Wraps a progress callback into a listener for solver output lines. The callback receives each
+    progress record as a dict with keys test, verdict, done, passed and total."""
+    if progress is None:
+        return None
+
+    def on_line(line):
+        if line.startswith(PROGRESS_PREFIX):
+            progress(json.loads(line)["progress"])
+
+    return on_line
 
 class CompileTimeError(Exception):
     def __init__(self, logs):
@@ -36,7 +66,7 @@ class Chunk():
         return self.__chunk
     
     def remove(self):
-        shutil.rmtree(self.absdir)
+        shutil.rmtree(self.absdir, ignore_errors=True)
 
 class Engine():
     VOLUME_NAME = "algobattles-engine"
@@ -46,107 +76,311 @@ class Engine():
         "c++": Cpp()
     }
 
-    def __init__(self) -> None:
-        self.configure()
+    def __init__(self, sandbox: Sandbox = None) -> None:
+        self.configure(sandbox)
         
-    def configure(self):
-        self.client = docker.from_env()
+    def configure(self, sandbox=None):
+        self.sandbox = sandbox or get_sandbox(settings.ENGINE_SANDBOX)
         self.workingdir = settings.ENGINE_WORKDIR
         os.makedirs(self.workingdir, exist_ok=True)
-    
+        self.cache = ArtifactCache(settings.ENGINE_ARTIFACT_CACHE_SIZE)
+        self.testsets = TestSetStore(settings.ENGINE_TESTSET_DIR)
+        self.checkers = CheckerStore()
+        self.admission = AdmissionController.from_settings() if settings.ENGINE_ADMISSION else None
+
+    @contextmanager
+    def _admit(self, memlimit, jobs):
+        """Reserve the host resources of a solver run, yields the reserved Demand (None without admission
+        control). Raises AdmissionTimeout if the host stays full."""
+        if self.admission is None:
+            yield None
+            return
+
+        start = time.perf_counter()
+        with self.admission.reserve(self.admission.demand(memlimit, jobs), settings.ENGINE_ADMISSION_WAIT) as demand:
+            observe("judge_phase", time.perf_counter() - start, phase="admission")
+            yield demand
+
+    def _new_chunk(self, uid) -> Chunk:
+        """Create a chunk, raising WorkspaceFull if the working directory is short of space"""
+        with span("chunk"):
+            ensure_space(self.workingdir, settings.ENGINE_WORKDIR_RESERVE, settings.ENGINE_CHUNK_MAX_AGE)
+            return Chunk(uid, self.workingdir)
+
     def _save_source(self, chunk: Chunk, source, language):
         with open(os.path.join(chunk.absdir, language.source_file), "w") as fp:
             fp.write(source)
 
+    def _save_artifact(self, chunk: Chunk, artifact, name="artifact"):
+        path = os.path.join(chunk.absdir, name)
+        with open(path, "wb") as fp:
+            fp.write(artifact)
+        os.chmod(path, 0o755)
+
+    def _load_artifact(self, chunk: Chunk, name="artifact"):
+        with open(os.path.join(chunk.absdir, name), "rb") as fp:
+            return fp.read()
+
     def _check_source(self, langid, source, uid):
         """Check if the language id provided is supported by this engine, and decodes the source
-        code from base64"""
+        code from base64. Raises CompileTimeError for unsupported languages."""
 
-        langid = langid.lower()
-        language = self.languages.get(langid)
+        language = self.languages.get((langid or "").lower())
 
         if language is None:
-            logging.error("Unsupported language")
-            self.signal("build", uid, None, "fail", errors="Unsupported language")
-            return None, None
+            logging.error(f"Unsupported language {langid}")
+            raise CompileTimeError(f"Unsupported language {langid}")
 
         source = base64.b64decode(source).decode("utf-8")
         return source, language
 
-    def compile(self, langid: str, source: str, uid: str, *args, **kwargs):
-        """Compile a source. Create container, and start compile process."""
-        chunk = Chunk(uid, self.workingdir)
+    def _build(self, chunk: Chunk, langid, source, uid):
+        """Put the artifact of source in chunk, from the cache or compiling it. On failure the chunk is
+        removed and CompileTimeError raised."""
         source, language = self._check_source(langid, source, uid)
-        self._save_source(chunk, source, language)
 
-        errors = None
+        key = ArtifactCache.key(language, source)
+        cached = self.cache.get(key)
+        if cached is not None:
+            logging.debug(f"Artifact cache hit for {uid}")
 
-        worker = language.get_compiler(self.client, chunk.absdir)
-        if not worker:
-            raise ValueError("Cannot create worker compiler")
+            if cached.errors is not None:
+                chunk.remove()
+                raise CompileTimeError(cached.errors)
 
-        try:
-            worker.start()
-            exit = worker.wait()
-            logging.debug(f"Completed")
+            self._save_artifact(chunk, cached.artifact)
+            return
 
-            if exit["StatusCode"] != 0:
-                errors = worker.logs(stdout=False, stderr=True).decode('utf-8')
+        self._save_source(chunk, source, language)
 
-        except Exception as e:
-            print(e)
+        with span("compile"):
+            errors = self.sandbox.compile(chunk.absdir, language)
 
-        finally:
-            worker.remove()
-        
         if errors is None:
-            return chunk.absdir
+            if os.path.exists(os.path.join(chunk.absdir, "artifact")):
+                self.cache.put(key, CompileResult(artifact=self._load_artifact(chunk)))
         
         else:
+            self._cache_errors(key, errors)
             chunk.remove()
             raise CompileTimeError(errors)
-    
-    def _put_tests_file(self, chunk, tests):
-        with open(os.path.join(chunk, "tests.txt"), "w") as fp:
-            json.dump(tests, fp)
-
-    def test(self, chunk, uid, tests, timeout=0, memlimit=0):
-        """Test compiled binary against private test cases."""
-
-        self._put_tests_file(chunk, tests)
-
-        solver_volumes =  {chunk: {'bind': "/chunk", 'mode': 'rw'}} if settings.DEBUG else {
-            "algobattles_attempts_files": {"bind": "/usr/abengine", "mode": "rw"}
-        }
-        worker = self.client.containers.create(
-            image = "algobattles-solver",
-            volumes = solver_volumes,
-            working_dir = "/chunk" if settings.DEBUG else chunk,
-            network_disabled = True,
-            command=f"python /app/solver.py {timeout} {memlimit}"
-        )
+
+    def _cache_errors(self, key, errors):
+        """Cache a failed compilation, only if the compiler reported diagnostics. Failures without any (the
+        compiler killed out of memory, a sandbox error) are transient and compiled again on resubmission."""
+        if errors.strip():
+            self.cache.put(key, CompileResult(errors=errors))
+
+    def _resolve_checker(self, checker):
+        """The custom checker of the puzzle as a (langid, source) pair. checker is either such a pair or a
+        reference to the checker of a puzzle, {"puzzle": id, "hash": digest}"""
+        if isinstance(checker, dict):
+            return self.checkers.fetch(checker["puzzle"], checker["hash"])
+
+        return checker
+
+    def _add_checker(self, chunk: Chunk, checker, uid):
+        """Compile the custom checker of the puzzle, a (langid, source) pair, into the chunk"""
+        langid, source = checker
+        checker_chunk = Chunk(f"{uid}-checker", self.workingdir)
+
+        try:
+            self._build(checker_chunk, langid, source, uid)
+        except CompileTimeError as e:
+            chunk.remove()
+            raise CompileTimeError(f"The puzzle checker does not compile:\n{e.logs}")
+        except Exception:
+            checker_chunk.remove()
+            raise
+
+        shutil.move(os.path.join(checker_chunk.absdir, "artifact"), os.path.join(chunk.absdir, "checker"))
+        checker_chunk.remove()
+
+    def _stage_checker(self, chunk: Chunk, checker, uid):
+        """Put the custom checker of the puzzle, a (langid, source) pair, in the chunk for a fused run: its
+        artifact if cached, otherwise its source, to be compiled by the solver. Returns the cache key and
+        the compile command (None when cached)."""
+        langid, source = checker
+        try:
+            source, language = self._check_source(langid, source, uid)
+        except CompileTimeError as e:
+            raise CompileTimeError(f"The puzzle checker does not compile:\n{e.logs}")
+
+        key = ArtifactCache.key(language, source)
+        cached = self.cache.get(key)
+        if cached is not None and cached.errors is not None:
+            raise CompileTimeError(f"The puzzle checker does not compile:\n{cached.errors}")
+
+        if cached is not None:
+            self._save_artifact(chunk, cached.artifact, "checker")
+            return key, None
+
+        os.mkdir(os.path.join(chunk.absdir, CHECKER_BUILD_DIR))
+        with open(os.path.join(chunk.absdir, CHECKER_BUILD_DIR, language.source_file), "w") as fp:
+            fp.write(source)
+
+        return key, language.compile_command
+
+    def compile(self, langid: str, source: str, uid: str, checker=None, *args, **kwargs):
+        """Compile a source. Create container, and start compile process.
+        
+        Identical sources are served from the artifact cache without starting any container.
+        If the puzzle has a custom checker, it is compiled in the same chunk."""
+        chunk = self._new_chunk(uid)
 
         try:
-            worker.start()
-            exit = worker.wait()
-            logging.debug(f"Completed")
-            if exit["StatusCode"] == 0:
-                results = worker.logs(stdout=True, stderr=False).decode('utf-8')
-                logging.info(worker.logs(stderr=True, stdout=False).decode('utf-8'))
-                ret = ("solver_success", results)
-            else:
-                logs = worker.logs(stdout=False, stderr=True).decode('utf-8')
-                ret = ("solver_fail", logs)
-
-        except Exception as e:
-            logging.error(str(e))
-            ret = ("engine_fail", e)
-
-        finally:
-            worker.remove()
-            shutil.rmtree(chunk)
+            self._build(chunk, langid, source, uid)
+
+            checker = self._resolve_checker(checker)
+            if checker:
+                self._add_checker(chunk, checker, uid)
+        except Exception:
+            chunk.remove()
+            raise
+
+        return chunk.absdir
+    
+    def _put_tests(self, chunk, tests):
+        """Put the tests under the tests directory of the chunk. tests is either a list of (id, input, output)
+        or a reference to a stored test set, {"puzzle": id, "hash": digest}"""
+        testsdir = os.path.join(chunk, "tests")
+        os.mkdir(testsdir)
+
+        if isinstance(tests, dict):
+            copy_tests(self.testsets.fetch(tests["puzzle"], tests["hash"]), testsdir)
+        else:
+            write_tests(testsdir, tests)
+
+    def _solver_args(self, timeout, memlimit, jobs=None, fail_fast=False, tolerance=0.0):
+        if jobs is None:
+            jobs = settings.ENGINE_SOLVER_JOBS
+
+        args = [
+            str(timeout), str(memlimit),
+            "--jobs", str(jobs),
+            "--float-tolerance", str(tolerance),
+            "--output-limit", str(settings.ENGINE_OUTPUT_LIMIT)
+        ]
+        if fail_fast:
+            args.append("--fail-fast")
+
+        return args
+
+    def test(self, chunk, uid, tests, timeout=0, memlimit=0, jobs=None, fail_fast=False, progress=None, tolerance=0.0):
+        """Test compiled binary against private test cases. Up to jobs tests are run in parallel.
+        
+        With fail_fast, testing stops at the first test not passed and the remaining ones are skipped.
+        Numbers in the output are accepted within tolerance, unless the chunk has a custom checker.
+        The progress callback, if provided, is called with a record as each test completes."""
+
+        if jobs is None:
+            jobs = settings.ENGINE_SOLVER_JOBS
+
+        # The chunk is kept if the host stays full, to be tested again when the task is retried
+        with self._admit(memlimit, jobs) as resources:
+            with span("tests"):
+                self._put_tests(chunk, tests)
+
+            try:
+                with span("solver"):
+                    status, results, logs = self.sandbox.run_solver(
+                        chunk, self._solver_args(timeout, memlimit, jobs, fail_fast, tolerance),
+                        on_line=progress_listener(progress), resources=resources
+                    )
+                if status == 0:
+                    logging.info(logs)
+                    ret = ("solver_success", solver_results(results))
+                else:
+                    ret = ("solver_fail", logs)
+
+            except Exception as e:
+                logging.error(str(e))
+                ret = ("engine_fail", e)
+
+            finally:
+                shutil.rmtree(chunk)
 
         return ret
+
+    def build_and_test(self, langid: str, source: str, uid: str, tests, timeout=0, memlimit=0, jobs=None, fail_fast=False,
+                       progress=None, tolerance=0.0, checker=None):
+        """Compile and test in a single sandbox run (with Docker, one container of the sandbox image, which
+        holds both the toolchain and the solver). The custom checker of the puzzle, if any, is compiled in
+        the same run. Raises CompileTimeError like compile, otherwise returns the same results as test."""
+
+        if jobs is None:
+            jobs = settings.ENGINE_SOLVER_JOBS
+
+        # Resources are reserved before creating the chunk, nothing is left behind if the host stays full
+        with self._admit(memlimit, jobs) as resources:
+            chunk = self._new_chunk(uid)
+
+            try:
+                source, language = self._check_source(langid, source, uid)
+
+                key = ArtifactCache.key(language, source)
+                cached = self.cache.get(key)
+                if cached is not None and cached.errors is not None:
+                    raise CompileTimeError(cached.errors)
+
+                build = None
+                if cached is not None:
+                    self._save_artifact(chunk, cached.artifact)
+                else:
+                    self._save_source(chunk, source, language)
+                    build = language.compile_command
+
+                checker_key, build_checker = None, None
+                checker = self._resolve_checker(checker)
+                if checker:
+                    checker_key, build_checker = self._stage_checker(chunk, checker, uid)
+
+                with span("tests"):
+                    self._put_tests(chunk.absdir, tests)
+            except Exception:
+                chunk.remove()
+                raise
+
+            errors = None
+            try:
+                with span("solver", fused="true"):
+                    status, results, logs = self.sandbox.run_solver(
+                        chunk.absdir, self._solver_args(timeout, memlimit, jobs, fail_fast, tolerance), build,
+                        on_line=progress_listener(progress), resources=resources, build_checker=build_checker
+                    )
+                if status == 0:
+                    logging.info(logs)
+                    ret = ("solver_success", solver_results(results))
+                elif status == BUILD_FAILED_STATUS:
+                    errors = logs
+                elif status == CHECKER_BUILD_FAILED_STATUS:
+                    errors = f"The puzzle checker does not compile:\n{logs}"
+                else:
+                    ret = ("solver_fail", logs)
+
+                if cached is None:
+                    if status == BUILD_FAILED_STATUS:
+                        self._cache_errors(key, logs)
+                    elif os.path.exists(os.path.join(chunk.absdir, "artifact")):
+                        self.cache.put(key, CompileResult(artifact=self._load_artifact(chunk)))
+
+                if build_checker is not None and status != BUILD_FAILED_STATUS:
+                    if status == CHECKER_BUILD_FAILED_STATUS:
+                        self._cache_errors(checker_key, logs)
+                    elif os.path.exists(os.path.join(chunk.absdir, "checker")):
+                        self.cache.put(checker_key, CompileResult(artifact=self._load_artifact(chunk, "checker")))
+
+            except Exception as e:
+                logging.error(str(e))
+                ret = ("engine_fail", e)
+
+            finally:
+                chunk.remove()
+
+            if errors is not None:
+                raise CompileTimeError(errors)
+
+            return ret
     
     @classmethod
     def get_instance(cls):
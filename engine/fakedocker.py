@@ -0,0 +1,164 @@
+"""
+In-process stand-in for the Docker client, used by the engine benchmark.
+
+Fake containers do not run anything: each lifecycle call sleeps for a configurable cost and the effects of
+a run are simulated on the chunk. Compilers leave an artifact, the solver reports every test as passed.
+Archives put in a container are extracted in a private temporary directory, standing for its filesystem.
+"""
+
+import io
+import os
+import json
+import shutil
+import tarfile
+import tempfile
+import time
+import random
+import uuid
+from collections import namedtuple
+
+ExecResult = namedtuple("ExecResult", "exit_code,output")
+
+SOLVER_SCRIPT = "/app/solver.py"
+
+
+class FakeContainer():
+    def __init__(self, client, image, command, volumes=None, working_dir=None, **kwargs):
+        self.client = client
+        self.id = uuid.uuid4().hex[:12]
+        self.image = image
+        self.command = command
+        self.volumes = volumes or {}
+        self.working_dir = working_dir
+        self.status = "created"
+        self.stdout = b""
+        self.root = None
+
+    def _host_path(self, path):
+        """Translate a path in the container to the path of the bound host directory"""
+        for host, spec in self.volumes.items():
+            bind = spec["bind"]
+            if os.path.isabs(host) and (path == bind or path.startswith(bind + "/")):
+                return host + path[len(bind):]
+
+        if self.root is not None:
+            return os.path.join(self.root, path.lstrip("/"))
+
+        return path
+
+    def put_archive(self, path, data):
+        self.client.spend("archive")
+        if self.root is None:
+            self.root = tempfile.mkdtemp(prefix="fake-container-")
+
+        with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+            tar.extractall(self._host_path(path), filter="data")
+        return True
+
+    def get_archive(self, path):
+        self.client.spend("archive")
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w") as tar:
+            tar.add(self._host_path(path), arcname=os.path.basename(path))
+
+        return iter([buffer.getvalue()]), {"name": os.path.basename(path)}
+
+    def _run(self, command, workdir):
+        self.client.spend("run")
+        workdir = self._host_path(workdir)
+        argv = command if isinstance(command, list) else command.split()
+
+        if SOLVER_SCRIPT in argv:
+            if "--build" in argv:
+                self._put_artifact(workdir)
+            if "--build-checker" in argv:
+                self._put_artifact(workdir, "checker")
+
+            with open(os.path.join(workdir, "tests", "index.json")) as fp:
+                tests = json.load(fp)
+            return (json.dumps({str(i): "passed" for i in tests}) + "\n").encode()
+
+        self._put_artifact(workdir)
+        return b""
+
+    @staticmethod
+    def _put_artifact(workdir, name="artifact"):
+        with open(os.path.join(workdir, name), "wb") as fp:
+            fp.write(b"")
+
+    def start(self):
+        self.client.spend("start")
+        self.status = "running"
+
+    def wait(self):
+        if self.status == "exited":
+            return {"StatusCode": 0}
+
+        self.stdout = self._run(self.command, self.working_dir)
+        self.status = "exited"
+        return {"StatusCode": 0}
+
+    def logs(self, stdout=True, stderr=True, stream=False, follow=False):
+        self.client.spend("logs")
+        data = self.stdout if stdout else b""
+
+        if stream:
+            if follow and self.status == "running":
+                self.wait()
+                data = self.stdout if stdout else b""
+            return iter([data])
+
+        return data
+
+    def exec_run(self, cmd, workdir=None, demux=False):
+        if isinstance(cmd, list) and cmd[:2] == ["sh", "-c"]:
+            cmd = cmd[2]
+
+        output = b""
+        if workdir is not None:
+            output = self._run(cmd, workdir)
+
+        return ExecResult(0, (output, b"") if demux else output)
+
+    def reload(self):
+        pass
+
+    def remove(self, force=False):
+        self.client.spend("remove")
+        self.status = "removed"
+        if self.root is not None:
+            shutil.rmtree(self.root, ignore_errors=True)
+
+
+class FakeContainers():
+    def __init__(self, client):
+        self.client = client
+
+    def create(self, image, command=None, **kwargs):
+        self.client.spend("create")
+        return FakeContainer(self.client, image, command, **kwargs)
+
+
+class FakeDockerClient():
+    """Docker client whose containers sleep for cost seconds at each lifecycle step, give or take jitter
+    (a fraction of the cost)"""
+
+    DEFAULT_COSTS = {
+        "create": 0.03,
+        "start": 0.25,
+        "run": 0.05,
+        "logs": 0.005,
+        "archive": 0.005,
+        "remove": 0.04,
+    }
+
+    def __init__(self, costs=None, jitter=0.2, seed=None):
+        self.costs = {**self.DEFAULT_COSTS, **(costs or {})}
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.containers = FakeContainers(self)
+
+    def spend(self, step):
+        cost = self.costs.get(step, 0)
+        if cost > 0:
+            time.sleep(cost * (1 + self.random.uniform(-self.jitter, self.jitter)))
@@ -1,14 +1,31 @@
+import os
 from docker.models.containers import Container
 from AlgoBattles import settings
 
+def workdir_volumes():
+    """Volumes exposing the whole engine working directory at the same path it has on the worker,
+    so that chunk paths are valid inside long-lived containers. None in archive mode, where chunks are copied
+    into the containers."""
+
+    if settings.ENGINE_ARCHIVE_TRANSFER:
+        return None
+
+    if settings.DEBUG:
+        workdir = os.path.abspath(settings.ENGINE_WORKDIR)
+        return {workdir: {'bind': workdir, 'mode': 'rw'}}
+
+    return {"algobattles_attempts_files": {'bind': "/usr/abengine", 'mode': 'rw'}}
+
 class Language():
     """This class defines a supported language, with its extension and the command
     to create a container with its compiler"""
 
-    def __init__(self, name, extension):
+    def __init__(self, name, extension, compile_command=""):
         self.name = name
         self.extension = extension
+        self.compile_command = compile_command
         self.default_filename = "source"
+        self.image = None
     
     @property
     def source_file(self):
@@ -17,23 +34,34 @@ class Language():
     def get_compiler(self, docker) -> Container:
         pass
 
+    def get_pooled_compiler(self, docker, scratch) -> Container:
+        """Create a long-lived compiler container, idling until builds are run in it with exec"""
+        return docker.containers.create(
+            image = self.image,
+            command = ["sleep", "infinity"],
+            volumes = workdir_volumes(),
+            environment = {"TMPDIR": scratch},
+            network_disabled = True
+        )
+
 class C(Language):
     def __init__(self):
-        super().__init__("c", ".c")
+        super().__init__("c", ".c", "gcc -o artifact source.c")
+        self.image = "gcc:11"
 
     def get_compiler(self, docker, chunk) -> Container:
         if settings.DEBUG:
             return docker.containers.create(
-                image = "gcc:11",
-                command = "gcc -o artifact source.c",
+                image = self.image,
+                command = self.compile_command,
                 volumes = {chunk: {'bind': "/chunk", 'mode': 'rw'}},
                 working_dir = "/chunk",
                 network_disabled = True
             )
         
         return docker.containers.create(
-            image = "gcc:11",
-            command = "gcc -o artifact source.c",
+            image = self.image,
+            command = self.compile_command,
             volumes = {"algobattles_attempts_files": {'bind': "/usr/abengine", 'mode': 'rw'}},
             working_dir = chunk,
             network_disabled = True
@@ -41,21 +69,22 @@ class C(Language):
     
 class Cpp(Language):
     def __init__(self):
-        super().__init__("c++", ".cpp")
+        super().__init__("c++", ".cpp", "g++ -fpermissive -o artifact source.cpp")
+        self.image = "gcc:11"
 
     def get_compiler(self, docker, chunk) -> Container:
         if settings.DEBUG:
             return docker.containers.create(
-                image = "gcc:11",
-                command = "g++ -fpermissive -o artifact source.cpp",
+                image = self.image,
+                command = self.compile_command,
                 volumes = {chunk: {'bind': "/chunk", 'mode': 'rw'}},
                 working_dir = "/chunk",
                 network_disabled = True
             )
     
         return docker.containers.create(
-            image = "gcc:11",
-            command = "g++ -fpermissive -o artifact source.cpp",
+            image = self.image,
+            command = self.compile_command,
             volumes = {"algobattles_attempts_files": {'bind': "/usr/abengine", 'mode': 'rw'}},
             working_dir = chunk,
             network_disabled = True
@@ -65,11 +94,13 @@ class Java(Language):
     def __init__(self):
         super().__init__("java", ".java")
         self.default_filename = "Main"
+        self.compile_command = f"javac {self.source_file}"
+        self.image = "eclipse-temurin:latest"
 
     def get_compiler(self, docker, chunk) -> Container:
         return docker.containers.create(
-            image = "eclipse-temurin:latest",
-            command = f"javac {self.source_file}",
+            image = self.image,
+            command = self.compile_command,
             volumes = {chunk: {'bind': "/chunk", 'mode': 'rw'}},
             working_dir = "/chunk",
             network_disabled = True
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+
+from engine.benchmark import Benchmark, PHASES
+from engine.fakedocker import FakeDockerClient
+
+
+class Command(BaseCommand):
+    help = "Benchmark the judge pipeline, reporting latency percentiles by phase and attempts per second"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--attempts", type=int, default=100)
+        parser.add_argument("--concurrency", type=int, default=4)
+        parser.add_argument("--tests", type=int, default=10, help="Number of tests of each attempt")
+        parser.add_argument("--mode", choices=["engine", "chain"], default="engine",
+                            help="Call the engine in process, or submit chains to the Celery workers")
+        parser.add_argument("--docker", choices=["fake", "real"], default="fake")
+        parser.add_argument("--reuse-source", action="store_true", help="Submit the same source, hitting the artifact cache")
+        for step, cost in FakeDockerClient.DEFAULT_COSTS.items():
+            parser.add_argument(f"--fake-{step}", type=float, default=cost, help=f"Seconds spent by fake containers on {step}")
+        parser.add_argument("--fake-jitter", type=float, default=0.2)
+        parser.add_argument("--seed", type=int, default=None)
+
+    def handle(self, *args, **options):
+        client = None
+        if options["docker"] == "fake":
+            costs = {step: options[f"fake_{step}"] for step in FakeDockerClient.DEFAULT_COSTS}
+            client = FakeDockerClient(costs, options["fake_jitter"], options["seed"])
+
+        report = Benchmark(
+            client,
+            attempts=options["attempts"],
+            concurrency=options["concurrency"],
+            tests=options["tests"],
+            mode=options["mode"],
+            reuse_source=options["reuse_source"],
+        ).run()
+
+        self.stdout.write(
+            f"{report['attempts']} attempts ({report['errors']} errors) at concurrency {report['concurrency']} "
+            f"in {report['elapsed']:.2f} s: {report['throughput']:.2f} attempts/s"
+        )
+        self.stdout.write(f"{'phase':<10}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for phase in PHASES:
+            stats = report["phases"].get(phase)
+            if stats:
+                self.stdout.write(
+                    f"{phase:<10}{stats['count']:>8}{stats['p50'] * 1000:>10.1f}{stats['p95'] * 1000:>10.1f}{stats['p99'] * 1000:>10.1f}"
+                )
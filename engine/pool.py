@@ -0,0 +1,180 @@
+"""
+Warm pool of long-lived compiler containers.
+
+Instead of creating and removing a `gcc` container for every build, the engine keeps a few idle,
+network-disabled containers per language and runs each build through `exec` inside one of them.
+Between jobs the pool resets the container scratch directory and checks that it is still usable;
+broken containers are removed and replaced, idle ones above the minimum size are reaped.
+"""
+
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+from docker.models.containers import Container
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class _Slot():
+    def __init__(self, container: Container):
+        self.container = container
+        self.last_used = time.monotonic()
+
+
+class CompilerPool():
+    """Pool of compiler containers for a single language"""
+
+    SCRATCH_DIR = "/scratch"
+
+    def __init__(self, client, language, min_size=1, max_size=4, idle_timeout=300):
+        self.client = client
+        self.language = language
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size, 1)
+        self.idle_timeout = idle_timeout
+
+        self.__idle = []
+        self.__size = 0
+        self.__cond = threading.Condition()
+
+    @property
+    def size(self):
+        return self.__size
+
+    def _create(self) -> _Slot:
+        container = self.language.get_pooled_compiler(self.client, self.SCRATCH_DIR)
+        container.start()
+        return _Slot(container)
+
+    def _destroy(self, slot: _Slot):
+        try:
+            slot.container.remove(force=True)
+        except Exception as e:
+            logging.warning(f"Cannot remove pooled compiler {slot.container.id}: {e}")
+
+    def _is_healthy(self, slot: _Slot):
+        try:
+            slot.container.reload()
+            return slot.container.status == "running"
+        except Exception:
+            return False
+
+    def _reset(self, slot: _Slot):
+        """Wipe the scratch directory used by the compiler. Doubles as an health check."""
+        try:
+            res = slot.container.exec_run(
+                ["sh", "-c", f"rm -rf {self.SCRATCH_DIR} && mkdir -p {self.SCRATCH_DIR}"]
+            )
+            return res.exit_code == 0
+        except Exception:
+            return False
+
+    def warm(self):
+        """Create containers until the pool reaches its minimum size"""
+        while True:
+            with self.__cond:
+                if self.__size >= self.min_size:
+                    return
+                self.__size += 1
+
+            try:
+                slot = self._create()
+            except Exception:
+                with self.__cond:
+                    self.__size -= 1
+                    self.__cond.notify()
+                raise
+
+            with self.__cond:
+                self.__idle.append(slot)
+                self.__cond.notify()
+
+    def acquire(self, timeout=None) -> _Slot:
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            with self.__cond:
+                while not self.__idle and self.__size >= self.max_size:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise PoolExhausted(f"No {self.language.name} compiler available")
+                    self.__cond.wait(remaining)
+
+                if self.__idle:
+                    slot = self.__idle.pop()
+                else:
+                    slot = None
+                    self.__size += 1
+
+            if slot is None:
+                try:
+                    return self._create()
+                except Exception:
+                    with self.__cond:
+                        self.__size -= 1
+                        self.__cond.notify()
+                    raise
+
+            if self._is_healthy(slot):
+                return slot
+
+            logging.warning(f"Replacing broken {self.language.name} compiler {slot.container.id}")
+            self._discard(slot)
+
+    def release(self, slot: _Slot, healthy=True):
+        if healthy and self._reset(slot):
+            slot.last_used = time.monotonic()
+            with self.__cond:
+                self.__idle.append(slot)
+                self.__cond.notify()
+        else:
+            self._discard(slot)
+
+        self.reap()
+
+    def _discard(self, slot: _Slot):
+        self._destroy(slot)
+        with self.__cond:
+            self.__size -= 1
+            self.__cond.notify()
+
+    @contextmanager
+    def lease(self, timeout=None):
+        slot = self.acquire(timeout)
+        healthy = True
+        try:
+            yield slot.container
+        except Exception:
+            healthy = False
+            raise
+        finally:
+            self.release(slot, healthy)
+
+    def reap(self):
+        """Remove containers idle for longer than idle_timeout, keeping at least min_size"""
+        now = time.monotonic()
+        reaped = []
+
+        with self.__cond:
+            for slot in list(self.__idle):
+                if self.__size - len(reaped) <= self.min_size:
+                    break
+                if now - slot.last_used > self.idle_timeout:
+                    self.__idle.remove(slot)
+                    reaped.append(slot)
+            self.__size -= len(reaped)
+
+        for slot in reaped:
+            self._destroy(slot)
+
+    def shutdown(self):
+        with self.__cond:
+            idle, self.__idle = self.__idle, []
+            self.__size -= len(idle)
+
+        for slot in idle:
+            self._destroy(slot)
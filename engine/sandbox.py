@@ -0,0 +1,421 @@
+"""
+Sandbox backends used by the engine to compile sources and run the solver on a chunk.
+
+DockerSandbox runs every step in a container (the default). Chunks are shared with containers through a
+volume or, in archive mode, copied in and out of them as in-memory tar archives, so that containers need no
+filesystem shared with the worker and the Docker daemon may be remote. LocalSandbox runs the compiler and the solver
+as local subprocesses, confined with resource limits and with bubblewrap in fresh namespaces without network
+access. It is meant for trusted worker hosts and for machines without a Docker daemon.
+"""
+
+import io
+import os
+import sys
+import tarfile
+import shutil
+import logging
+import resource
+import threading
+import subprocess
+
+from .pool import CompilerPool, PoolExhausted
+
+from AlgoBattles import settings
+
+
+class SandboxUnavailable(Exception):
+    pass
+
+
+class Sandbox():
+    """Interface of an environment where attempts are compiled and tested"""
+
+    def compile(self, chunk, language):
+        """Compile the source saved in chunk. Returns the compiler errors, or None on success"""
+        raise NotImplementedError
+
+    def run_solver(self, chunk, args, build=None, on_line=None, resources=None, build_checker=None):
+        """Run the solver with args on chunk, compiling it first with the build command if provided, and the
+        checker with the build_checker command. Returns the exit status code, stdout and stderr of the solver.
+        
+        If on_line is provided, it is called with each line of stdout as soon as the solver prints it.
+        resources is the Demand reserved for the run by admission control, if any: backends may confine
+        the solver to it."""
+        raise NotImplementedError
+
+
+class LineSplitter():
+    """Calls a function with each complete line of a byte stream received in arbitrary chunks"""
+
+    def __init__(self, on_line):
+        self.on_line = on_line
+        self.buffer = b""
+
+    def feed(self, data):
+        self.buffer += data
+        *lines, self.buffer = self.buffer.split(b"\n")
+        for line in lines:
+            self.on_line(line.decode('utf-8'))
+
+    def close(self):
+        if self.buffer:
+            self.on_line(self.buffer.decode('utf-8'))
+            self.buffer = b""
+
+
+def pack(directory, arcname) -> bytes:
+    """Tar archive of directory, whose entries are rooted at arcname"""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        tar.add(directory, arcname=arcname)
+
+    return buffer.getvalue()
+
+def unpack(bits, directory):
+    """Extract an archive returned by get_archive into directory"""
+    with tarfile.open(fileobj=io.BytesIO(b"".join(bits))) as tar:
+        tar.extractall(directory, filter="data")
+
+
+class DockerSandbox(Sandbox):
+    # Exists in every image, archives are extracted in a chunk directory under it
+    ARCHIVE_ROOT = "/tmp"
+
+    def __init__(self, client=None, archive=None):
+        if client is None:
+            import docker
+            client = docker.from_env()
+
+        self.client = client
+        self.pools = {}
+        self.archive = settings.ENGINE_ARCHIVE_TRANSFER if archive is None else archive
+
+    @property
+    def archive_chunk(self):
+        return f"{self.ARCHIVE_ROOT}/chunk"
+
+    def _fetch_artifact(self, worker, path, chunk):
+        bits, _ = worker.get_archive(path)
+        unpack(bits, chunk)
+
+    def get_pool(self, language) -> CompilerPool:
+        """Returns the warm pool of compiler containers for a language, creating it on first use"""
+        pool = self.pools.get(language.name)
+
+        if pool is None:
+            pool = CompilerPool(
+                self.client,
+                language,
+                min_size=settings.ENGINE_POOL_MIN_SIZE,
+                max_size=settings.ENGINE_POOL_MAX_SIZE,
+                idle_timeout=settings.ENGINE_POOL_IDLE_TIMEOUT
+            )
+            pool = self.pools.setdefault(language.name, pool)
+            pool.warm()
+
+        return pool
+
+    def _compile_oneshot(self, chunk, language):
+        """Compile in a dedicated container, removed afterwards"""
+        errors = None
+
+        if self.archive:
+            worker = self.client.containers.create(
+                image = language.image,
+                command = ["sh", "-c", language.compile_command],
+                working_dir = self.archive_chunk,
+                network_disabled = True
+            )
+        else:
+            worker = language.get_compiler(self.client, chunk)
+
+        if not worker:
+            raise ValueError("Cannot create worker compiler")
+
+        try:
+            if self.archive:
+                worker.put_archive(self.ARCHIVE_ROOT, pack(chunk, "chunk"))
+
+            worker.start()
+            exit = worker.wait()
+            logging.debug(f"Compiled {language.name} in a one-shot container, exit status {exit['StatusCode']}")
+
+            if exit["StatusCode"] != 0:
+                errors = worker.logs(stdout=False, stderr=True).decode('utf-8')
+            elif self.archive:
+                self._fetch_artifact(worker, f"{self.archive_chunk}/artifact", chunk)
+
+        except Exception:
+            logging.exception("Compilation failed")
+
+        finally:
+            worker.remove()
+
+        return errors
+
+    def _compile_pooled(self, chunk, language):
+        """Compile with exec inside a warm container of the pool"""
+        errors = None
+
+        try:
+            with self.get_pool(language).lease(settings.ENGINE_POOL_ACQUIRE_TIMEOUT) as worker:
+                workdir = chunk
+                if self.archive:
+                    # The scratch directory is wiped when the container is returned to the pool
+                    workdir = f"{CompilerPool.SCRATCH_DIR}/{os.path.basename(chunk)}"
+                    worker.put_archive("/", pack(chunk, workdir.lstrip("/")))
+
+                res = worker.exec_run(["sh", "-c", language.compile_command], workdir=workdir, demux=True)
+                logging.debug(f"Compiled {language.name} in a pooled container, exit status {res.exit_code}")
+
+                if res.exit_code != 0:
+                    _, stderr = res.output
+                    errors = (stderr or b"").decode('utf-8')
+                elif self.archive:
+                    self._fetch_artifact(worker, f"{workdir}/artifact", chunk)
+
+        except PoolExhausted:
+            # Retried by the build task, rather than reported as a build without artifact
+            raise
+        except Exception:
+            logging.exception("Compilation failed")
+
+        return errors
+
+    def compile(self, chunk, language):
+        if settings.ENGINE_COMPILER_POOL:
+            return self._compile_pooled(chunk, language)
+
+        return self._compile_oneshot(chunk, language)
+
+    def run_solver(self, chunk, args, build=None, on_line=None, resources=None, build_checker=None):
+        if build is None and build_checker is None:
+            image, command = "algobattles-solver", ["python", "/app/solver.py", *args]
+        else:
+            image, command = "algobattles-sandbox", ["python3", "/app/solver.py", *args]
+            if build is not None:
+                command += ["--build", build]
+            if build_checker is not None:
+                command += ["--build-checker", build_checker]
+
+        if self.archive:
+            solver_volumes, working_dir = None, self.archive_chunk
+        elif settings.DEBUG:
+            solver_volumes, working_dir = {chunk: {'bind': "/chunk", 'mode': 'rw'}}, "/chunk"
+        else:
+            solver_volumes, working_dir = {"algobattles_attempts_files": {"bind": "/usr/abengine", "mode": "rw"}}, chunk
+
+        limits = {}
+        if resources is not None:
+            limits = {"mem_limit": resources.memory, "nano_cpus": int(resources.cpus * 1e9)}
+
+        worker = self.client.containers.create(
+            image = image,
+            volumes = solver_volumes,
+            working_dir = working_dir,
+            network_disabled = True,
+            command = command,
+            **limits
+        )
+
+        try:
+            if self.archive:
+                worker.put_archive(self.ARCHIVE_ROOT, pack(chunk, "chunk"))
+
+            worker.start()
+
+            if on_line is not None:
+                lines = LineSplitter(on_line)
+                for data in worker.logs(stdout=True, stderr=False, stream=True, follow=True):
+                    lines.feed(data)
+                lines.close()
+
+            exit = worker.wait()
+            logging.debug(f"Solver container of {image} exited with status {exit['StatusCode']}")
+
+            stdout = worker.logs(stdout=True, stderr=False).decode('utf-8')
+            stderr = worker.logs(stdout=False, stderr=True).decode('utf-8')
+
+            if self.archive and exit["StatusCode"] == 0:
+                # Bring the artifacts built in the sandbox back, for the artifact cache
+                built = [name for name, command in (("artifact", build), ("checker", build_checker)) if command]
+                for name in built:
+                    try:
+                        self._fetch_artifact(worker, f"{self.archive_chunk}/{name}", chunk)
+                    except Exception as e:
+                        logging.warning(f"Cannot fetch {name}: {e}")
+
+            return exit["StatusCode"], stdout, stderr
+
+        finally:
+            worker.remove()
+
+
+class LocalSandbox(Sandbox):
+    """Runs the compiler and the solver as local subprocesses.
+
+    Each process gets rlimits on CPU time, address space, file size, open files and core dumps, and a minimal
+    environment. Processes run with bubblewrap (bwrap) in new user, pid, ipc, uts and network namespaces, seeing
+    only read-only toolchain and runtime directories and their chunk, the only writable place. Without bwrap,
+    the sandbox is refused unless settings.ENGINE_LOCAL_UNCONFINED explicitly allows running unconfined.
+    """
+
+    SOLVER = os.path.join(settings.BASE_DIR, "solver", "solver.py")
+
+    # Mounted read-only in the sandbox, when they exist
+    SYSTEM_DIRS = ("/usr", "/bin", "/sbin", "/lib", "/lib32", "/lib64", "/etc/alternatives", "/etc/ld.so.cache")
+
+    COMPILE_LIMITS = {
+        resource.RLIMIT_CPU: 30,
+        resource.RLIMIT_AS: 2 * 1024 ** 3,
+        resource.RLIMIT_FSIZE: 64 * 1024 ** 2,
+        resource.RLIMIT_NOFILE: 256,
+        resource.RLIMIT_CORE: 0,
+    }
+
+    SOLVER_LIMITS = {
+        resource.RLIMIT_CPU: 600,
+        resource.RLIMIT_FSIZE: 64 * 1024 ** 2,
+        resource.RLIMIT_NOFILE: 256,
+        resource.RLIMIT_CORE: 0,
+    }
+
+    def __init__(self, use_bwrap=None):
+        if use_bwrap is None:
+            use_bwrap = shutil.which("bwrap") is not None
+
+            if not use_bwrap:
+                if not settings.ENGINE_LOCAL_UNCONFINED:
+                    raise SandboxUnavailable(
+                        "bwrap is not installed, set ALGOBATTLES_ENGINE_LOCAL_UNCONFINED to run attempts unconfined"
+                    )
+                logging.warning("bwrap is not installed, attempts run unconfined")
+
+        self.use_bwrap = use_bwrap
+
+    @property
+    def environment(self):
+        """The only environment variables of sandboxed processes"""
+        return {
+            "PATH": f"{os.path.dirname(sys.executable)}:/usr/local/bin:/usr/bin:/bin",
+            "HOME": "/tmp",
+            "LANG": "C.UTF-8",
+        }
+
+    def _mounts(self):
+        """Read-only mounts of the toolchain, the Python runtime and the solver"""
+        mounts = []
+        for path in self.SYSTEM_DIRS:
+            if os.path.islink(path):
+                mounts += ["--symlink", os.readlink(path), path]
+            else:
+                mounts += ["--ro-bind-try", path, path]
+
+        for path in {sys.base_prefix, sys.prefix, os.path.dirname(self.SOLVER)}:
+            if not path.startswith("/usr/"):
+                mounts += ["--ro-bind", path, path]
+
+        return mounts
+
+    @staticmethod
+    def _limiter(limits):
+        def set_limits():
+            os.setsid()
+            for res, value in limits.items():
+                resource.setrlimit(res, (value, value))
+
+        return set_limits
+
+    def _confine(self, chunk, argv):
+        if not self.use_bwrap:
+            return argv
+
+        env = [arg for name, value in self.environment.items() for arg in ("--setenv", name, value)]
+
+        return [
+            "bwrap",
+            "--unshare-all",
+            "--die-with-parent",
+            "--new-session",
+            "--clearenv",
+            *env,
+            *self._mounts(),
+            "--dev", "/dev",
+            "--proc", "/proc",
+            "--tmpfs", "/tmp",
+            "--bind", chunk, chunk,
+            "--chdir", chunk,
+            *argv
+        ]
+
+    def _run(self, chunk, argv, limits, timeout):
+        result = subprocess.run(
+            self._confine(chunk, argv),
+            cwd=chunk,
+            stdin=subprocess.DEVNULL,
+            capture_output=True,
+            env=self.environment,
+            preexec_fn=self._limiter(limits),
+            timeout=timeout
+        )
+
+        return result.returncode, result.stdout.decode('utf-8'), result.stderr.decode('utf-8')
+
+    def compile(self, chunk, language):
+        status, _, stderr = self._run(
+            chunk, ["sh", "-c", language.compile_command], self.COMPILE_LIMITS, settings.ENGINE_LOCAL_COMPILE_TIMEOUT
+        )
+        logging.debug(f"Compiled {language.name} locally, exit status {status}")
+
+        return stderr if status != 0 else None
+
+    def run_solver(self, chunk, args, build=None, on_line=None, resources=None, build_checker=None):
+        argv = [sys.executable, self.SOLVER, *args]
+        if build is not None:
+            argv += ["--build", build]
+        if build_checker is not None:
+            argv += ["--build-checker", build_checker]
+
+        if on_line is None:
+            status, stdout, stderr = self._run(chunk, argv, self.SOLVER_LIMITS, None)
+            logging.debug(f"Local solver exited with status {status}")
+            return status, stdout, stderr
+
+        process = subprocess.Popen(
+            self._confine(chunk, argv),
+            cwd=chunk,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=self.environment,
+            preexec_fn=self._limiter(self.SOLVER_LIMITS),
+            text=True
+        )
+
+        errors = []
+        stderr_reader = threading.Thread(target=lambda: errors.append(process.stderr.read()), daemon=True)
+        stderr_reader.start()
+
+        stdout = []
+        for line in process.stdout:
+            stdout.append(line)
+            on_line(line.rstrip("\n"))
+
+        status = process.wait()
+        stderr_reader.join()
+        logging.debug(f"Local solver exited with status {status}")
+
+        return status, "".join(stdout), "".join(errors)
+
+
+def get_sandbox(name) -> Sandbox:
+    """Instantiate the sandbox backend configured by name"""
+    backends = {
+        "docker": DockerSandbox,
+        "local": LocalSandbox,
+    }
+
+    if name not in backends:
+        raise ValueError(f"Unknown engine sandbox {name}")
+
+    return backends[name]()
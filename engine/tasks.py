@@ -1,44 +1,160 @@
 from celery import shared_task
 from celery.exceptions import Ignore
-from celery.signals import task_postrun
+from celery.signals import task_postrun, worker_ready, worker_shutdown
 from django.db import transaction
 from django_celery_results.models import TaskResult
 from puzzle.models import Attempt
+from puzzle.notify import send_attempt_event
+from puzzle.serializers import AttemptListSerializer
+from puzzle import states
 from .engine import Engine, CompileTimeError
+from .workspace import WorkspaceFull, Reaper
+from .admission import AdmissionTimeout
+from .pool import PoolExhausted
+from AlgoBattles import settings
+from AlgoBattles.celery import worker_queue
+from utils.metrics import span
 import json
 import logging
 
-@shared_task(bind=True)
-def build(self, language, source, uid):
+# Results of attempts whose task failed, e.g. after running out of retries while the host stayed full
+ENGINE_ERROR = "The attempt could not be judged, submit it again"
+
+@shared_task(bind=True, autoretry_for=(WorkspaceFull, PoolExhausted), retry_backoff=True, max_retries=5)
+def build(self, language, source, uid, checker=None):
     engine = Engine.get_instance()
+    enter_state(uid, states.COMPILING)
 
     try:
-        return engine.compile(language, source, uid)
+        with span("build_task"):
+            chunk = engine.compile(language, source, uid, checker)
     except CompileTimeError as e:
         self.update_state(state="FAILURE", meta=e.logs)
         raise Ignore()
 
-@shared_task
-def test(chunk, uid, tests, timelimit, memlimit):
+    pin_chain(self.request)
+    return chunk
+
+def pin_chain(request):
+    """Route the remaining tasks of the chain to the queue of this worker, where the chunk is"""
+    if not request.chain or not request.hostname:
+        return
+
+    for signature in request.chain:
+        signature.setdefault("options", {})["queue"] = worker_queue(request.hostname)
+
+def attempt_owner(uid):
+    known = states.get_state(uid)
+    if known is not None and known[1] is not None:
+        return known[1]
+
+    return Attempt.objects.filter(pk=uid).values_list("development__user_id", flat=True).first()
+
+def enter_state(uid, state):
+    """Advance the attempt to state as its phase starts, notifying the owner. Returns the owner."""
+    owner = attempt_owner(uid)
+    states.advance(uid, state)
+    publish(owner, uid, "attempt.state", state=state)
+    return owner
+
+def publish(owner, uid, event_type, **payload):
+    """Push an event about attempt uid to its owner. Failures are logged, they never fail judging."""
+    if owner is None:
+        return
+
+    try:
+        send_attempt_event(owner, event_type, attempt=uid, **payload)
+    except Exception as e:
+        logging.warning(f"Cannot publish {event_type} of attempt {uid}: {e}")
+
+def progress_publisher(owner, uid):
+    """Returns a callback publishing the solver progress to the owner of the attempt"""
+    if owner is None:
+        return None
+
+    def publish_progress(record):
+        publish(owner, uid, "attempt.progress", done=record["done"], passed=record["passed"], total=record["total"])
+
+    return publish_progress
+
+@shared_task(autoretry_for=(AdmissionTimeout,), retry_backoff=True, max_retries=10)
+def test(chunk, uid, tests, timelimit, memlimit, fail_fast=False, tolerance=0.0):
+    engine = Engine.get_instance()
+    owner = enter_state(uid, states.RUNNING)
+
+    with span("test_task"):
+        return engine.test(
+            chunk, uid, tests, timelimit, memlimit, fail_fast=fail_fast, progress=progress_publisher(owner, uid), tolerance=tolerance
+        )
+
+@shared_task(bind=True, autoretry_for=(WorkspaceFull, AdmissionTimeout), retry_backoff=True, max_retries=10)
+def build_and_test(self, language, source, uid, tests, timelimit, memlimit, fail_fast=False, tolerance=0.0, checker=None):
     engine = Engine.get_instance()
-    return engine.test(chunk, uid, tests, timelimit, memlimit)
+    owner = enter_state(uid, states.RUNNING)
+
+    try:
+        with span("build_and_test_task"):
+            return engine.build_and_test(
+                language, source, uid, tests, timelimit, memlimit, fail_fast=fail_fast, progress=progress_publisher(owner, uid),
+                tolerance=tolerance, checker=checker
+            )
+    except CompileTimeError as e:
+        self.update_state(state="FAILURE", meta=e.logs)
+        raise Ignore()
 
-def test_chain(language, source, uid, tests, timelimit, memlimit):
+def test_chain(language, source, uid, tests, timelimit, memlimit, fused=None, fail_fast=False, tolerance=0.0, checker=None,
+               queue=None):
     """Build and tests the provided call by running
     the build and test tasks in a chain.
+
+    tests is either a list of (id, input, output) or a reference to the test set of a puzzle, as returned by
+    engine.testsets.testset_ref. References keep messages small, workers fetch and cache the test set.
+
+    In fused mode a single build_and_test task compiles and tests in one sandbox container.
+    With fail_fast, testing stops at the first test not passed and the remaining ones are marked as skipped.
+    Outputs are compared token by token, with tolerance on numbers, or by the custom checker of the puzzle:
+    a reference to it, as returned by engine.checkers.checker_ref, or a (language, base64 source) pair.
     
+    The chain is sent to queue, by default the practice queue: challenge attempts go to
+    settings.ENGINE_CHALLENGE_QUEUE, consumed first. The chunk built by the build task is local to its
+    worker, so the test task is routed to the same worker.
+
     Returns the chain task ID. Can be used to retrieve the task result later on.
     """
 
-    chain = build.si(language, source, uid) | test.s(uid, tests, timelimit, memlimit)
-    return chain.apply_async()
+    if fused is None:
+        fused = settings.ENGINE_FUSED_SANDBOX
+
+    if queue is None:
+        queue = settings.ENGINE_PRACTICE_QUEUE
+
+    if fused:
+        return build_and_test.apply_async(
+            (language, source, uid, tests, timelimit, memlimit, fail_fast, tolerance, checker), queue=queue
+        )
+
+    chain = build.si(language, source, uid, checker) | test.s(uid, tests, timelimit, memlimit, fail_fast, tolerance)
+    return chain.apply_async(queue=queue)
 
 @task_postrun.connect
 def update_task_status(sender, task_id, task, args, kwargs, retval, state, **extra):
-    if task == build and state == "IGNORED":
+    if task not in (build, test, build_and_test):
+        return
+
+    with span("writeback"):
+        _update_attempt(task_id, task, args, retval, state)
+
+def _update_attempt(task_id, task, args, retval, state):
+    if state == "FAILURE":
+        # The attempt id follows the chunk in the arguments of test, the language and source otherwise
+        uid = args[1] if task is test else args[2]
+        logging.error(f"Attempt {uid} not judged: {retval!r}")
+        _fail_attempt(uid)
+
+    if task in (build, build_and_test) and state == "IGNORED":
         uid = args[2]
         
-        att = Attempt.objects.filter(pk=uid).first()
+        att = Attempt.objects.select_related("development").filter(pk=uid).first()
         if not att:
             return
         
@@ -51,9 +167,11 @@ def update_task_status(sender, task_id, task, args, kwargs, retval, state, **ext
             att.build_error = True
             att.save()
 
-    if task == test and state == "SUCCESS":
+        publish_result(att)
+
+    if task in (test, build_and_test) and state == "SUCCESS":
         with transaction.atomic():
-            att = Attempt.objects.filter(task_id=task_id).first()
+            att = Attempt.objects.select_related("development").filter(task_id=task_id).first()
             if not att:
                 return
 
@@ -67,3 +185,37 @@ def update_task_status(sender, task_id, task, args, kwargs, retval, state, **ext
 
             att.results = data
             att.save()
+
+        publish_result(att)
+
+def _fail_attempt(uid):
+    """Record an engine error as the result of the attempt, so that it is not left running"""
+    with transaction.atomic():
+        att = Attempt.objects.select_related("development").filter(pk=uid).first()
+        if not att:
+            return
+
+        att.build_error = True
+        att.results = ENGINE_ERROR
+        att.save()
+
+    publish_result(att)
+
+def publish_result(att: Attempt):
+    """Mark the attempt as done and push its final verdict, as returned by PollingAttemptResultView"""
+    states.advance(att.pk, states.DONE)
+    publish(att.development.user_id, str(att.pk), "attempt.result", result=AttemptListSerializer(att).data)
+
+reaper = None
+
+@worker_ready.connect
+def start_reaper(**kwargs):
+    """Reap chunks orphaned on this worker host and report its workspace usage"""
+    global reaper
+    reaper = Reaper(settings.ENGINE_WORKDIR, settings.ENGINE_CHUNK_MAX_AGE, settings.ENGINE_REAP_INTERVAL)
+    reaper.start()
+
+@worker_shutdown.connect
+def stop_reaper(**kwargs):
+    if reaper is not None:
+        reaper.stop()
@@ -1,12 +1,33 @@
-from django.test import TestCase
-from .tasks import test_chain
-from .engine import Engine
-from puzzle.models import Attempt
 import base64
 import os
 import random
-from time import sleep
-from celery.exceptions import Ignore
+import shutil
+import tempfile
+import time
+import types
+import uuid
+from unittest import mock, skipUnless
+
+import redis
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase
+
+from AlgoBattles import settings
+from puzzle.models import Attempt, Development, Puzzle, PuzzleTest
+from utils.testing import redis_available
+
+from .admission import AdmissionController, AdmissionTimeout, Demand
+from .benchmark import Benchmark, percentile
+from .cache import ArtifactCache, CompileResult
+from .checkers import CheckerStore, checker_ref
+from .engine import CompileTimeError, Engine
+from .fakedocker import FakeDockerClient
+from .language import C
+from .pool import CompilerPool, PoolExhausted
+from .sandbox import DockerSandbox, LocalSandbox, Sandbox, SandboxUnavailable, pack, unpack
+from .tasks import ENGINE_ERROR, build, build_and_test, pin_chain, publish_result, test as test_task, test_chain
+from .testsets import TestSetStore, copy_tests, digest_tests, testset_hash, testset_ref
+from .workspace import WorkspaceFull, ensure_space, reap
 
 class TestBuild(TestCase):
     def setUp(self):
@@ -33,6 +54,23 @@ class TestBuild(TestCase):
         self.assertNotEqual(chain_res.id, 0)
         self.assertTrue(chain_res.successful())
 
+    def test_fused_chain(self):
+        checktests = [(0, "input", "hello world")]
+        chain_res = test_chain("c", self.valid_c_source(), self.uid, checktests, int(1e6), int(1e10), fused=True)
+
+        chain_res.get(timeout=2)
+        solver_status, result = chain_res.result
+
+        self.assertTrue(chain_res.successful())
+        self.assertEqual(solver_status, "solver_success")
+        self.assertEqual(result, '{"0": "passed"}\n')
+
+    def test_unsupported_language(self):
+        with self.assertRaises(CompileTimeError):
+            Engine.get_instance().compile("pascal", self.valid_c_source(), self.uid)
+
+        self.assertFalse(os.path.exists(os.path.join(Engine.get_instance().workingdir, self.uid)))
+
     @staticmethod
     def timeout_c_source():
         src = """
@@ -69,3 +107,615 @@ class TestBuild(TestCase):
         self.assertEqual(solver_status, "solver_success")
         self.assertEqual(result, '{"0": "memfail"}\n')
 
+
+class TestChainAffinity(SimpleTestCase):
+    def test_pin_chain(self):
+        request = types.SimpleNamespace(chain=[{"task": "engine.tasks.test", "options": {}}], hostname="celery@node1")
+        pin_chain(request)
+
+        self.assertEqual(request.chain[0]["options"]["queue"], "engine.celery@node1")
+
+    def test_no_chain(self):
+        request = types.SimpleNamespace(chain=None, hostname="celery@node1")
+        pin_chain(request)
+
+        self.assertIsNone(request.chain)
+
+
+class TestPriorityQueues(SimpleTestCase):
+    def test_challenge_and_practice_queues(self):
+        with mock.patch.object(build_and_test, "apply_async") as apply_async:
+            test_chain("c", "", "1", [], 1, 1, fused=True)
+            test_chain("c", "", "2", [], 1, 1, fused=True, queue=settings.ENGINE_CHALLENGE_QUEUE)
+
+        queues = [call.kwargs["queue"] for call in apply_async.call_args_list]
+        self.assertEqual(queues, [settings.ENGINE_PRACTICE_QUEUE, settings.ENGINE_CHALLENGE_QUEUE])
+
+
+class TestResultPush(TestCase):
+    def test_publish_result(self):
+        user = User.objects.create_user("pusher", password="pusher")
+        puzzle = Puzzle.objects.create(
+            title="Push puzzle",
+            difficulty=Puzzle.DifficultyLevel.EASY,
+            description="A description",
+            time_constraint = 1,
+            memory_constraint = 1,
+        )
+        dev = Development.objects.create(user=user, puzzle=puzzle)
+        att = Attempt.objects.create(development=dev, passed=True, results='{"0": "passed"}')
+
+        with mock.patch("engine.tasks.send_attempt_event") as send:
+            publish_result(att)
+
+        send.assert_called_once_with(
+            user.id, "attempt.result", attempt=str(att.pk),
+            result={"passed": True, "results": '{"0": "passed"}', "build_error": False}
+        )
+
+
+class TestRetriesExhausted(TestCase):
+    """Attempts whose task runs out of retries end with an engine error instead of running forever"""
+
+    def setUp(self):
+        user = User.objects.create_user("retrier", password="retrier")
+        puzzle = Puzzle.objects.create(
+            title="Retried puzzle",
+            difficulty=Puzzle.DifficultyLevel.EASY,
+            description="A description",
+            time_constraint = 1,
+            memory_constraint = 1,
+        )
+        dev = Development.objects.create(user=user, puzzle=puzzle)
+        self.attempt = Attempt.objects.create(development=dev, passed=False, results="")
+
+        # Failures are reported by task_postrun instead of being raised by eager tasks
+        conf = build.app.conf
+        propagates, conf.task_eager_propagates = conf.task_eager_propagates, False
+        self.addCleanup(setattr, conf, "task_eager_propagates", propagates)
+
+    def run_out_of_retries(self, task, args, engine):
+        with mock.patch.object(Engine, "get_instance", return_value=engine), \
+                mock.patch("engine.tasks.states") as attempt_states, mock.patch("engine.tasks.send_attempt_event"):
+            result = task.apply(args)
+
+        self.assertTrue(result.failed())
+        attempt_states.advance.assert_called_with(self.attempt.pk, attempt_states.DONE)
+
+        self.attempt.refresh_from_db()
+        self.assertTrue(self.attempt.build_error)
+        self.assertEqual(self.attempt.results, ENGINE_ERROR)
+
+    def test_build(self):
+        engine = mock.Mock()
+        engine.compile.side_effect = WorkspaceFull("full")
+
+        self.run_out_of_retries(build, ("c", "", str(self.attempt.pk)), engine)
+        self.assertEqual(engine.compile.call_count, build.max_retries + 1)
+
+    def test_test(self):
+        engine = mock.Mock()
+        engine.test.side_effect = AdmissionTimeout("full")
+
+        self.run_out_of_retries(test_task, ("chunk", str(self.attempt.pk), [], 1, 1), engine)
+        self.assertEqual(engine.test.call_count, test_task.max_retries + 1)
+
+
+class TestTestSetStore(TestCase):
+    def setUp(self):
+        self.puzzle = Puzzle.objects.create(
+            title="Test set puzzle",
+            difficulty=Puzzle.DifficultyLevel.EASY,
+            description="A description",
+            time_constraint = 1,
+            memory_constraint = 1,
+        )
+        self.tests = [("1 2", "3"), ("5 5", "10")]
+        for in_line, out in self.tests:
+            PuzzleTest.objects.create(puzzle=self.puzzle, input=in_line, output=out, is_private=True)
+        PuzzleTest.objects.create(puzzle=self.puzzle, input="public", output="public", is_private=False)
+
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def ref(self):
+        return testset_ref(Puzzle.objects.get(pk=self.puzzle.pk))
+
+    def test_hash_matches_digest(self):
+        self.assertEqual(testset_hash(self.puzzle.id), digest_tests(self.tests))
+
+    def test_hash_changes_with_tests(self):
+        before = testset_hash(self.puzzle.id)
+        PuzzleTest.objects.create(puzzle=self.puzzle, input="0 0", output="0", is_private=True)
+
+        self.assertNotEqual(testset_hash(self.puzzle.id), before)
+
+        PuzzleTest.objects.filter(puzzle=self.puzzle, input="0 0").delete()
+        self.assertEqual(testset_hash(self.puzzle.id), before)
+
+    def test_ref_reads_the_stored_hash(self):
+        puzzle = Puzzle.objects.get(pk=self.puzzle.pk)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(testset_ref(puzzle), {"puzzle": puzzle.id, "hash": digest_tests(self.tests)})
+
+    def test_fetch_once_per_version(self):
+        store = TestSetStore(self.root)
+        ref = self.ref()
+
+        path = store.fetch(ref["puzzle"], ref["hash"])
+        self.assertEqual(sorted(os.listdir(path)), ["0.in", "0.out", "1.in", "1.out", "index.json"])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(store.fetch(ref["puzzle"], ref["hash"]), path)
+
+        PuzzleTest.objects.create(puzzle=self.puzzle, input="0 0", output="0", is_private=True)
+        ref = self.ref()
+
+        self.assertNotEqual(store.fetch(ref["puzzle"], ref["hash"]), path)
+        self.assertFalse(os.path.exists(path))
+
+    def test_chunks_cannot_alter_the_store(self):
+        store = TestSetStore(self.root)
+        ref = self.ref()
+        path = store.fetch(ref["puzzle"], ref["hash"])
+
+        testsdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, testsdir)
+        copy_tests(path, testsdir)
+
+        with open(os.path.join(testsdir, "0.out"), "w") as fp:
+            fp.write("overwritten")
+
+        with open(os.path.join(path, "0.out")) as fp:
+            self.assertEqual(fp.read(), "3")
+
+
+class TestCheckerStore(TestCase):
+    def setUp(self):
+        self.puzzle = Puzzle.objects.create(
+            title="Checker puzzle",
+            difficulty=Puzzle.DifficultyLevel.EASY,
+            description="A description",
+            time_constraint = 1,
+            memory_constraint = 1,
+            checker="int main() { return 0; }",
+            checker_language="c",
+        )
+
+    def test_no_checker(self):
+        self.puzzle.checker = ""
+        self.assertIsNone(checker_ref(self.puzzle))
+
+    def test_fetch_once_per_version(self):
+        store = CheckerStore()
+        ref = checker_ref(self.puzzle)
+        source = base64.b64encode(b"int main() { return 0; }").decode()
+
+        self.assertEqual(store.fetch(ref["puzzle"], ref["hash"]), ("c", source))
+        with self.assertNumQueries(0):
+            self.assertEqual(store.fetch(ref["puzzle"], ref["hash"]), ("c", source))
+
+        self.puzzle.checker = "int main() { return 1; }"
+        self.puzzle.save()
+        ref = checker_ref(self.puzzle)
+
+        self.assertEqual(store.fetch(ref["puzzle"], ref["hash"]), ("c", base64.b64encode(b"int main() { return 1; }").decode()))
+
+
+class _FailingSandbox(Sandbox):
+    """Fails every compilation with the given compiler output"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        self.compilations = 0
+
+    def compile(self, chunk, language):
+        self.compilations += 1
+        return self.errors
+
+
+class TestArtifactCache(SimpleTestCase):
+    def test_key_depends_on_source(self):
+        self.assertEqual(ArtifactCache.key(C(), "int main;"), ArtifactCache.key(C(), "int main;"))
+        self.assertNotEqual(ArtifactCache.key(C(), "int main;"), ArtifactCache.key(C(), "int main; "))
+
+    def test_hit_and_miss_counters(self):
+        cache = ArtifactCache(1024)
+
+        self.assertIsNone(cache.get("a"))
+        cache.put("a", CompileResult(artifact=b"binary"))
+        self.assertEqual(cache.get("a").artifact, b"binary")
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_lru_eviction(self):
+        cache = ArtifactCache(10)
+
+        cache.put("a", CompileResult(artifact=b"aaaa"))
+        cache.put("b", CompileResult(errors="bbbb"))
+        cache.get("a")
+        cache.put("c", CompileResult(artifact=b"cccc"))
+
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("c"))
+        self.assertLessEqual(cache.size, 10)
+
+    def test_compile_errors_cached(self):
+        sandbox = _FailingSandbox("source.c:1: error: expected expression")
+        engine = Engine(sandbox=sandbox)
+        source = base64.b64encode(b"int main() { return }").decode()
+
+        for i in range(2):
+            with self.assertRaises(CompileTimeError):
+                engine.compile("c", source, f"cached-{random.randint(1000, 200000)}")
+
+        self.assertEqual(sandbox.compilations, 1)
+
+    def test_failures_without_diagnostics_not_cached(self):
+        sandbox = _FailingSandbox("")
+        engine = Engine(sandbox=sandbox)
+        source = base64.b64encode(b"int main() { return 0; }").decode()
+
+        for i in range(2):
+            with self.assertRaises(CompileTimeError):
+                engine.compile("c", source, f"uncached-{random.randint(1000, 200000)}")
+
+        self.assertEqual(sandbox.compilations, 2)
+
+
+class TestBenchmark(SimpleTestCase):
+    def test_percentile(self):
+        samples = list(range(1, 101))
+
+        self.assertEqual(percentile(samples, 50), 50)
+        self.assertEqual(percentile(samples, 99), 99)
+        self.assertIsNone(percentile([], 50))
+
+    def test_fake_docker(self):
+        client = FakeDockerClient({step: 0 for step in FakeDockerClient.DEFAULT_COSTS})
+        report = Benchmark(client, attempts=6, concurrency=3, tests=4).run()
+
+        self.assertEqual(report["errors"], 0)
+        self.assertGreater(report["throughput"], 0)
+        for phase in ("chunk", "create", "start", "wait", "logs", "remove", "attempt"):
+            self.assertIn(phase, report["phases"])
+        self.assertEqual(report["phases"]["attempt"]["count"], 6)
+
+
+class _BrokenSandbox(Sandbox):
+    def compile(self, chunk, language):
+        raise RuntimeError("Sandbox unavailable")
+
+
+class TestWorkspace(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def test_reap_by_age(self):
+        for name in ("old", "new"):
+            os.mkdir(os.path.join(self.root, name))
+        past = time.time() - 7200
+        os.utime(os.path.join(self.root, "old"), (past, past))
+
+        self.assertEqual(reap(self.root, 3600), ["old"])
+        self.assertEqual(os.listdir(self.root), ["new"])
+
+    def test_reserve(self):
+        ensure_space(self.root, 0, 3600)
+
+        with self.assertRaises(WorkspaceFull):
+            ensure_space(self.root, 2 ** 62, 3600)
+
+    def test_chunk_removed_on_sandbox_failure(self):
+        engine = Engine(sandbox=_BrokenSandbox())
+        uid = f"broken-{random.randint(1000, 200000)}"
+        source = base64.b64encode(b"int main() { return 0; }").decode()
+
+        with self.assertRaises(RuntimeError):
+            engine.compile("c", source, uid)
+
+        self.assertFalse(os.path.exists(os.path.join(engine.workingdir, uid)))
+
+
+class TestArchiveTransfer(SimpleTestCase):
+    def setUp(self):
+        self.chunk = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.chunk)
+        self.sandbox = DockerSandbox(FakeDockerClient({step: 0 for step in FakeDockerClient.DEFAULT_COSTS}), archive=True)
+
+    def test_pack_unpack(self):
+        os.mkdir(os.path.join(self.chunk, "tests"))
+        with open(os.path.join(self.chunk, "tests", "0.in"), "w") as fp:
+            fp.write("1 2")
+
+        dest = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dest)
+        unpack([pack(self.chunk, "chunk")], dest)
+
+        with open(os.path.join(dest, "chunk", "tests", "0.in")) as fp:
+            self.assertEqual(fp.read(), "1 2")
+
+    def test_compile_and_run(self):
+        with open(os.path.join(self.chunk, "source.c"), "w") as fp:
+            fp.write("int main() { return 0; }")
+
+        self.assertIsNone(self.sandbox._compile_oneshot(self.chunk, C()))
+        self.assertTrue(os.path.exists(os.path.join(self.chunk, "artifact")))
+
+        os.mkdir(os.path.join(self.chunk, "tests"))
+        with open(os.path.join(self.chunk, "tests", "index.json"), "w") as fp:
+            fp.write("[0, 1]")
+
+        status, stdout, _ = self.sandbox.run_solver(self.chunk, ["1000000", "0"])
+
+        self.assertEqual(status, 0)
+        self.assertEqual(stdout, '{"0": "passed", "1": "passed"}\n')
+
+    def test_fused_checker_in_one_container(self):
+        with mock.patch.object(settings, "ENGINE_ADMISSION", False):
+            engine = Engine(sandbox=self.sandbox)
+        source = base64.b64encode(b"int main() { return 0; }").decode()
+        checker = base64.b64encode(b"int main() { return 1; }").decode()
+        create = mock.patch.object(self.sandbox.client.containers, "create", wraps=self.sandbox.client.containers.create)
+
+        with create as created:
+            status, result = engine.build_and_test(
+                "c", source, f"fused-{random.randint(1000, 200000)}", [(0, "", "")], int(1e6), 0, checker=("c", checker)
+            )
+
+        self.assertEqual(created.call_count, 1)
+        self.assertEqual((status, result), ("solver_success", '{"0": "passed"}\n'))
+        self.assertEqual(len(engine.cache), 2)
+
+
+@skipUnless(redis_available(settings.ENGINE_ADMISSION_REDIS_URL), "requires a live Redis")
+class TestAdmissionController(SimpleTestCase):
+    def setUp(self):
+        client = redis.Redis.from_url(settings.ENGINE_ADMISSION_REDIS_URL)
+        self.controller = AdmissionController(client, f"test-{uuid.uuid4().hex[:8]}", cpus=2, memory=1000, poll_interval=0.01)
+        self.addCleanup(client.delete, *self.controller.keys)
+
+    def test_budget(self):
+        with self.controller.reserve(Demand(1, 600)):
+            self.assertTrue(self.controller.try_acquire("small", Demand(1, 400)))
+            self.assertFalse(self.controller.try_acquire("large", Demand(1, 600)))
+            self.controller.release("small")
+
+        self.assertTrue(self.controller.try_acquire("large", Demand(2, 1000)))
+
+    def test_timeout(self):
+        with self.controller.reserve(Demand(2, 100)):
+            with self.assertRaises(AdmissionTimeout):
+                with self.controller.reserve(Demand(1, 100), timeout=0.05):
+                    pass
+
+    def test_demand_capped(self):
+        demand = self.controller.demand(memlimit=10 ** 12, jobs=8)
+
+        self.assertEqual((demand.cpus, demand.memory), (2, 1000))
+
+
+class _StubExecResult():
+    def __init__(self, exit_code):
+        self.exit_code = exit_code
+        self.output = (b"", b"")
+
+
+class _StubContainer():
+    def __init__(self):
+        self.status = "created"
+        self.removed = False
+        self.id = str(id(self))
+
+    def start(self):
+        self.status = "running"
+
+    def reload(self):
+        pass
+
+    def exec_run(self, cmd, **kwargs):
+        return _StubExecResult(0 if self.status == "running" else 1)
+
+    def remove(self, force=False):
+        self.removed = True
+
+
+class _StubLanguage(C):
+    def get_pooled_compiler(self, docker, scratch):
+        return _StubContainer()
+
+
+class TestCompilerPool(SimpleTestCase):
+    def test_containers_are_reused(self):
+        pool = CompilerPool(None, _StubLanguage(), min_size=1, max_size=2)
+        pool.warm()
+
+        with pool.lease() as first:
+            pass
+        with pool.lease() as second:
+            pass
+
+        self.assertIs(first, second)
+        self.assertEqual(pool.size, 1)
+
+    def test_broken_containers_are_replaced(self):
+        pool = CompilerPool(None, _StubLanguage(), min_size=1, max_size=1)
+        pool.warm()
+
+        with pool.lease() as first:
+            first.status = "exited"
+
+        with pool.lease() as second:
+            pass
+
+        self.assertTrue(first.removed)
+        self.assertIsNot(first, second)
+        self.assertEqual(pool.size, 1)
+
+    def test_max_size(self):
+        pool = CompilerPool(None, _StubLanguage(), min_size=0, max_size=1)
+
+        with pool.lease():
+            with self.assertRaises(PoolExhausted):
+                pool.acquire(timeout=0.01)
+
+    def test_exhausted_pool_fails_the_build(self):
+        language = _StubLanguage()
+        pool = CompilerPool(None, language, min_size=0, max_size=1)
+        sandbox = DockerSandbox(client=object(), archive=False)
+        sandbox.pools[language.name] = pool
+
+        with pool.lease(), mock.patch.object(settings, "ENGINE_POOL_ACQUIRE_TIMEOUT", 0.01):
+            with self.assertRaises(PoolExhausted):
+                sandbox._compile_pooled("/nonexistent", language)
+
+    def test_idle_reaping(self):
+        pool = CompilerPool(None, _StubLanguage(), min_size=0, max_size=2, idle_timeout=0)
+
+        with pool.lease() as container:
+            pass
+        time.sleep(0.01)
+        pool.reap()
+
+        self.assertTrue(container.removed)
+        self.assertEqual(pool.size, 0)
+
+
+@skipUnless(shutil.which("gcc"), "requires a local C compiler")
+class TestLocalSandbox(SimpleTestCase):
+    """Runs the engine without a Docker daemon"""
+
+    def setUp(self):
+        self.engine = Engine(sandbox=LocalSandbox(use_bwrap=shutil.which("bwrap") is not None))
+        self.uid = str(random.randint(1000, 200000))
+        while os.path.exists(os.path.join(self.engine.workingdir, self.uid)):
+            self.uid = str(random.randint(1000, 200000))
+
+    def test_requires_bwrap(self):
+        with mock.patch("shutil.which", return_value=None), mock.patch.object(settings, "ENGINE_LOCAL_UNCONFINED", False):
+            with self.assertRaises(SandboxUnavailable):
+                LocalSandbox()
+
+    def test_clean_environment(self):
+        chunk = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, chunk)
+
+        with mock.patch.dict(os.environ, {"SECRET_KEY": "do-not-leak"}):
+            status, stdout, _ = self.engine.sandbox._run(chunk, ["sh", "-c", "env"], {}, 10)
+
+        self.assertEqual(status, 0)
+        self.assertNotIn("do-not-leak", stdout)
+
+    def test_compile_and_test(self):
+        chunk = self.engine.compile("c", TestBuild.valid_c_source(), self.uid)
+        solver_status, result = self.engine.test(chunk, self.uid, [(0, "input", "hello world")], int(1e6), int(1e10))
+
+        self.assertEqual(solver_status, "solver_success")
+        self.assertEqual(result, '{"0": "passed"}\n')
+
+    def test_parallel_results_match_sequential(self):
+        tests = [(i, "input", "hello world" if i % 2 else "bye") for i in range(6)]
+
+        chunk = self.engine.compile("c", TestBuild.valid_c_source(), self.uid)
+        sequential = self.engine.test(chunk, self.uid, tests, int(1e6), int(1e10), jobs=1)
+        chunk = self.engine.compile("c", TestBuild.valid_c_source(), self.uid)
+        parallel = self.engine.test(chunk, self.uid, tests, int(1e6), int(1e10), jobs=4)
+
+        self.assertEqual(sequential, parallel)
+
+    def test_fail_fast(self):
+        tests = [(0, "input", "hello world"), (1, "input", "bye"), (2, "input", "hello world")]
+
+        chunk = self.engine.compile("c", TestBuild.valid_c_source(), self.uid)
+        solver_status, result = self.engine.test(chunk, self.uid, tests, int(1e6), int(1e10), jobs=1, fail_fast=True)
+
+        self.assertEqual(solver_status, "solver_success")
+        self.assertEqual(result, '{"0": "passed", "1": "failed", "2": "skipped"}\n')
+
+    def test_progress(self):
+        tests = [(0, "input", "hello world"), (1, "input", "bye")]
+        records = []
+
+        chunk = self.engine.compile("c", TestBuild.valid_c_source(), self.uid)
+        solver_status, result = self.engine.test(chunk, self.uid, tests, int(1e6), int(1e10), jobs=1, progress=records.append)
+
+        self.assertEqual(result, '{"0": "passed", "1": "failed"}\n')
+        self.assertEqual([(r["done"], r["passed"], r["total"]) for r in records], [(1, 1, 2), (2, 1, 2)])
+
+    def test_token_comparison(self):
+        tests = [(0, "input", "hello   world\n"), (1, "input", "hello")]
+
+        chunk = self.engine.compile("c", TestBuild.valid_c_source(), self.uid)
+        solver_status, result = self.engine.test(chunk, self.uid, tests, int(1e6), int(1e10))
+
+        self.assertEqual(result, '{"0": "passed", "1": "failed"}\n')
+
+    def test_memory_capped_while_running(self):
+        source = base64.b64encode(
+            b'#include <stdlib.h>\n#include <string.h>\n'
+            b'int main() { for (;;) { char *p = malloc(16 << 20); if (!p) return 1; memset(p, 1, 16 << 20); } }'
+        ).decode()
+
+        chunk = self.engine.compile("c", source, self.uid)
+        solver_status, result = self.engine.test(chunk, self.uid, [(0, "", "")], int(1e6), 64 * 1024 ** 2)
+
+        self.assertEqual(result, '{"0": "memfail"}\n')
+
+    def test_background_process_does_not_hang(self):
+        source = base64.b64encode(
+            b'#include <stdio.h>\n#include <unistd.h>\n'
+            b'int main() { if (fork() == 0) { sleep(60); return 0; } printf("done"); return 0; }'
+        ).decode()
+
+        chunk = self.engine.compile("c", source, self.uid)
+        start = time.monotonic()
+        solver_status, result = self.engine.test(chunk, self.uid, [(0, "", "done")], int(1e6), int(1e10))
+
+        self.assertEqual(result, '{"0": "passed"}\n')
+        self.assertLess(time.monotonic() - start, 30)
+
+    def test_float_tolerance(self):
+        source = base64.b64encode(b'#include <stdio.h>\nint main() { printf("%f", 3.14159); return 0; }').decode()
+        tests = [(0, "", "3.1416")]
+
+        chunk = self.engine.compile("c", source, self.uid)
+        _, exact = self.engine.test(chunk, self.uid, tests, int(1e6), int(1e10))
+        chunk = self.engine.compile("c", source, self.uid)
+        _, tolerant = self.engine.test(chunk, self.uid, tests, int(1e6), int(1e10), tolerance=1e-4)
+
+        self.assertEqual(exact, '{"0": "failed"}\n')
+        self.assertEqual(tolerant, '{"0": "passed"}\n')
+
+    def test_custom_checker(self):
+        # Accepts any output starting with "hello"
+        checker = base64.b64encode(b"""#include <stdio.h>
+            #include <string.h>
+            int main(int argc, char **argv) {
+                char buf[6] = {0};
+                FILE *out = fopen(argv[3], "r");
+                fread(buf, 1, 5, out);
+                return strcmp(buf, "hello") != 0;
+            }
+        """).decode()
+
+        chunk = self.engine.compile("c", TestBuild.valid_c_source(), self.uid, checker=("c", checker))
+        _, result = self.engine.test(chunk, self.uid, [(0, "input", "unrelated")], int(1e6), int(1e10))
+
+        self.assertEqual(result, '{"0": "passed"}\n')
+
+        _, result = self.engine.build_and_test(
+            "c", TestBuild.valid_c_source(), self.uid, [(0, "input", "unrelated")], int(1e6), int(1e10), checker=("c", checker)
+        )
+
+        self.assertEqual(result, '{"0": "passed"}\n')
+
+    def test_compile_error(self):
+        source = base64.b64encode(b"int main() { return }").decode()
+
+        with self.assertRaises(CompileTimeError):
+            self.engine.compile("c", source, self.uid)
+
+        self.assertFalse(os.path.exists(os.path.join(self.engine.workingdir, self.uid)))
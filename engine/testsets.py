@@ -0,0 +1,100 @@
+"""
+Worker-side, content-addressed store of puzzle test sets.
+
+Instead of shipping every private test in each Celery message, tasks carry a reference to the test set:
+the puzzle id and the hash of its private tests. The hash is kept on the puzzle, computed by the database
+whenever its tests change, so the web app never loads the tests. Workers fetch a test set once per version and keep it on disk, in the layout read
+by the solver; chunks get copies of its files.
+
+The store must stay out of reach of attempts: it is kept off the volume mounted by solver containers, and
+chunks never share its files, which an attempt could otherwise overwrite for every later attempt.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+
+from puzzle.models import Puzzle, PuzzleTest
+
+def private_tests(puzzle_id):
+    return PuzzleTest.objects.filter(puzzle_id=puzzle_id, is_private=True).order_by("id")
+
+def testset_hash(puzzle_id):
+    """Hash of the private tests of a puzzle, as stored by Puzzle.objects.refresh_testset_hash. Matches
+    digest_tests on the same tests."""
+    return Puzzle.objects.filter(pk=puzzle_id).values_list("testset_hash", flat=True).get()
+
+def digest_tests(tests):
+    """Hash of a list of (input, output) pairs, the same computed by testset_hash"""
+    md5 = lambda text: hashlib.md5(text.encode("utf-8")).hexdigest()
+    return md5(",".join(md5(i) + md5(o) for i, o in tests))
+
+def testset_ref(puzzle: Puzzle):
+    """Reference to the current test set of a puzzle, to be sent to the engine in place of the tests"""
+    return {"puzzle": puzzle.id, "hash": puzzle.testset_hash}
+
+def write_tests(testsdir, tests):
+    """Write each (id, input, output) test to its own input and output file in testsdir, with an index of
+    the test ids"""
+
+    for i, in_line, expected_out in tests:
+        with open(os.path.join(testsdir, f"{i}.in"), "w") as fp:
+            fp.write(in_line)
+        with open(os.path.join(testsdir, f"{i}.out"), "w") as fp:
+            fp.write(expected_out)
+
+    with open(os.path.join(testsdir, "index.json"), "w") as fp:
+        json.dump([i for i, _, _ in tests], fp)
+
+def copy_tests(source, testsdir):
+    """Populate testsdir with copies of the files of a stored test set"""
+    for name in os.listdir(source):
+        shutil.copyfile(os.path.join(source, name), os.path.join(testsdir, name))
+
+
+class TestSetStore():
+    """On-disk cache of test sets, one directory per puzzle and test set hash"""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, puzzle_id, digest):
+        return os.path.join(self.root, f"{puzzle_id}-{digest}")
+
+    def fetch(self, puzzle_id, digest) -> str:
+        """Returns the directory of the test set, loading it from the database on a miss"""
+        path = self.path(puzzle_id, digest)
+        if os.path.isdir(path):
+            return path
+
+        tests = list(private_tests(puzzle_id).values_list("input", "output"))
+        actual = digest_tests(tests)
+        if actual != digest:
+            logging.warning(f"Tests of puzzle {puzzle_id} changed since submission: {digest} is now {actual}")
+            path = self.path(puzzle_id, actual)
+            if os.path.isdir(path):
+                return path
+
+        tmp = tempfile.mkdtemp(prefix=".tmp-", dir=self.root)
+        write_tests(tmp, [(i, in_line, out) for i, (in_line, out) in enumerate(tests)])
+
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # Stored concurrently by another worker process
+            shutil.rmtree(tmp)
+        else:
+            self.prune(puzzle_id, keep=path)
+
+        return path
+
+    def prune(self, puzzle_id, keep):
+        """Remove older versions of a puzzle test set. Chunks keep working on their copies."""
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.startswith(f"{puzzle_id}-") and path != keep:
+                shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,102 @@
+"""
+Housekeeping of the engine working directory, where chunks are created.
+
+In production the working directory is a tmpfs volume, whose size is the quota of the chunks. New chunks
+are refused while free space is below a reserve, orphaned chunks (left behind by crashed workers or by
+chains interrupted between build and test) are reaped by age, and usage is reported as gauges.
+"""
+
+import os
+import time
+import shutil
+import socket
+import logging
+import threading
+
+from utils import metrics
+
+
+class WorkspaceFull(Exception):
+    pass
+
+
+def chunks(workdir):
+    """Chunk directories in workdir"""
+    with os.scandir(workdir) as entries:
+        return [entry for entry in entries if entry.is_dir(follow_symlinks=False)]
+
+def reap(workdir, max_age, now=None):
+    """Remove chunks not modified for max_age seconds. Returns the names of the removed chunks."""
+    now = now or time.time()
+    removed = []
+
+    for entry in chunks(workdir):
+        try:
+            age = now - entry.stat(follow_symlinks=False).st_mtime
+        except FileNotFoundError:
+            continue
+
+        if age > max_age:
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed.append(entry.name)
+
+    if removed:
+        logging.warning(f"Reaped {len(removed)} orphaned chunks")
+
+    return removed
+
+def ensure_space(workdir, reserve, max_age):
+    """Raise WorkspaceFull if less than reserve bytes are free in workdir, after reaping orphaned chunks"""
+    if shutil.disk_usage(workdir).free >= reserve:
+        return
+
+    reap(workdir, max_age)
+    if shutil.disk_usage(workdir).free < reserve:
+        raise WorkspaceFull(f"Less than {reserve} bytes free in the engine working directory")
+
+def available_memory():
+    """Memory available on the host in bytes, None if unknown"""
+    try:
+        with open("/proc/meminfo") as fp:
+            for line in fp:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    return None
+
+def report(workdir):
+    """Publish workspace and memory usage gauges of this host"""
+    usage = shutil.disk_usage(workdir)
+    host = socket.gethostname()
+
+    metrics.gauge("workspace_used_bytes", usage.used, host=host)
+    metrics.gauge("workspace_size_bytes", usage.total, host=host)
+    metrics.gauge("workspace_chunks", len(chunks(workdir)), host=host)
+
+    memory = available_memory()
+    if memory is not None:
+        metrics.gauge("memory_available_bytes", memory, host=host)
+
+
+class Reaper(threading.Thread):
+    """Background thread reaping orphaned chunks and reporting usage every interval seconds"""
+
+    def __init__(self, workdir, max_age, interval):
+        super().__init__(name="chunk-reaper", daemon=True)
+        self.workdir = workdir
+        self.max_age = max_age
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                reap(self.workdir, self.max_age)
+                report(self.workdir)
+            except Exception as e:
+                logging.error(f"Chunk reaper: {e}")
+
+    def stop(self):
+        self.stopped.set()
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class PuzzleConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'puzzle'
+
+    def ready(self):
+        from . import signals
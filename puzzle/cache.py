@@ -0,0 +1,120 @@
+"""
+puzzle.cache
+
+Two-tier cache of the featured puzzles payload, served on the home page, and per-process cache of title
+autocomplete suggestions.
+
+The payload is stored in Redis (the default Django cache) under the current version, which signals bump
+whenever a puzzle, a category or the categories of a puzzle change. Each process keeps the payloads of
+recent versions in a small LRU in front of Redis, so that a hit costs a single lookup of the version.
+When the payload of a version is missing, only the process holding a short lock rebuilds it, the
+others wait for it to appear. If Redis is unavailable, the payload is built on every request.
+"""
+
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+import redis
+from django.core.cache import cache
+
+from AlgoBattles import settings
+
+FEATURED_VERSION_KEY = "puzzle:featured:version"
+
+
+class LocalLRU():
+    """Thread-safe LRU of at most max_entries items, expiring after ttl seconds if given"""
+
+    def __init__(self, max_entries, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key):
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                return None
+
+            expires, value = entry
+            if expires is not None and expires < time.monotonic():
+                del self.__entries[key]
+                return None
+
+            self.__entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self.__lock:
+            self.__entries[key] = (expires, value)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.max_entries:
+                self.__entries.popitem(last=False)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+
+
+local_featured = LocalLRU(max_entries=4)
+autocomplete_cache = LocalLRU(settings.AUTOCOMPLETE_CACHE_SIZE, ttl=settings.AUTOCOMPLETE_CACHE_TTL)
+
+def featured_version():
+    return cache.get_or_set(FEATURED_VERSION_KEY, 1, timeout=None)
+
+def invalidate_featured():
+    """Move to a new version of the featured payload. Entries of older versions expire on their own."""
+    try:
+        cache.incr(FEATURED_VERSION_KEY)
+    except ValueError:
+        cache.add(FEATURED_VERSION_KEY, 1, timeout=None)
+    except redis.RedisError as e:
+        logging.warning(f"Featured puzzles cache not invalidated: {e}")
+
+def featured_payload(build):
+    """The featured payload, calling build on a miss to compute it"""
+    try:
+        return _cached(build)
+    except redis.RedisError as e:
+        logging.warning(f"Featured puzzles cache unavailable: {e}")
+        return build()
+
+def _cached(build):
+    version = featured_version()
+
+    payload = local_featured.get(version)
+    if payload is not None:
+        return payload
+
+    key = f"puzzle:featured:{version}"
+    payload = cache.get(key)
+
+    if payload is None:
+        if cache.add(f"{key}:lock", 1, timeout=settings.FEATURED_CACHE_LOCK_TIMEOUT):
+            try:
+                payload = build()
+                cache.set(key, payload, timeout=settings.FEATURED_CACHE_TIMEOUT)
+            finally:
+                cache.delete(f"{key}:lock")
+        else:
+            payload = _wait_for(key)
+            if payload is None:
+                # The rebuild is taking too long, serve a fresh payload without caching it
+                return build()
+
+    local_featured.put(version, payload)
+    return payload
+
+def _wait_for(key):
+    deadline = time.monotonic() + settings.FEATURED_CACHE_LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        payload = cache.get(key)
+        if payload is not None:
+            return payload
+
+    return None
@@ -0,0 +1,73 @@
+from channels.generic.websocket import JsonWebsocketConsumer
+from asgiref.sync import async_to_sync
+from multiplayer.auth import get_user
+from .notify import user_group
+
+class AttemptConsumer(JsonWebsocketConsumer):
+    """Streams the state, progress and final result of the attempts of the authenticated user, so that
+    clients need not poll PollingAttemptResultView.
+
+    Clients authenticate with {"authenticate": {"token": <token>}}, again to switch user. Connections are
+    closed with INVALID_TOKEN or INVALID_MESSAGE otherwise."""
+
+    INVALID_TOKEN = 3000
+    INVALID_MESSAGE = 3001
+
+    def connect(self):
+        self.user = None
+        self.accept()
+
+    def disconnect(self, close_code):
+        self.leave()
+
+    def leave(self):
+        if self.user and not self.user.is_anonymous:
+            async_to_sync(self.channel_layer.group_discard)(user_group(self.user.id), self.channel_name)
+
+    def receive_json(self, content):
+        if not isinstance(content, dict) or "authenticate" not in content:
+            self.close(self.INVALID_MESSAGE, "Invalid message")
+            return
+
+        authenticate = content["authenticate"]
+        token = authenticate.get("token") if isinstance(authenticate, dict) else None
+        if not isinstance(token, str):
+            self.close(self.INVALID_MESSAGE, "Invalid authenticate message")
+            return
+
+        user = get_user(token)
+        self.leave()
+        self.user = user
+
+        if user.is_anonymous:
+            self.close(self.INVALID_TOKEN, "Invalid token")
+            return
+
+        async_to_sync(self.channel_layer.group_add)(user_group(user.id), self.channel_name)
+
+    def attempt_progress(self, event):
+        self.send_json({
+            "progress": {
+                "attempt": event.get("attempt"),
+                "done": event.get("done"),
+                "passed": event.get("passed"),
+                "total": event.get("total"),
+                "message": f"{event.get('passed')}/{event.get('total')} passed"
+            }
+        })
+
+    def attempt_state(self, event):
+        self.send_json({
+            "state": {
+                "attempt": event.get("attempt"),
+                "state": event.get("state")
+            }
+        })
+
+    def attempt_result(self, event):
+        self.send_json({
+            "result": {
+                "attempt": event.get("attempt"),
+                **event.get("result")
+            }
+        })
@@ -0,0 +1,66 @@
+import json
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.core.management.base import BaseCommand
+
+from puzzle.models import Puzzle
+
+WORDS = ["graph", "path", "tree", "string", "prime", "matrix", "sort", "queue", "heap", "flow"]
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ("Measure title autocomplete queries with EXPLAIN ANALYZE on synthetic puzzles, which are rolled back "
+            "afterwards")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--puzzles", type=int, default=100000)
+        parser.add_argument("--limit", type=int, default=10)
+        parser.add_argument("prefixes", nargs="*", default=["gr", "graph pa", "matrix q", "shortst"])
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.seed(options["puzzles"])
+                self.report(options["prefixes"], options["limit"])
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def seed(self, count):
+        Puzzle.objects.bulk_create([
+            Puzzle(
+                title=f"{WORDS[i % 10].capitalize()} {WORDS[i // 10 % 10]} {i}",
+                description="A description",
+                time_constraint=1,
+                memory_constraint=1,
+            ) for i in range(count)
+        ], batch_size=10000)
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {Puzzle._meta.db_table}")
+
+    def report(self, prefixes, limit):
+        puzzles = Puzzle.objects.filter(~Q(visibility=Puzzle.Visibility.PRIVATE))
+
+        self.stdout.write(f"{'prefix':<16}{'query':<10}{'ms':>10}  index")
+        for prefix in prefixes:
+            prefix = " ".join(prefix.lower().split())
+            queries = (
+                ("prefix", puzzles.title_prefix(prefix)),
+                ("similar", puzzles.title_similar(prefix)),
+            )
+            for name, queryset in queries:
+                plan = json.loads(queryset.values_list("id", "title")[:limit].explain(analyze=True, format="json"))[0]
+                indexes = sorted(set(self.indexes(plan["Plan"]))) or ["-"]
+                self.stdout.write(f"{prefix:<16}{name:<10}{plan['Execution Time']:>10.3f}  {', '.join(indexes)}")
+
+    def indexes(self, node):
+        if "Index Name" in node:
+            yield node["Index Name"]
+        for child in node.get("Plans", ()):
+            yield from self.indexes(child)
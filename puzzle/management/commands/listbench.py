@@ -0,0 +1,99 @@
+import time
+import statistics
+
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.models import Group, User
+from django.core.management.base import BaseCommand
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from puzzle.models import Category, Development, Puzzle
+
+# URL, and whose token authenticates the request
+ENDPOINTS = [
+    ("/api/puzzle?page_size=1000", None),
+    ("/api/puzzle?page_size=1000&count=1", None),
+    ("/api/puzzle?category=category-3&page_size=1000", None),
+    ("/api/search?t=graph&page_size=1000", None),
+    ("/api/search/facets?t=graph&category=category-3&page_size=100", None),
+    ("/api/featured", None),
+    ("/api/puzzle/attempted/?page_size=1000", "user"),
+    ("/api/puzzle/completed/?page_size=1000", "user"),
+    ("/api/publisher/list?page_size=1000", "publisher"),
+    ("/api/publisher/search?q=graph&page_size=1000", "publisher"),
+]
+
+
+class Command(BaseCommand):
+    help = ("Measure the latency and the number of queries of the puzzle list endpoints on synthetic puzzles, "
+            "which are rolled back afterwards")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--puzzles", type=int, default=10000)
+        parser.add_argument("--categories", type=int, default=50)
+        parser.add_argument("--repeat", type=int, default=5, help="Requests to each endpoint")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            tokens = self.seed(options["puzzles"], options["categories"])
+            self.report(tokens, options["repeat"])
+            transaction.set_rollback(True)
+
+    def seed(self, count, category_count):
+        categories = Category.objects.bulk_create(
+            [Category(name=f"category-{i}", featured=i < 5) for i in range(category_count)]
+        )
+
+        publisher = User.objects.create_user(username="listbench-publisher")
+        publisher.groups.add(Group.objects.get_or_create(name="Publishers")[0])
+        user = User.objects.create_user(username="listbench-solver")
+
+        puzzles = Puzzle.objects.bulk_create([
+            Puzzle(
+                title=f"Puzzle {i} on graph paths",
+                description="Find the shortest path in the graph",
+                time_constraint=1,
+                memory_constraint=1,
+                visibility=Puzzle.Visibility.PUBLIC if i % 10 else Puzzle.Visibility.HIDDEN,
+                publisher=publisher if i % 20 == 0 else None,
+            ) for i in range(count)
+        ], batch_size=10000)
+
+        Through = Puzzle.categories.through
+        Through.objects.bulk_create([
+            Through(puzzle_id=p.id, category_id=categories[(i + k) % category_count].id)
+            for i, p in enumerate(puzzles) for k in (0, 7)
+        ], batch_size=10000)
+        Puzzle.objects.refresh_category_names()
+
+        Development.objects.bulk_create([
+            Development(user=user, puzzle=p, completed=i % 2 == 0) for i, p in enumerate(puzzles[:400])
+        ])
+
+        with connection.cursor() as cursor:
+            for model in (Category, Puzzle, Through, Development):
+                cursor.execute(f"ANALYZE {model._meta.db_table}")
+
+        return {
+            "user": Token.objects.create(user=user).key,
+            "publisher": Token.objects.create(user=publisher).key,
+        }
+
+    def report(self, tokens, repeat):
+        self.stdout.write(f"{'endpoint':<64}{'queries':>8}{'p50 ms':>10}{'max ms':>10}")
+        for url, who in ENDPOINTS:
+            client = APIClient()
+            if who is not None:
+                client.credentials(HTTP_AUTHORIZATION="Token " + tokens[who])
+
+            elapsed = []
+            for _ in range(repeat):
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    client.get(url)
+                    elapsed.append(time.perf_counter() - start)
+
+            self.stdout.write(
+                f"{url:<64}{len(queries):>8}{statistics.median(elapsed) * 1000:>10.1f}{max(elapsed) * 1000:>10.1f}"
+            )
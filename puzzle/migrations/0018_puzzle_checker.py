@@ -0,0 +1,28 @@
+# Generated by Django 5.1 on 2026-10-18 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('puzzle', '0017_alter_category_name_category_unique_lower'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='puzzle',
+            name='float_tolerance',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='puzzle',
+            name='checker',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='puzzle',
+            name='checker_language',
+            field=models.CharField(blank=True, default='', max_length=10),
+        ),
+    ]
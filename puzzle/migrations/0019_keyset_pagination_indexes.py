@@ -0,0 +1,37 @@
+# Generated by Django 5.1 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('puzzle', '0018_puzzle_checker'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='puzzle',
+            index=models.Index(fields=['visibility', 'id'], name='puzzle_visibility_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='puzzle',
+            index=models.Index(fields=['visibility', 'difficulty', 'id'], name='puzzle_vis_difficulty_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='development',
+            index=models.Index(fields=['user', 'id'], name='development_user_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='development',
+            index=models.Index(fields=['user', 'completed', 'id'], name='development_user_done_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='development',
+            index=models.Index(fields=['user', 'puzzle', 'id'], name='development_user_puzzle_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='attempt',
+            index=models.Index(fields=['development', 'id'], name='attempt_development_id_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.1 on 2026-10-18 14:00
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('puzzle', '0019_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='puzzle',
+            name='category_names',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=100), blank=True, default=list, editable=False, size=None),
+        ),
+        migrations.RunSQL(
+            sql="""
+                UPDATE puzzle_puzzle SET category_names = ARRAY(
+                    SELECT c.name FROM puzzle_category c
+                    JOIN puzzle_puzzle_categories pc ON pc.category_id = c.id
+                    WHERE pc.puzzle_id = puzzle_puzzle.id
+                    ORDER BY c.name
+                )
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name='puzzle',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['category_names'], name='puzzle_category_names_gin'),
+        ),
+    ]
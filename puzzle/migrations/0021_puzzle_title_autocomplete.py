@@ -0,0 +1,25 @@
+# Generated by Django 5.1 on 2026-10-18 16:00
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('puzzle', '0020_puzzle_category_names'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddIndex(
+            model_name='puzzle',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Lower('title'), name='text_pattern_ops'), name='puzzle_title_prefix_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='puzzle',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['title'], name='puzzle_title_trgm_gin', opclasses=['gin_trgm_ops']),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1 on 2026-10-18 18:00
+
+import django.db.models.functions.comparison
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('puzzle', '0021_puzzle_title_autocomplete'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='puzzle',
+            name='puzzle_title_prefix_idx',
+        ),
+        migrations.AddIndex(
+            model_name='puzzle',
+            index=models.Index(django.db.models.functions.comparison.Collate(django.db.models.functions.text.Lower('title'), 'C'), name='puzzle_title_prefix_idx'),
+        ),
+    ]
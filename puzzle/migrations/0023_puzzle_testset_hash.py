@@ -0,0 +1,28 @@
+# Generated by Django 5.1 on 2026-10-18 20:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('puzzle', '0022_puzzle_title_prefix_collation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='puzzle',
+            name='testset_hash',
+            field=models.CharField(default='d41d8cd98f00b204e9800998ecf8427e', editable=False, max_length=32),
+        ),
+        migrations.RunSQL(
+            sql="""
+                UPDATE puzzle_puzzle SET testset_hash = COALESCE((
+                    SELECT MD5(STRING_AGG(MD5(t.input) || MD5(t.output), ',' ORDER BY t.id))
+                    FROM puzzle_puzzletest t
+                    WHERE t.puzzle_id = puzzle_puzzle.id AND t.is_private
+                ), 'd41d8cd98f00b204e9800998ecf8427e')
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
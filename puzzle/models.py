@@ -1,10 +1,14 @@
-from django.db import models
+from django.db import models, connections
 from django.db.models import constraints
-from django.db.models.functions import Lower
+from django.db.models.functions import MD5, Coalesce, Collate, Concat, Lower
+from django.contrib.postgres.search import TrigramWordSimilarity
 from django.contrib.auth.models import User
 from django.utils.translation import gettext_lazy as _
 from multiplayer.models import Challenge
 from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.expressions import ArraySubquery
+from django.contrib.postgres.aggregates import StringAgg
 from django.contrib.postgres.search import SearchVectorField, SearchVector
 
 class Category(models.Model):
@@ -23,6 +27,76 @@ class Category(models.Model):
         return self.name
 
 
+# MD5 of no tests
+EMPTY_TESTSET_HASH = "d41d8cd98f00b204e9800998ecf8427e"
+
+
+class PuzzleQuerySet(models.QuerySet):
+    def with_categories(self):
+        """Prefetch the category names, so that list serializers do not query them once per puzzle"""
+        return self.prefetch_related(models.Prefetch("categories", queryset=Category.objects.only("name")))
+
+    def refresh_category_names(self):
+        """Copy the category names of the puzzles into their category_names array"""
+        names = Category.objects.filter(puzzle=models.OuterRef("pk")).order_by("name").values("name")
+        return self.update(category_names=ArraySubquery(names))
+
+    def refresh_testset_hash(self):
+        """Hash the private tests of the puzzles into their testset_hash, in the database without
+        transferring them. Matches engine.testsets.digest_tests on the same tests."""
+        digest = PuzzleTest.objects.filter(puzzle=models.OuterRef("pk"), is_private=True).order_by().values(
+            "puzzle"
+        ).annotate(
+            digest=MD5(StringAgg(Concat(MD5("input"), MD5("output")), delimiter=",", ordering="id"))
+        ).values("digest")
+        return self.update(testset_hash=Coalesce(models.Subquery(digest), models.Value(EMPTY_TESTSET_HASH)))
+
+    def autocomplete(self, prefix, limit):
+        """Up to limit (id, title) of puzzles whose title starts with prefix, in alphabetical order, then of
+        puzzles with a word close to prefix (typos included), most similar first. prefix must be lowercase."""
+        suggestions = list(self.title_prefix(prefix).values_list("id", "title")[:limit])
+
+        if len(suggestions) < limit:
+            suggestions += self.title_similar(prefix).values_list("id", "title")[:limit - len(suggestions)]
+
+        return suggestions
+
+    def title_prefix(self, prefix):
+        # Byte order ("C" collation) of the lowercase titles, so that puzzle_title_prefix_idx serves both the
+        # range of the prefix and the order
+        return self.annotate(lower_title=Collate(Lower("title"), "C")).filter(
+            lower_title__startswith=prefix
+        ).order_by("lower_title")
+
+    def title_similar(self, prefix):
+        return self.filter(title__trigram_word_similar=prefix).annotate(
+            lower_title=Collate(Lower("title"), "C")
+        ).exclude(
+            lower_title__startswith=prefix
+        ).annotate(
+            similarity=TrigramWordSimilarity(prefix, "title")
+        ).order_by("-similarity", "id")
+
+    def facets(self):
+        """Number of puzzles per category and per difficulty, counted in a single query"""
+        sql, params = self.order_by().values("difficulty", "category_names").query.sql_with_params()
+        facets = {"categories": {}, "difficulty": {}}
+
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(f"""
+                WITH matches AS ({sql})
+                SELECT 'categories', category, COUNT(*) FROM matches, unnest(matches.category_names) AS category
+                GROUP BY category
+                UNION ALL
+                SELECT 'difficulty', difficulty, COUNT(*) FROM matches GROUP BY difficulty
+            """, params)
+
+            for facet, value, count in cursor.fetchall():
+                facets[facet][value] = count
+
+        return facets
+
+
 class Puzzle(models.Model):
     title = models.CharField(max_length=150)
 
@@ -44,6 +118,9 @@ class Puzzle(models.Model):
 
     categories = models.ManyToManyField(Category)
 
+    # Names of the categories, denormalized for indexed filtering and faceting. Kept up to date by signals
+    category_names = ArrayField(models.CharField(max_length=100), default=list, blank=True, editable=False)
+
     search_vector = models.GeneratedField(
         db_persist=True,
         expression=SearchVector(
@@ -52,7 +129,16 @@ class Puzzle(models.Model):
         output_field=SearchVectorField(),
     )
     class Meta:
-        indexes = [GinIndex(fields=['search_vector'])]
+        indexes = [
+            GinIndex(fields=['search_vector']),
+            GinIndex(fields=['category_names'], name="puzzle_category_names_gin"),
+            # Title autocomplete: prefixes on a range of the lowercase titles, typos with trigrams
+            models.Index(Collate(Lower("title"), "C"), name="puzzle_title_prefix_idx"),
+            GinIndex(fields=["title"], opclasses=["gin_trgm_ops"], name="puzzle_title_trgm_gin"),
+            # Keyset pagination of the puzzle list, optionally filtered by difficulty
+            models.Index(fields=["visibility", "id"], name="puzzle_visibility_id_idx"),
+            models.Index(fields=["visibility", "difficulty", "id"], name="puzzle_vis_difficulty_id_idx"),
+        ]
 
     class Visibility(models.TextChoices):
         PUBLIC = "P", _("Public")
@@ -67,6 +153,18 @@ class Puzzle(models.Model):
 
     publisher = models.ForeignKey(User, on_delete=models.SET_DEFAULT, null=True, default=None)
 
+    # Outputs are compared token by token, numbers are accepted within this absolute or relative tolerance
+    float_tolerance = models.FloatField(default=0.0)
+
+    # Optional custom checker, run as `checker input expected output`: exits with 0 if the output is correct
+    checker = models.TextField(blank=True, default="")
+    checker_language = models.CharField(max_length=10, blank=True, default="")
+
+    # Hash of the private tests, sent to the engine to reference the test set. Kept up to date by signals
+    testset_hash = models.CharField(max_length=32, default=EMPTY_TESTSET_HASH, editable=False)
+
+    objects = PuzzleQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.id} {self.title}"
 
@@ -94,6 +192,14 @@ class Development(models.Model):
 
     challenge = models.ForeignKey(Challenge, on_delete=models.CASCADE, default=None, null=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination of the attempted and completed puzzles of a user
+            models.Index(fields=["user", "id"], name="development_user_id_idx"),
+            models.Index(fields=["user", "completed", "id"], name="development_user_done_id_idx"),
+            models.Index(fields=["user", "puzzle", "id"], name="development_user_puzzle_idx"),
+        ]
+
 class Attempt(models.Model):
     """An attempt of solving the puzzle. Triggers a build and a test in the solver facility"""
 
@@ -104,3 +210,6 @@ class Attempt(models.Model):
     on_date = models.DateTimeField(auto_now=True)
     task_id = models.CharField(max_length=255)
 
+    class Meta:
+        indexes = [models.Index(fields=["development", "id"], name="attempt_development_id_idx")]
+
@@ -0,0 +1,23 @@
+"""
+puzzle.notify
+
+Pushes attempt events to the websocket clients of the attempt owner, through the channels layer.
+Every user has its own group, joined by AttemptConsumer once the client authenticates.
+"""
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+channel_layer = get_channel_layer()
+
+def user_group(user_id):
+    return f"attempts.user.{user_id}"
+
+def send_attempt_event(user_id, event_type, **payload):
+    """Send an event to every connection of the user. event_type is the name of the consumer handler,
+    with dots, e.g. attempt.progress"""
+
+    async_to_sync(channel_layer.group_send)(user_group(user_id), {
+        "type": event_type,
+        **payload
+    })
@@ -1,5 +1,6 @@
 from .. import models
 from rest_framework import serializers
+from engine.engine import Engine
 
 class PuzzleListSerializer(serializers.ModelSerializer):
     """Serializes a puzzle with categories as list, for list views"""
@@ -10,7 +11,7 @@ class PuzzleListSerializer(serializers.ModelSerializer):
         fields = ("id", "title", "difficulty", "categories")
 
     def get_categories(self, obj):
-        return list(obj.categories.values_list('name', flat=True))
+        return [category.name for category in obj.categories.all()]
 
 class PuzzleTestSerializer(serializers.ModelSerializer):
     class Meta:
@@ -30,10 +31,22 @@ class PuzzleSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.Puzzle
         fields = (
-            'id', 'title', 'difficulty', 'description', 'time_constraint', 'memory_constraint', 'categories', 'visibility', 'publisher', 'tests'
+            'id', 'title', 'difficulty', 'description', 'time_constraint', 'memory_constraint', 'categories', 'visibility', 'publisher', 'tests',
+            'float_tolerance', 'checker', 'checker_language'
         )
         read_only_fields = ('id', 'publisher')
 
+    def validate(self, attrs):
+        checker = attrs.get('checker', self.instance.checker if self.instance else "")
+        language = attrs.get('checker_language', self.instance.checker_language if self.instance else "")
+
+        if checker and language.lower() not in Engine.languages:
+            raise serializers.ValidationError(
+                {'checker_language': f"The checker language must be one of {', '.join(Engine.languages)}"}
+            )
+
+        return attrs
+
     def create(self, validated_data):
         request = self.context.get('request')
 
@@ -27,7 +27,7 @@ class PublishedPuzzles(generics.ListAPIView):
     serializer_class = PuzzleListSerializer
 
     def get_queryset(self):
-        return Puzzle.objects.filter(publisher=self.request.user).order_by("-id")
+        return Puzzle.objects.filter(publisher=self.request.user).with_categories().order_by("-id")
 
 
 class SearchPublisherPuzzleView(generics.ListAPIView):
@@ -38,7 +38,7 @@ class SearchPublisherPuzzleView(generics.ListAPIView):
 
     def get_queryset(self):
         search_query = self.request.query_params.get('q', None)
-        queryset = Puzzle.objects.filter(publisher=self.request.user)
+        queryset = Puzzle.objects.filter(publisher=self.request.user).with_categories()
 
         if search_query:
             query = SearchQuery(search_query)
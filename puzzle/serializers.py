@@ -10,7 +10,13 @@ class PuzzleListSerializer(serializers.ModelSerializer):
         fields = ("id", "title", "difficulty", "categories")
 
     def get_categories(self, obj):
-        return list(obj.categories.values_list('name', flat=True))
+        # Served from the prefetched categories on list views, see PuzzleQuerySet.with_categories
+        return [category.name for category in obj.categories.all()]
+
+
+class FacetedPuzzleSerializer(PuzzleListSerializer):
+    def get_categories(self, obj):
+        return obj.category_names
 
 
 class PuzzleTestListSerializer(serializers.ModelSerializer):
@@ -23,7 +29,7 @@ class PuzzleViewSerializer(serializers.ModelSerializer):
     categories = serializers.SerializerMethodField()
 
     def get_categories(self, obj):
-        return list(obj.categories.values_list('name', flat=True))
+        return [category.name for category in obj.categories.all()]
 
 
     class Meta:
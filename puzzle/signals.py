@@ -1,22 +1,62 @@
 """
 puzzle.signals
 
-This module provides callbacks for post_save signals to optimize the computation of completed developments for
-a given puzzle and a given user.
+This module provides callbacks for model signals to keep the category names and the test set hash of puzzles in
+sync with their categories and tests, and to invalidate the cached featured puzzles when puzzles or categories
+change.
 
 https://docs.djangoproject.com/en/5.0/ref/signals/#post-save
 https://docs.djangoproject.com/en/5.0/topics/signals/
 """
 
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_save, pre_delete, post_delete, m2m_changed
 from django.dispatch import receiver
-from django.contrib.auth.models import User
-from .models import Development, Attempt
+from .models import Puzzle, PuzzleTest, Category
+from .cache import invalidate_featured
 
-@receiver(post_save)
-def update_completed_dev_on_attempt(sender, instance, created, raw, using, update_fields, **kwargs):
-    """Run when any attempt is marked as passed"""
-    if sender is Attempt and instance.passed:
-        instance.development.completed = True
-        instance.save()
+@receiver(m2m_changed, sender=Puzzle.categories.through)
+def update_category_names(sender, instance, action, reverse, pk_set, **kwargs):
+    """Run when categories are added to or removed from puzzles, from either side of the relation"""
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            Puzzle.objects.filter(pk=instance.pk).refresh_category_names()
+        return
 
+    # The instance is a category
+    if action == "pre_clear":
+        instance._cleared_puzzles = list(instance.puzzle_set.values_list("pk", flat=True))
+    elif action in ("post_add", "post_remove"):
+        Puzzle.objects.filter(pk__in=pk_set).refresh_category_names()
+    elif action == "post_clear":
+        Puzzle.objects.filter(pk__in=instance._cleared_puzzles).refresh_category_names()
+
+@receiver(post_save, sender=Category)
+def rename_category_names(sender, instance, created, **kwargs):
+    if not created:
+        Puzzle.objects.filter(categories=instance).refresh_category_names()
+
+@receiver(pre_delete, sender=Category)
+def remember_category_puzzles(sender, instance, **kwargs):
+    instance._cleared_puzzles = list(instance.puzzle_set.values_list("pk", flat=True))
+
+@receiver(post_delete, sender=Category)
+def remove_category_names(sender, instance, **kwargs):
+    Puzzle.objects.filter(pk__in=instance._cleared_puzzles).refresh_category_names()
+
+@receiver(post_save, sender=PuzzleTest)
+@receiver(post_delete, sender=PuzzleTest)
+def refresh_testset_hash(sender, instance, **kwargs):
+    """Run when a test is added, changed or removed, so that submissions reference the current test set"""
+    Puzzle.objects.filter(pk=instance.puzzle_id).refresh_testset_hash()
+
+@receiver(post_save, sender=Puzzle)
+@receiver(post_delete, sender=Puzzle)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(m2m_changed, sender=Puzzle.categories.through)
+def invalidate_featured_puzzles(sender, **kwargs):
+    """Run when a puzzle, a category or the categories of a puzzle change. The cache is invalidated once the
+    change is committed, so that it cannot be rebuilt from the state before it."""
+    if kwargs.get("action", "post_").startswith("post_"):
+        transaction.on_commit(invalidate_featured)
@@ -0,0 +1,80 @@
+"""
+puzzle.states
+
+Lifecycle of an attempt while it is judged, kept in Redis: queued → compiling → running → done.
+
+States only move forward, so that a late or retried update cannot bring an attempt back. Along with the
+state, the owner is stored, which lets status lookups be authorized without touching the database. Only
+the final result of an attempt is persisted in Postgres.
+"""
+
+import logging
+
+import redis
+
+from AlgoBattles import settings
+
+QUEUED = "queued"
+COMPILING = "compiling"
+RUNNING = "running"
+DONE = "done"
+
+ORDER = (QUEUED, COMPILING, RUNNING, DONE)
+
+# Sets the state, unless the attempt is already in the same or a later one
+ADVANCE_SCRIPT = """
+local current = tonumber(redis.call('HGET', KEYS[1], 'rank') or '-1')
+if tonumber(ARGV[2]) <= current then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'state', ARGV[1], 'rank', ARGV[2])
+if ARGV[3] ~= '' then
+    redis.call('HSET', KEYS[1], 'owner', ARGV[3])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+"""
+
+_client = None
+_advance = None
+
+def get_client():
+    global _client, _advance
+    if _client is None:
+        _client = redis.Redis.from_url(settings.ATTEMPT_STATE_REDIS_URL, socket_connect_timeout=0.5, socket_timeout=0.5)
+        _advance = _client.register_script(ADVANCE_SCRIPT)
+
+    return _client
+
+def state_key(attempt_id):
+    return f"attempt:{attempt_id}:state"
+
+def advance(attempt_id, state, owner=None) -> bool:
+    """Move the attempt to state. Returns whether it changed."""
+    get_client()
+
+    try:
+        return bool(_advance(
+            keys=[state_key(attempt_id)],
+            args=[state, ORDER.index(state), "" if owner is None else owner, settings.ATTEMPT_STATE_TTL]
+        ))
+    except redis.RedisError as e:
+        logging.warning(f"Cannot set attempt {attempt_id} {state}: {e}")
+        return False
+
+def get_state(attempt_id):
+    """Returns (state, owner id) of the attempt, or None if unknown"""
+    try:
+        values = get_client().hmget(state_key(attempt_id), "state", "owner")
+    except redis.RedisError as e:
+        logging.warning(f"Cannot get attempt {attempt_id} state: {e}")
+        return None
+
+    state, owner = values
+    if state is None:
+        return None
+
+    return state.decode(), int(owner) if owner is not None else None
+
+def etag(attempt_id, state):
+    return f'"attempt-{attempt_id}-{state}"'
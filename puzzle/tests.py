@@ -1,6 +1,19 @@
 from django.test import TestCase
 from rest_framework.test import APIClient
 from .models import *
+from . import states
+from .consumers import AttemptConsumer
+from .notify import user_group
+from .publisher.serializers import PuzzleSerializer
+from .cache import invalidate_featured, autocomplete_cache
+from engine.checkers import checker_ref
+from django.contrib.auth.models import User
+from rest_framework.authtoken.models import Token
+from django.contrib.auth.models import Group
+import redis
+from unittest import mock, skipUnless
+from AlgoBattles import settings
+from utils.testing import redis_available
 
 class AnonUserCapabilities(TestCase):
     """
@@ -95,3 +108,408 @@ class AnonUserCapabilities(TestCase):
         response = self.client.get("/api/puzzle/completed/")
 
         self.assertEqual(response.status_code, 401)
+
+
+@skipUnless(redis_available(settings.ATTEMPT_STATE_REDIS_URL), "requires a live Redis")
+class AttemptStatePolling(TestCase):
+    """Attempts being judged are answered from their state in Redis, with conditional GET support"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="poller", password="a")
+        token, _ = Token.objects.get_or_create(user=self.user)
+
+        puzzle = Puzzle.objects.create(
+            title="Polling puzzle",
+            difficulty=Puzzle.DifficultyLevel.EASY,
+            description="A description",
+            time_constraint = 1,
+            memory_constraint = 1,
+        )
+        dev = Development.objects.create(user=self.user, puzzle=puzzle)
+        self.attempt = Attempt.objects.create(development=dev, passed=False, results="")
+        self.addCleanup(states.get_client().delete, states.state_key(self.attempt.pk))
+
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        self.url = f"/api/puzzle/attempt_result/{self.attempt.pk}"
+
+    def test_state_without_database(self):
+        states.advance(self.attempt.pk, states.QUEUED, owner=self.user.id)
+        states.advance(self.attempt.pk, states.RUNNING)
+
+        with self.assertNumQueries(1):  # Token authentication only
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["state"], states.RUNNING)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_states_only_advance(self):
+        states.advance(self.attempt.pk, states.RUNNING, owner=self.user.id)
+
+        self.assertFalse(states.advance(self.attempt.pk, states.COMPILING))
+        self.assertEqual(states.get_state(self.attempt.pk), (states.RUNNING, self.user.id))
+
+    def test_done_from_database(self):
+        self.attempt.passed = True
+        self.attempt.results = '{"0": "passed"}'
+        self.attempt.save()
+        states.advance(self.attempt.pk, states.DONE, owner=self.user.id)
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["state"], states.DONE)
+        self.assertTrue(response.data["passed"])
+
+
+class AttemptConsumerMessages(TestCase):
+    def consumer(self):
+        consumer = AttemptConsumer()
+        consumer.channel_layer = mock.AsyncMock()
+        consumer.channel_name = "channel"
+        consumer.user = None
+        consumer.close = mock.Mock()
+        return consumer
+
+    def test_invalid_messages_close(self):
+        for content in ({}, [], {"authenticate": "token"}, {"authenticate": {"token": 1}}):
+            consumer = self.consumer()
+            consumer.receive_json(content)
+            consumer.close.assert_called_once_with(AttemptConsumer.INVALID_MESSAGE, mock.ANY)
+
+    def test_reauthentication_leaves_previous_group(self):
+        first, second = (User.objects.create_user(username=name, password="a") for name in ("first", "second"))
+        consumer = self.consumer()
+
+        consumer.receive_json({"authenticate": {"token": Token.objects.create(user=first).key}})
+        consumer.receive_json({"authenticate": {"token": Token.objects.create(user=second).key}})
+
+        consumer.channel_layer.group_discard.assert_awaited_once_with(user_group(first.id), "channel")
+        consumer.channel_layer.group_add.assert_awaited_with(user_group(second.id), "channel")
+        consumer.close.assert_not_called()
+
+
+class CheckerValidation(TestCase):
+    def test_checker_language_is_supported(self):
+        data = {
+            "title": "Checked puzzle", "description": "A description", "time_constraint": 1, "memory_constraint": 1,
+            "categories": [], "checker": "int main() { return 0; }",
+        }
+
+        for language in ("", "pascal"):
+            serializer = PuzzleSerializer(data={**data, "checker_language": language})
+            self.assertFalse(serializer.is_valid())
+            self.assertIn("checker_language", serializer.errors)
+
+        self.assertTrue(PuzzleSerializer(data={**data, "checker_language": "c"}).is_valid())
+
+
+class AttemptSubmission(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username="submitter", password="a")
+        token, _ = Token.objects.get_or_create(user=user)
+        self.puzzle = Puzzle.objects.create(
+            title="Submitted puzzle",
+            difficulty=Puzzle.DifficultyLevel.EASY,
+            description="A description",
+            time_constraint = 1,
+            memory_constraint = 1,
+        )
+
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        self.url = f"/api/puzzle/{self.puzzle.pk}/attempt"
+
+    def test_fail_fast_form_values(self):
+        for value, expected in (("false", False), ("0", False), ("true", True), ("1", True)):
+            with mock.patch("puzzle.views.test_chain") as test_chain:
+                test_chain.return_value.id = "task"
+                response = self.client.post(self.url, {"language": "c", "source": "", "fail_fast": value})
+
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(test_chain.call_args.kwargs["fail_fast"], expected)
+
+        response = self.client.post(self.url, {"language": "c", "source": "", "fail_fast": "maybe"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_checker_sent_by_reference(self):
+        self.puzzle.checker = "int main() { return 0; }"
+        self.puzzle.checker_language = "c"
+        self.puzzle.save()
+
+        with mock.patch("puzzle.views.test_chain") as test_chain:
+            test_chain.return_value.id = "task"
+            self.client.post(self.url, {"language": "c", "source": ""})
+
+        self.assertEqual(test_chain.call_args.kwargs["checker"], checker_ref(self.puzzle))
+
+
+class ListQueryBudget(TestCase):
+    """Puzzle list endpoints run a fixed number of queries whatever the page size. See the listbench command
+    for their latency"""
+
+    PUZZLES = 2000
+    CATEGORIES = 50
+
+    @classmethod
+    def setUpTestData(cls):
+        categories = Category.objects.bulk_create(
+            [Category(name=f"category-{i}", featured=i < 5) for i in range(cls.CATEGORIES)]
+        )
+
+        cls.publisher = User.objects.create_user(username="publisher", password="a")
+        cls.publisher.groups.add(Group.objects.get_or_create(name="Publishers")[0])
+        cls.user = User.objects.create_user(username="solver", password="a")
+
+        puzzles = Puzzle.objects.bulk_create([
+            Puzzle(
+                title=f"Puzzle {i} on graph paths",
+                description="Find the shortest path in the graph",
+                time_constraint=1,
+                memory_constraint=1,
+                visibility=Puzzle.Visibility.PUBLIC if i % 10 else Puzzle.Visibility.HIDDEN,
+                publisher=cls.publisher if i % 20 == 0 else None,
+            ) for i in range(cls.PUZZLES)
+        ])
+
+        Through = Puzzle.categories.through
+        Through.objects.bulk_create([
+            Through(puzzle_id=p.id, category_id=categories[(i + k) % cls.CATEGORIES].id)
+            for i, p in enumerate(puzzles) for k in (0, 7)
+        ])
+        # Bulk inserts send no m2m_changed signal
+        Puzzle.objects.refresh_category_names()
+
+        Development.objects.bulk_create([
+            Development(user=cls.user, puzzle=p, completed=i % 2 == 0) for i, p in enumerate(puzzles[1:400])
+        ])
+
+        cls.user_token = Token.objects.create(user=cls.user).key
+        cls.publisher_token = Token.objects.create(user=cls.publisher).key
+
+    def assertBudget(self, url, queries, token=None):
+        client = APIClient()
+        if token:
+            client.credentials(HTTP_AUTHORIZATION='Token ' + token)
+
+        with self.assertNumQueries(queries):
+            response = client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    # Page and prefetched categories, the count only when asked
+
+    def test_puzzle_list(self):
+        response = self.assertBudget("/api/puzzle?page_size=1000", 2)
+        self.assertEqual(len(response.data["results"]), 1000)
+        self.assertEqual(len(response.data["results"][0]["categories"]), 2)
+        self.assertNotIn("count", response.data)
+
+        response = self.assertBudget("/api/puzzle?page_size=1000&count=1", 3)
+        self.assertEqual(response.data["count"], self.PUZZLES * 9 // 10)
+
+    def test_category_filter(self):
+        response = self.assertBudget("/api/puzzle?category=category-3&page_size=1000", 2)
+        self.assertTrue(all("category-3" in p["categories"] for p in response.data["results"]))
+
+    def test_deep_pages(self):
+        url, seen = "/api/puzzle?page_size=1000", []
+        while url:
+            response = self.assertBudget(url, 2)
+            seen += [p["id"] for p in response.data["results"]]
+            url = response.data["next"]
+
+        self.assertEqual(len(seen), self.PUZZLES * 9 // 10)
+        self.assertEqual(seen, sorted(set(seen), reverse=True))
+
+    def test_search(self):
+        self.assertBudget("/api/search?t=graph&page_size=1000", 3)
+
+    def test_faceted_search(self):
+        # Facets, then the page
+        response = self.assertBudget("/api/search/facets?t=graph&category=category-3&page_size=100", 2)
+        self.assertEqual(len(response.data["results"]), 100)
+        self.assertEqual(response.data["facets"]["categories"]["category-3"], response.data["count"])
+
+    # Plus the token lookup
+
+    def test_attempted(self):
+        response = self.assertBudget("/api/puzzle/attempted/?page_size=1000", 3, self.user_token)
+        self.assertEqual(len(response.data["results"]), 399)
+
+    def test_completed(self):
+        response = self.assertBudget("/api/puzzle/completed/?page_size=1000", 3, self.user_token)
+        self.assertEqual(len(response.data["results"]), 200)
+
+    def test_attempts_of_puzzle(self):
+        dev = Development.objects.filter(user=self.user).latest("id")
+        Attempt.objects.bulk_create([Attempt(development=dev, results="") for _ in range(3)])
+
+        # Plus the development lookup
+        response = self.assertBudget(f"/api/puzzle/{dev.puzzle_id}/attempt?page_size=2", 3, self.user_token)
+        self.assertEqual(len(response.data["results"]), 2)
+        self.assertIsNotNone(response.data["next"])
+
+    # Plus the token lookup and the publisher group check
+
+    def test_publisher_list(self):
+        self.assertBudget("/api/publisher/list?page_size=1000", 5, self.publisher_token)
+
+    def test_publisher_search(self):
+        self.assertBudget("/api/publisher/search?q=graph&page_size=1000", 5, self.publisher_token)
+
+    def test_featured(self):
+        invalidate_featured()
+
+        # Featured categories, then a page and its categories for each one
+        response = self.assertBudget("/api/featured", 1 + 2 * 5)
+        self.assertEqual(len(response.data), 5)
+
+        # Then from the cache
+        self.assertBudget("/api/featured", 0)
+
+
+class FeaturedCache(TestCase):
+    """The featured puzzles payload is cached until a puzzle or a category changes"""
+
+    def setUp(self):
+        invalidate_featured()
+
+        self.category = Category.objects.create(name="featured", featured=True)
+        self.puzzle = Puzzle.objects.create(
+            title="Featured puzzle",
+            difficulty=Puzzle.DifficultyLevel.EASY,
+            description="A description",
+            time_constraint = 1,
+            memory_constraint = 1,
+            visibility=Puzzle.Visibility.PUBLIC,
+        )
+        self.puzzle.categories.add(self.category)
+        self.client = APIClient()
+
+    def titles(self):
+        return [p["title"] for p in self.client.get("/api/featured").data[0]["puzzles"]]
+
+    def test_invalidated_on_puzzle_change(self):
+        self.assertEqual(self.titles(), ["Featured puzzle"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.puzzle.title = "Renamed puzzle"
+            self.puzzle.save()
+
+        self.assertEqual(self.titles(), ["Renamed puzzle"])
+
+    def test_invalidated_on_categories_change(self):
+        self.assertEqual(self.titles(), ["Featured puzzle"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.puzzle.categories.remove(self.category)
+
+        self.assertEqual(self.client.get("/api/featured").data[0]["puzzles"], [])
+
+    def test_saved_when_cache_unavailable(self):
+        with mock.patch("puzzle.cache.cache.incr", side_effect=redis.ConnectionError("down")):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.puzzle.title = "Renamed puzzle"
+                self.puzzle.save()
+
+        self.assertEqual(Puzzle.objects.get(pk=self.puzzle.pk).title, "Renamed puzzle")
+
+
+class FacetedSearch(TestCase):
+    """Puzzles keep the names of their categories in sync, for the faceted search"""
+
+    def setUp(self):
+        self.graphs = Category.objects.create(name="graphs")
+        self.strings = Category.objects.create(name="strings")
+
+        self.puzzles = [
+            Puzzle.objects.create(
+                title=title,
+                difficulty=difficulty,
+                description="A description",
+                time_constraint = 1,
+                memory_constraint = 1,
+            ) for title, difficulty in (
+                ("Shortest path", Puzzle.DifficultyLevel.EASY),
+                ("Longest path", Puzzle.DifficultyLevel.HARD),
+                ("Palindromes", Puzzle.DifficultyLevel.EASY),
+            )
+        ]
+        self.puzzles[0].categories.add(self.graphs)
+        self.puzzles[1].categories.add(self.graphs, self.strings)
+        self.strings.puzzle_set.add(self.puzzles[2])
+
+    def names(self):
+        return [p.category_names for p in Puzzle.objects.order_by("id")]
+
+    def test_category_names(self):
+        self.assertEqual(self.names(), [["graphs"], ["graphs", "strings"], ["strings"]])
+
+        self.puzzles[1].categories.remove(self.graphs)
+        self.graphs.name = "trees"
+        self.graphs.save()
+        self.assertEqual(self.names(), [["trees"], ["strings"], ["strings"]])
+
+        self.strings.delete()
+        self.assertEqual(self.names(), [["trees"], [], []])
+
+    def test_facets(self):
+        response = APIClient().get("/api/search/facets?t=path")
+
+        self.assertEqual(response.data["count"], 2)
+        self.assertEqual(response.data["facets"], {
+            "categories": {"graphs": 2, "strings": 1},
+            "difficulty": {"E": 1, "H": 1},
+        })
+
+        response = APIClient().get("/api/search/facets?category=graphs&category=strings")
+        self.assertEqual([p["title"] for p in response.data["results"]], ["Longest path"])
+
+
+class Autocomplete(TestCase):
+    """Title suggestions match prefixes and typos. See the autocompletebench command for their latency"""
+
+    PUZZLES = 1000
+    WORDS = ["graph", "path", "tree", "string", "prime", "matrix", "sort", "queue", "heap", "flow"]
+
+    @classmethod
+    def setUpTestData(cls):
+        Puzzle.objects.bulk_create([
+            Puzzle(
+                title=f"{cls.WORDS[i % 10].capitalize()} {cls.WORDS[i // 10 % 10]} {i}",
+                description="A description",
+                time_constraint=1,
+                memory_constraint=1,
+                visibility=Puzzle.Visibility.PRIVATE if i % 100 == 99 else Puzzle.Visibility.PUBLIC,
+            ) for i in range(cls.PUZZLES)
+        ])
+        Puzzle.objects.create(
+            title="Shortest path", description="A description", time_constraint=1, memory_constraint=1
+        )
+
+    def setUp(self):
+        autocomplete_cache.clear()
+        self.client = APIClient()
+
+    def titles(self, q):
+        return [s["title"] for s in self.client.get(f"/api/search/autocomplete?q={q}").data]
+
+    def test_prefix(self):
+        titles = self.titles("Heap%20str")
+        self.assertEqual(len(titles), 10)
+        self.assertTrue(all(t.startswith("Heap string") for t in titles))
+        self.assertEqual(titles, sorted(titles, key=str.lower))
+
+    def test_typo(self):
+        self.assertEqual(self.titles("shortst")[0], "Shortest path")
+
+    def test_cached(self):
+        self.assertEqual(len(self.titles("gr")), 10)
+
+        with self.assertNumQueries(0):
+            self.titles("gr")
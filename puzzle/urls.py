@@ -6,6 +6,8 @@ urlpatterns = [
     path("puzzle", views.PuzzleList.as_view(), name="puzzle-list"),
     path("featured", views.FeaturedPuzzleView.as_view(), name="puzzle-list"),
     path("search", views.SearchPuzzleView.as_view(), name="search-puzzle-list"),
+    path("search/facets", views.FacetedSearchView.as_view(), name="faceted-search"),
+    path("search/autocomplete", views.AutocompleteView.as_view(), name="autocomplete"),
     path("puzzle/<pk>", views.PuzzleView.as_view(), name="puzzle"),
     path("puzzle/<pk>/test", views.public_tests_for_puzzle, name="puzzle-tests-list"),
     path("puzzle/<pk>/attempt", views.AttemptsView.as_view({"get": "list_for_puzzle", "post": "create_for_puzzle"}), name="attempts-list"),
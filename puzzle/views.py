@@ -2,11 +2,19 @@ from rest_framework import generics, pagination, views, status, authentication,
 from rest_framework.decorators import api_view, action
 from rest_framework.response import Response
 from rest_framework.throttling import ScopedRateThrottle
-from . import serializers
+from rest_framework.fields import BooleanField
+from rest_framework.exceptions import ValidationError
+from . import serializers, states
+from .cache import featured_payload, autocomplete_cache
 from .models import Puzzle, Category, PuzzleTest, Development, Attempt
 from engine.tasks import test_chain
+from engine.testsets import testset_ref
+from engine.checkers import checker_ref
+from utils.metrics import span
+from AlgoBattles import settings
 import logging
-from django.db.models import Exists, OuterRef
+from django.db.models import Exists, OuterRef, Prefetch
+from django.utils.http import parse_etags
 from utils.permissions import IsBrowserAuthenticated
 from django.contrib.postgres.search import SearchQuery, SearchRank
 from django.db.models import F, Q
@@ -31,19 +39,39 @@ class StandardResultsSetPagination(pagination.PageNumberPagination):
     page_size_query_param = 'page_size'
     max_page_size = 1000
 
+class KeysetPagination(pagination.CursorPagination):
+    """Pages on the position of the last item in an indexed ordering, rather than on an offset, so that deep
+    pages cost the same as the first one. The total is counted only when asked with count=1."""
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    ordering = "-id"
+    count_query_param = "count"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = queryset.count() if request.query_params.get(self.count_query_param) == "1" else None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.count is not None:
+            response.data = {"count": self.count, **response.data}
+
+        return response
+
 class PuzzleList(generics.ListAPIView):
     serializer_class = serializers.PuzzleListSerializer
-    pagination_class = StandardResultsSetPagination
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         category = self.request.query_params.get("category", None)
         difficulty = self.request.query_params.get("difficulty", None)
 
-        puzzles = Puzzle.objects.filter(visibility=Puzzle.Visibility.PUBLIC)
+        puzzles = Puzzle.objects.filter(visibility=Puzzle.Visibility.PUBLIC).with_categories()
 
         if category is not None:
             category = category.lower()
-            puzzles = puzzles.filter(categories__name=category)
+            puzzles = puzzles.filter(category_names__contains=[category])
 
         if difficulty is not None:
             puzzles = puzzles.filter(difficulty=difficulty)
@@ -64,23 +92,29 @@ class PuzzleView(generics.RetrieveAPIView):
     
 
 class FeaturedPuzzleView(views.APIView):
+    """Featured categories and their puzzles. The payload is cached, see puzzle.cache"""
+
     def get(self, request, format=None):
+        return Response(featured_payload(self.build), status=status.HTTP_200_OK)
+
+    @staticmethod
+    def build():
         serializer_class = serializers.PuzzleListSerializer
 
         featured_cats = Category.objects.filter(featured=True)
         puzzles = [
-            Puzzle.objects.filter(visibility=Puzzle.Visibility.PUBLIC, categories=fcat)[:MAX_FEATURED] for fcat in featured_cats
+            Puzzle.objects.filter(visibility=Puzzle.Visibility.PUBLIC, categories=fcat).with_categories()[:MAX_FEATURED]
+            for fcat in featured_cats
         ]
 
-        data = [
+        # Plain lists and dicts, to be pickled in the cache
+        return [
             {
                 "name": fcat.name,
-                "puzzles": serializer_class(p, many=True).data
+                "puzzles": [dict(item) for item in serializer_class(p, many=True).data]
             } for fcat, p in zip(featured_cats, puzzles)
         ]
 
-        return Response(data, status=status.HTTP_200_OK)
-
 @api_view(["GET"])
 def public_tests_for_puzzle(request, pk):
     queryset = PuzzleTest.objects.filter(
@@ -100,6 +134,11 @@ class AttemptsView(viewsets.ModelViewSet):
     permission_classes = (IsBrowserAuthenticated, )
     serializer_class = serializers.AttemptListSerializer
 
+    # Run every test by default. Clients may ask to stop at the first test not passed with "fail_fast"
+    fail_fast = False
+    queue = settings.ENGINE_PRACTICE_QUEUE
+    pagination_class = KeysetPagination
+
     def _corresponding_development(self, user, puzzle_id) -> Development:
         obj, created = Development.objects.get_or_create(user=user, puzzle_id=puzzle_id, challenge=None)
         return obj
@@ -113,15 +152,25 @@ class AttemptsView(viewsets.ModelViewSet):
 
         dev = self._corresponding_development(request.user, pk)
         res = Attempt.objects.filter(development__id=dev.id)
-        serializer = self.get_serializer(res, many=True)
-        return Response(serializer.data)
+        page = self.paginate_queryset(res)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
     
     @action(detail=True, methods=["post"])
     def create_for_puzzle(self, request, pk):
+        with span("submit"):
+            return self._create_for_puzzle(request, pk)
+
+    def _create_for_puzzle(self, request, pk):
         try:
             pk = int(pk)    #puzzle key
         except ValueError:
             return Response({"reason": "Invalid puzzle key"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            fail_fast = BooleanField().to_internal_value(request.data.get("fail_fast", self.fail_fast))
+        except ValidationError:
+            return Response({"reason": "Invalid fail_fast"}, status=status.HTTP_400_BAD_REQUEST)
         
         dev = self._corresponding_development(request.user, pk)
 
@@ -131,15 +180,23 @@ class AttemptsView(viewsets.ModelViewSet):
         a = Attempt.objects.create(development=dev, passed=False, results="")
         uid = str(a.pk)
 
-        priv_tests = PuzzleTest.objects.filter(puzzle__id=pk, is_private=True)
         puzzle = Puzzle.objects.filter(id=pk).get()
 
-        tests = [(i, t.input, t.output) for i, t in enumerate(priv_tests)]
+        # Workers fetch the tests by reference, once per test set version
+        tests = testset_ref(puzzle)
 
         logging.debug(tests)
         logging.debug(f"{puzzle.time_constraint} s, {puzzle.memory_constraint} B")
 
-        task_result = test_chain(request.data.get("language"), request.data.get("source"), uid, tests, puzzle.time_constraint, puzzle.memory_constraint)
+        states.advance(uid, states.QUEUED, owner=request.user.id)
+
+        # Like the tests, the checker is sent by reference
+        checker = checker_ref(puzzle)
+
+        task_result = test_chain(
+            request.data.get("language"), request.data.get("source"), uid, tests, puzzle.time_constraint, puzzle.memory_constraint,
+            fail_fast=fail_fast, tolerance=puzzle.float_tolerance, checker=checker, queue=self.queue
+        )
         a.task_id = task_result.id
         a.save()
 
@@ -147,6 +204,11 @@ class AttemptsView(viewsets.ModelViewSet):
     
 
 class MultiplayerAttemptsView(AttemptsView):
+    # Only passing or not matters in a challenge
+    fail_fast = True
+    # Attempts deciding a live match are judged before practice attempts
+    queue = settings.ENGINE_CHALLENGE_QUEUE
+
     def _corresponding_development(self, user, puzzle_id) -> Development:
         cid = self.request.query_params.get("chal")
         obj, _ = Development.objects.get_or_create(user=user, puzzle_id=puzzle_id, challenge_id=cid)
@@ -154,7 +216,11 @@ class MultiplayerAttemptsView(AttemptsView):
 
 
 class PollingAttemptResultView(generics.RetrieveAPIView):
-    """Gets the result of a build-test chain with polling"""
+    """Gets the result of a build-test chain with polling. Clients connected to ws/attempts receive
+    the result as soon as it is available instead.
+
+    While the attempt is judged, its state is answered from Redis without querying the database. Responses
+    carry an ETag of the state, so that clients polling with If-None-Match get 304 until it changes."""
     authentication_classes = (authentication.TokenAuthentication,)
     permission_classes = (IsBrowserAuthenticated,)
     serializer_class = serializers.AttemptListSerializer
@@ -170,46 +236,69 @@ class PollingAttemptResultView(generics.RetrieveAPIView):
             development__user=self.request.user
         )
 
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            tid = int(self.kwargs['tid'])
+        except ValueError:
+            return Response({"reason": "Invalid attempt id"}, status=status.HTTP_400_BAD_REQUEST)
 
-class AttemptedPuzzleView(generics.ListAPIView):
-    """Returns a list of attempted puzzle for the authenticated user."""
+        known = states.get_state(tid)
+        if known is not None and known[1] == request.user.id:
+            state, _ = known
+            tag = states.etag(tid, state)
 
-    serializer_class = serializers.PuzzleListSerializer
-    authentication_classes = (authentication.TokenAuthentication,)
-    permission_classes = (permissions.IsAuthenticated,)
-    pagination_class = StandardResultsSetPagination
-    
-    def get_queryset(self):
-        return Puzzle.objects.filter(
-            Exists(
-                Development.objects.filter(
-                    puzzle=OuterRef('pk'),
-                    user=self.request.user
+            if tag in parse_etags(request.headers.get("If-None-Match", "")):
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": tag})
+
+            if state != states.DONE:
+                return Response(
+                    {"state": state, "passed": False, "results": "", "build_error": False}, headers={"ETag": tag}
                 )
-            ),
-            ~Q(visibility=Puzzle.Visibility.PRIVATE)
-        ).order_by("-development__id")
-    
 
-class CompletedPuzzleView(generics.ListAPIView):
-    """Returns a list of completed puzzle for the authenticated user."""
+        attempt = self.get_object()
+        state = states.DONE if attempt.results else states.QUEUED
+        data = {"state": state, **self.get_serializer(attempt).data}
+
+        return Response(data, headers={"ETag": states.etag(tid, state)})
+
+
+class DevelopedPuzzleView(generics.ListAPIView):
+    """Puzzles the authenticated user has a development on, most recently developed first. Pages are taken
+    from the developments of the user, keeping only the latest one of each puzzle."""
 
     serializer_class = serializers.PuzzleListSerializer
     authentication_classes = (authentication.TokenAuthentication,)
     permission_classes = (permissions.IsAuthenticated,)
-    pagination_class = StandardResultsSetPagination
-    
+    pagination_class = KeysetPagination
+
+    def get_developments(self):
+        return Development.objects.filter(user=self.request.user)
+
     def get_queryset(self):
-        return Puzzle.objects.filter(
-            Exists(
-                Development.objects.filter(
-                    puzzle=OuterRef('pk'),
-                    user=self.request.user,
-                    completed=True
-                )
-            ),
-            ~Q(visibility=Puzzle.Visibility.PRIVATE)
-        ).order_by("-development__id")
+        developments = self.get_developments()
+
+        return developments.filter(
+            ~Exists(developments.filter(puzzle=OuterRef('puzzle'), id__gt=OuterRef('id'))),
+            ~Q(puzzle__visibility=Puzzle.Visibility.PRIVATE)
+        ).select_related("puzzle").prefetch_related(
+            Prefetch("puzzle__categories", queryset=Category.objects.only("name"))
+        )
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.get_queryset())
+        serializer = self.get_serializer([dev.puzzle for dev in page], many=True)
+        return self.get_paginated_response(serializer.data)
+
+
+class AttemptedPuzzleView(DevelopedPuzzleView):
+    """Returns a list of attempted puzzle for the authenticated user."""
+
+
+class CompletedPuzzleView(DevelopedPuzzleView):
+    """Returns a list of completed puzzle for the authenticated user."""
+
+    def get_developments(self):
+        return super().get_developments().filter(completed=True)
 
 
 class SearchPuzzleView(generics.ListAPIView):
@@ -220,7 +309,7 @@ class SearchPuzzleView(generics.ListAPIView):
 
     def get_queryset(self):
         search_query = self.request.query_params.get('t', None)
-        queryset = Puzzle.objects.filter(~Q(visibility=Puzzle.Visibility.PRIVATE))
+        queryset = Puzzle.objects.filter(~Q(visibility=Puzzle.Visibility.PRIVATE)).with_categories()
 
         if search_query:
             query = SearchQuery(search_query)
@@ -229,3 +318,75 @@ class SearchPuzzleView(generics.ListAPIView):
             queryset = Puzzle.objects.none()
 
         return queryset
+
+
+class FacetedSearchView(views.APIView):
+    """Full text search on puzzles (t), filtered by categories (category, repeated to require several) and
+    difficulty. Along with a page of results, returns the number of matches per category and per difficulty.
+    Filters use the GIN indexes on search_vector and category_names."""
+
+    DEFAULT_PAGE_SIZE = 20
+    MAX_PAGE_SIZE = 100
+
+    def get(self, request):
+        params = request.query_params
+        try:
+            page = max(int(params.get("page", 1)), 1)
+            page_size = min(max(int(params.get("page_size", self.DEFAULT_PAGE_SIZE)), 1), self.MAX_PAGE_SIZE)
+        except ValueError:
+            return Response({"reason": "Invalid page"}, status=status.HTTP_400_BAD_REQUEST)
+
+        puzzles = Puzzle.objects.filter(~Q(visibility=Puzzle.Visibility.PRIVATE))
+
+        categories = [category.lower() for category in params.getlist("category")]
+        if categories:
+            puzzles = puzzles.filter(category_names__contains=categories)
+
+        difficulty = params.get("difficulty")
+        if difficulty:
+            puzzles = puzzles.filter(difficulty=difficulty)
+
+        text = params.get("t")
+        if text:
+            query = SearchQuery(text, config="english")
+            puzzles = puzzles.filter(search_vector=query).annotate(
+                rank=SearchRank(F('search_vector'), query)
+            ).order_by('-rank', '-id')
+        else:
+            puzzles = puzzles.order_by('-id')
+
+        facets = puzzles.facets()
+        results = puzzles[(page - 1) * page_size:page * page_size]
+
+        return Response({
+            "count": sum(facets["difficulty"].values()),
+            "results": serializers.FacetedPuzzleSerializer(results, many=True).data,
+            "facets": facets,
+        })
+
+
+class AutocompleteView(views.APIView):
+    """Title suggestions for type-ahead (q): titles starting with q, then titles close to it. Suggestions of
+    hot prefixes are served from a cache in each process, see puzzle.cache."""
+
+    DEFAULT_LIMIT = 10
+    MAX_LIMIT = 20
+    MAX_PREFIX = 100
+
+    def get(self, request):
+        prefix = " ".join(request.query_params.get("q", "").lower().split())[:self.MAX_PREFIX]
+        try:
+            limit = min(max(int(request.query_params.get("limit", self.DEFAULT_LIMIT)), 1), self.MAX_LIMIT)
+        except ValueError:
+            return Response({"reason": "Invalid limit"}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not prefix:
+            return Response([])
+
+        suggestions = autocomplete_cache.get((prefix, limit))
+        if suggestions is None:
+            puzzles = Puzzle.objects.filter(~Q(visibility=Puzzle.Visibility.PRIVATE))
+            suggestions = [{"id": pk, "title": title} for pk, title in puzzles.autocomplete(prefix, limit)]
+            autocomplete_cache.put((prefix, limit), suggestions)
+
+        return Response(suggestions)
@@ -1,3 +1,4 @@
 #!/bin/sh
 
 docker build -t algobattles-solver .
+docker build -t algobattles-sandbox -f Dockerfile.sandbox .
@@ -1,76 +1,437 @@
 """
 solver.py
 
-Run `artifact` from /chunk with input.txt test cases and compare results against expected output.
+Run `artifact` from /chunk with the private test cases and compare results against expected output.
+
+Each line printed on stdout is a JSON record: one {"progress": {...}} record per judged test, as tests
+complete, and finally the results of all the tests.
 
 Expect contents of /chunk:
 artifact -> an executable file (shebang can be configured for interpreted languages) to be run
-input.txt -> private test input
-output.txt -> expected output
+tests/index.json -> list of test ids, in order
+tests/<id>.in -> private test input, fed to the artifact stdin straight from the file
+tests/<id>.out -> expected output, memory mapped for the comparison
+
+Outputs are compared token by token while they are produced. If /chunk contains a `checker` executable, it
+decides instead whether each output is correct.
+
+When started with --build, the source in /chunk is compiled first with the provided command. If the build
+fails, compiler errors are written to stderr and the solver exits with status BUILD_FAILED. With
+--build-checker, the checker source in /chunk/checker-build is compiled the same way into /chunk/checker,
+exiting with status CHECKER_BUILD_FAILED if it does not compile.
 """
 
+import argparse
 import subprocess
+import concurrent.futures
+import threading
 import logging
+import tempfile
+import select
+import signal
+import resource
+import mmap
+import shutil
 import sys
 import json
 import time
-import psutil
+import re
+import os
 
 logging.basicConfig(level=logging.DEBUG)
 
-def main(timeout, memory_limit) -> int:
-    results = {}
+BUILD_FAILED = 3
+CHECKER_BUILD_FAILED = 4
 
-    timeout = int(timeout) * 1000
-    if timeout == 0: timeout = int(10e10)   #max 10 seconds in ns
-    memory_limit = int(memory_limit)
-    process = psutil.Process()
+DEFAULT_TIMEOUT = 10e10 / 1e9   # seconds, when no time limit is set
+CHECKER_TIMEOUT = 10            # seconds
+CHUNK_SIZE = 64 * 1024
+READER_TIMEOUT = 1              # seconds to drain the output once the test process group is killed
+MEMORY_HEADROOM = 1.25          # hard cap of test memory, relative to the limit, so that overruns are measured
+MEMORY_CAP_FLOOR = 32 * 1024 ** 2   # bytes, for the process to start and be measured under tiny limits
+CHECKER = "./checker"
+CHECKER_BUILD_DIR = "./checker-build"
+TESTS_DIR = "./tests"
+
+TOKEN = re.compile(rb"\S+")
+WHITESPACE = (b" ", b"\n", b"\t", b"\r", b"\x0b", b"\x0c")
+MAX_TOKEN_SLACK = 4096   # bytes a produced token may exceed the expected one by (e.g. float digits)
+
+def build(command, cwd=None) -> bool:
+    """Compile the source in cwd with the given shell command. Returns True on success"""
+    result = subprocess.run(command, shell=True, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        sys.stderr.write(result.stderr.decode("utf-8", errors="replace"))
+        return False
+
+    return True
+
+class Measurement():
+    """Resources used by a test run, as reported by wait4"""
+
+    def __init__(self, wall_time, cpu_time, peak_rss, timed_out):
+        self.wall_time = wall_time  # seconds
+        self.cpu_time = cpu_time    # seconds
+        self.peak_rss = peak_rss    # bytes
+        self.timed_out = timed_out
+
+    def __str__(self):
+        return f"wall {self.wall_time * 1000:.1f} ms, cpu {self.cpu_time * 1000:.1f} ms, peak rss {self.peak_rss} B"
+
+def wait_exit(pid, timeout) -> bool:
+    """Block until the process exits or the timeout expires, without reaping it.
+    Returns False on timeout."""
+
+    try:
+        pidfd = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        # No pidfd support: block on waitid in a helper thread
+        waiter = threading.Thread(target=os.waitid, args=(os.P_PID, pid, os.WEXITED | os.WNOWAIT), daemon=True)
+        waiter.start()
+        waiter.join(timeout)
+        return not waiter.is_alive()
+
+    try:
+        ready, _, _ = select.select([pidfd], [], [], timeout)
+        return bool(ready)
+    finally:
+        os.close(pidfd)
+
+def kill_group(process: subprocess.Popen):
+    """Kill the session of the test process, with every process it started"""
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+def supervise(process: subprocess.Popen, start_time, timeout) -> Measurement:
+    """Wait for process to complete, killing it when the timeout expires, and reap it with wait4 to
+    collect its resource usage. Processes it left behind are killed with it."""
+
+    remaining = max(timeout - (time.monotonic() - start_time), 0)
+    timed_out = not wait_exit(process.pid, remaining)
+
+    # Not reaped yet, so the process group id cannot be reused
+    kill_group(process)
+
+    _, status, rusage = os.wait4(process.pid, 0)
+    wall_time = time.monotonic() - start_time
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    return Measurement(
+        wall_time=wall_time,
+        cpu_time=rusage.ru_utime + rusage.ru_stime,
+        peak_rss=rusage.ru_maxrss * 1024,   # ru_maxrss is in KiB on Linux
+        timed_out=timed_out
+    )
+
+def memory_limiter(memory_limit):
+    """preexec_fn capping the data segment of the test process while it runs. The cap is a little above the
+    limit, so that a process going over it is reported as such rather than failing to allocate."""
+    if memory_limit == 0:
+        return None
+
+    cap = max(int(memory_limit * MEMORY_HEADROOM), MEMORY_CAP_FLOOR)
+
+    def limit():
+        resource.setrlimit(resource.RLIMIT_DATA, (cap, cap))
+
+    return limit
+
+class TokenComparator():
+    """Compares an output received in chunks with the expected output, token by token. Tokens are separated
+    by any amount of whitespace. With a tolerance, numeric tokens match if their absolute or relative
+    difference is within it. Memory does not depend on the output size."""
 
-    with open("./tests.txt", "r") as tfp:
-        tests = json.load(fp=tfp)
-        for i, in_line, expected_out in tests:
+    def __init__(self, expected: bytes, tolerance=0.0):
+        self.expected = TOKEN.finditer(expected)
+        self.pending = next(self.expected, None)
+        self.tolerance = tolerance
+        self.carry = b""
+        self.matches = True
+
+    def _equal(self, expected, produced):
+        if expected == produced:
+            return True
+
+        if self.tolerance <= 0:
+            return False
+
+        try:
+            e, p = float(expected), float(produced)
+        except ValueError:
+            return False
+
+        return abs(e - p) <= self.tolerance * max(1.0, abs(e))
+
+    def _match(self, token):
+        if self.pending is None or not self._equal(self.pending.group(), token):
+            self.matches = False
+            return
+
+        self.pending = next(self.expected, None)
+
+    def feed(self, data):
+        if not self.matches:
+            return
+
+        # The last token may continue in the next chunk
+        end = max(data.rfind(c) for c in WHITESPACE) + 1
+        if end == 0:
+            self.carry += data
+
+            # A token longer than the expected one can't match, no need to keep it
+            expected_len = len(self.pending.group()) if self.pending is not None else 0
+            if len(self.carry) > expected_len + MAX_TOKEN_SLACK:
+                self.matches = False
+            return
+
+        for token in TOKEN.finditer(self.carry + data[:end]):
+            self._match(token.group())
+            if not self.matches:
+                return
+
+        self.carry = data[end:]
+
+    def close(self) -> bool:
+        if self.carry and self.matches:
+            self._match(self.carry)
+
+        return self.matches and self.pending is None
+
+class MappedComparator(TokenComparator):
+    """Token comparator against an expected output file, mapped in memory"""
+
+    def __init__(self, expected_path, tolerance=0.0):
+        with open(expected_path, "rb") as fp:
             try:
-                result = subprocess.Popen("./artifact", stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                result.communicate(in_line.encode())
-                
-                start_time = time.time_ns()
-                
-                do = True
-                while do or result.poll() is None:
-                    do = False
-
-                    # Check memory usage
-                    mem_usage = process.memory_info().rss
-                    if memory_limit != 0 and mem_usage > memory_limit:
-                        result.terminate()
-                        logging.warning(f"Test {i} terminated due to excessive memory usage: {mem_usage} bytes")
-                        results[i] = "memfail"
-                        break
-                    
-                    # Check timeout
-                    if time.time_ns() - start_time > timeout:
-                        result.terminate()
-                        logging.warning(f"Test {i} terminated due to timeout")
-                        results[i] = "timeout"
-                        break
-                    
-                    time.sleep(0.0001)
-
-                else:
-                    produced_output, _ = result.communicate()
-                    produced_output = produced_output.decode()
-                    if produced_output == expected_out:
-                        logging.info(f"Test {i} passed")
-                        results[i] = "passed"
-                    else:
-                        logging.warning(f"Test {i} not passed. Expected {expected_out} but got {produced_output}")
-                        results[i] = "failed"
-            
-            except Exception as e:
-                logging.error(f"Test case {i} terminated due to error {str(e)}")
-                results[i] = "error"
+                self.map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                self.map = None     # empty files can't be mapped
+
+        super().__init__(self.map if self.map is not None else b"", tolerance)
+
+    def close(self) -> bool:
+        passed = super().close()
+
+        self.expected = self.pending = None
+        if self.map is not None:
+            self.map.close()
+
+        return passed
+
+class TokenChecker():
+    """Default checker, comparing outputs token by token"""
+
+    def __init__(self, tolerance=0.0):
+        self.tolerance = tolerance
+
+    def sink(self, i, input_path, expected_path):
+        return MappedComparator(expected_path, self.tolerance)
+
+class ExternalSink():
+    """Saves the output to a file, then runs a custom checker with `checker input expected output`. The
+    test passes if the checker exits with status 0."""
+
+    def __init__(self, path, i, input_path, expected_path):
+        self.path = path
+        self.dir = tempfile.mkdtemp(prefix=f"test{i}-", dir=".")
+        self.files = [input_path, expected_path, os.path.join(self.dir, "output")]
+
+        self.output = open(self.files[2], "wb")
+
+    def feed(self, data):
+        self.output.write(data)
+
+    def close(self) -> bool:
+        self.output.close()
+
+        try:
+            result = subprocess.run(
+                [self.path, *self.files], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL, timeout=CHECKER_TIMEOUT
+            )
+            return result.returncode == 0
+        except subprocess.TimeoutExpired:
+            logging.error(f"Checker timed out on {self.dir}")
+            return False
+        finally:
+            shutil.rmtree(self.dir, ignore_errors=True)
+
+class ExternalChecker():
+    def __init__(self, path):
+        self.path = path
+
+    def sink(self, i, input_path, expected_path):
+        return ExternalSink(self.path, i, input_path, expected_path)
+
+class Config():
+    """Limits and checker applied to every test"""
+
+    def __init__(self, timeout, memory_limit, output_limit, checker):
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.output_limit = output_limit
+        self.checker = checker
+
+def consume(process, sink, output_limit) -> bool:
+    """Stream the process stdout into the sink. Kills the process if it prints more than output_limit bytes
+    and returns False in that case."""
+
+    size = 0
+    while True:
+        data = process.stdout.read1(CHUNK_SIZE)
+        if not data:
+            return True
+
+        size += len(data)
+        if output_limit != 0 and size > output_limit:
+            kill_group(process)
+            return False
+
+        sink.feed(data)
+
+def run_test(i, input_path, expected_path, config: Config) -> str:
+    """Run a single test case and return its verdict"""
+    within_limit = []
+    sink = config.checker.sink(i, input_path, expected_path)
+
+    with open(input_path, "rb") as stdin:
+        start_time = time.monotonic()
+        process = subprocess.Popen(
+            "./artifact", stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            start_new_session=True, preexec_fn=memory_limiter(config.memory_limit)
+        )
+
+    reader = threading.Thread(target=lambda: within_limit.append(consume(process, sink, config.output_limit)), daemon=True)
+    reader.start()
+
+    usage = supervise(process, start_time, config.timeout)
+    reader.join(READER_TIMEOUT)
+    if reader.is_alive():
+        # A process escaped the session and holds the output open
+        logging.error(f"Test {i} output still open after its process exited")
+        return "error"
+
+    process.stdout.close()
+    passed = sink.close()
+
+    logging.debug(f"Test {i}: {usage}")
+
+    if usage.timed_out:
+        logging.warning(f"Test {i} terminated due to timeout")
+        return "timeout"
+
+    if not all(within_limit):
+        logging.warning(f"Test {i} terminated due to excessive output")
+        return "outputlimit"
+
+    if config.memory_limit != 0 and usage.peak_rss > config.memory_limit:
+        logging.warning(f"Test {i} terminated due to excessive memory usage: {usage.peak_rss} bytes")
+        return "memfail"
+
+    if passed:
+        logging.info(f"Test {i} passed")
+        return "passed"
+
+    logging.warning(f"Test {i} not passed")
+    return "failed"
+
+def judge(test, config: Config, stop=None) -> str:
+    """Judge a test, unless stop is set. When stop is provided, it is set if the test does not pass."""
+    i, input_path, expected_path = test
+
+    if stop is not None and stop.is_set():
+        return "skipped"
+
+    try:
+        verdict = run_test(i, input_path, expected_path, config)
+    except Exception as e:
+        logging.error(f"Test case {i} terminated due to error {str(e)}")
+        verdict = "error"
+
+    if stop is not None and verdict != "passed":
+        stop.set()
+
+    return verdict
+
+class Progress():
+    """Prints a progress record on stdout as soon as each test is judged"""
+
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.passed = 0
+        self.lock = threading.Lock()
+
+    def report(self, i, verdict):
+        with self.lock:
+            self.done += 1
+            if verdict == "passed":
+                self.passed += 1
+
+            record = {"test": i, "verdict": verdict, "done": self.done, "passed": self.passed, "total": self.total}
+            print(json.dumps({"progress": record}), flush=True)
+
+def main(timeout, memory_limit, jobs=1, fail_fast=False, tolerance=0.0, output_limit=0) -> int:
+    """Run all the tests, up to jobs of them at the same time. Each test has its own time and memory limits,
+    a progress record is printed as each test completes and the results are printed at the end, in test
+    order regardless of the degree of parallelism.
+
+    With fail_fast, tests that have not started yet when a test does not pass are skipped.
+    Outputs are checked by ./checker when present, otherwise compared token by token with the expected
+    ones, with the given tolerance on numbers."""
+
+    timeout = int(timeout) / 1e6    # us to seconds
+    if timeout == 0: timeout = DEFAULT_TIMEOUT
+    memory_limit = int(memory_limit)
+    stop = threading.Event() if fail_fast else None
+
+    checker = ExternalChecker(os.path.abspath(CHECKER)) if os.path.exists(CHECKER) else TokenChecker(tolerance)
+    config = Config(timeout, memory_limit, output_limit, checker)
+
+    with open(os.path.join(TESTS_DIR, "index.json"), "r") as tfp:
+        tests = [
+            (i, os.path.join(TESTS_DIR, f"{i}.in"), os.path.join(TESTS_DIR, f"{i}.out")) for i in json.load(fp=tfp)
+        ]
+
+    progress = Progress(len(tests))
+
+    def judge_and_report(test):
+        verdict = judge(test, config, stop)
+        progress.report(test[0], verdict)
+        return verdict
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        verdicts = executor.map(judge_and_report, tests)
+        results = {i: verdict for (i, _, _), verdict in zip(tests, verdicts)}
 
     print(json.dumps(results))
 
+def available_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
 if __name__ == "__main__":
-    main(*sys.argv[1:3])
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("timeout", help="time limit for each test, in us (0 = no limit)")
+    parser.add_argument("memory_limit", help="memory limit for each test, in bytes (0 = no limit)")
+    parser.add_argument("--build", metavar="COMMAND", help="compile the source with COMMAND before testing")
+    parser.add_argument("--build-checker", metavar="COMMAND", help="compile the checker with COMMAND before testing")
+    parser.add_argument("--jobs", type=int, default=1, help="number of tests run in parallel (0 = one per CPU)")
+    parser.add_argument("--fail-fast", action="store_true", help="skip remaining tests after the first one not passed")
+    parser.add_argument("--float-tolerance", type=float, default=0.0, help="absolute or relative tolerance on numbers")
+    parser.add_argument("--output-limit", type=int, default=0, help="maximum output size of a test, in bytes (0 = no limit)")
+    args = parser.parse_args()
+
+    if args.build and not build(args.build):
+        sys.exit(BUILD_FAILED)
+
+    if args.build_checker:
+        if not build(args.build_checker, CHECKER_BUILD_DIR):
+            sys.exit(CHECKER_BUILD_FAILED)
+        os.replace(os.path.join(CHECKER_BUILD_DIR, "artifact"), CHECKER)
+
+    main(args.timeout, args.memory_limit, args.jobs or available_cpus(), args.fail_fast, args.float_tolerance, args.output_limit)
\ No newline at end of file
@@ -0,0 +1,233 @@
+"""
+Latency histograms of the judge pipeline and usage gauges, exposed in the Prometheus text format.
+
+Observations are aggregated in Redis, so that the counts of every web and worker process add up. Each
+component (web app or Celery workers) keeps its own histograms and exposes them on its own endpoint:
+/metrics on the web app (for staff and METRICS_ALLOWED_NETWORKS only), a small HTTP server on the workers.
+
+Observations are buffered in memory and written in batches by a background thread of each process, so that
+timing a request or a task never waits on Redis. Failures to record are logged and ignored, metrics never
+get in the way of judging.
+"""
+
+import os
+import time
+import math
+import atexit
+import logging
+import ipaddress
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import redis
+from django.http import HttpResponse
+
+from AlgoBattles import settings
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, math.inf)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+KEY_PREFIX = "metrics"
+GAUGE_PREFIX = "metrics-gauge"
+
+# Component the observations of this process are accounted to, "worker" in Celery workers
+component = "web"
+
+FLUSH_INTERVAL = 1.0    # seconds between writes of the buffered observations
+MAX_PENDING = 10000     # observations buffered at most, newer ones are dropped while Redis is unreachable
+
+_client = None
+_broker_client = None
+_pending = []
+_pending_lock = threading.Lock()
+_flusher_pid = None
+
+def set_component(name):
+    global component
+    component = name
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.METRICS_REDIS_URL, socket_connect_timeout=0.5, socket_timeout=0.5)
+
+    return _client
+
+def get_broker_client():
+    global _broker_client
+    if _broker_client is None:
+        _broker_client = redis.Redis.from_url(settings.CELERY_BROKER_URL, socket_connect_timeout=0.5, socket_timeout=0.5)
+
+    return _broker_client
+
+def _labels_field(labels):
+    return ",".join(f"{k}={v}" for k, v in sorted(labels.items()))
+
+def _format_le(bound):
+    return "+Inf" if bound == math.inf else repr(float(bound))
+
+def observe(metric, seconds, **labels):
+    """Record a duration in the histogram metric, with the given labels. The observation is written to
+    Redis with the next batch."""
+    bucket = next(b for b in BUCKETS if seconds <= b)
+    observation = (f"{KEY_PREFIX}:{component}:{metric}", _labels_field(labels), _format_le(bucket), seconds)
+
+    _start_flusher()
+    with _pending_lock:
+        if len(_pending) < MAX_PENDING:
+            _pending.append(observation)
+
+def flush():
+    """Write the buffered observations to Redis, in a single pipeline"""
+    with _pending_lock:
+        batch = _pending[:]
+        _pending.clear()
+
+    if not batch:
+        return
+
+    try:
+        pipe = get_client().pipeline(transaction=False)
+        for key, fields, le, seconds in batch:
+            pipe.hincrby(key, f"{fields}|bucket|{le}", 1)
+            pipe.hincrbyfloat(key, f"{fields}|sum", seconds)
+            pipe.hincrby(key, f"{fields}|count", 1)
+        pipe.execute()
+    except redis.RedisError as e:
+        logging.debug(f"Cannot record {len(batch)} observations: {e}")
+
+def _flush_forever():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        flush()
+
+def _start_flusher():
+    """Start the flusher thread of this process. Forked processes (Celery pool workers) start their own and
+    drop the observations buffered by their parent, which flushes them."""
+    global _flusher_pid
+    if _flusher_pid == os.getpid():
+        return
+
+    with _pending_lock:
+        if _flusher_pid == os.getpid():
+            return
+        if _flusher_pid is not None:
+            _pending.clear()
+
+        _flusher_pid = os.getpid()
+        threading.Thread(target=_flush_forever, name="metrics-flusher", daemon=True).start()
+
+atexit.register(flush)
+
+def gauge(metric, value, **labels):
+    """Set the current value of a gauge, with the given labels"""
+    try:
+        get_client().hset(f"{GAUGE_PREFIX}:{component}:{metric}", _labels_field(labels), value)
+    except redis.RedisError as e:
+        logging.debug(f"Cannot record {metric}: {e}")
+
+def _selector(labels, *extra):
+    pairs = [f'{k}="{v}"' for k, v in (p.split("=", 1) for p in labels.split(",") if p)] + list(extra)
+    return f"{{{','.join(pairs)}}}" if pairs else ""
+
+@contextmanager
+def span(phase, **labels):
+    """Time the enclosed block as a phase of the judge pipeline"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe("judge_phase", time.perf_counter() - start, phase=phase, **labels)
+
+def render(name=None) -> str:
+    """Histograms of a component in the Prometheus text format"""
+    name = name or component
+    client = get_client()
+    lines = []
+
+    for key in sorted(client.scan_iter(f"{KEY_PREFIX}:{name}:*")):
+        metric = f"algobattles_{key.decode().rsplit(':', 1)[1]}_seconds"
+        series = {}
+        for field, value in client.hgetall(key).items():
+            labels, kind, *bound = field.decode().split("|")
+            series.setdefault(labels, {"bucket": {}})
+            if kind == "bucket":
+                series[labels]["bucket"][bound[0]] = int(value)
+            else:
+                series[labels][kind] = float(value)
+
+        lines.append(f"# TYPE {metric} histogram")
+        for labels, values in sorted(series.items()):
+            cumulative = 0
+            for bound in BUCKETS:
+                le = _format_le(bound)
+                cumulative += values["bucket"].get(le, 0)
+                selector = _selector(labels, f'le="{le}"')
+                lines.append(f"{metric}_bucket{selector} {cumulative}")
+
+            lines.append(f"{metric}_sum{_selector(labels)} {values.get('sum', 0.0)}")
+            lines.append(f"{metric}_count{_selector(labels)} {int(values.get('count', 0))}")
+
+    for key in sorted(client.scan_iter(f"{GAUGE_PREFIX}:{name}:*")):
+        metric = f"algobattles_{key.decode().rsplit(':', 1)[1]}"
+        lines.append(f"# TYPE {metric} gauge")
+        for labels, value in sorted(client.hgetall(key).items()):
+            lines.append(f"{metric}{_selector(labels.decode())} {float(value)}")
+
+    return "\n".join(lines) + "\n"
+
+def report_queue_depths():
+    """Gauges of the attempts waiting in the challenge and practice queues of the broker"""
+    broker = get_broker_client()
+
+    for queue_class, queue in (("challenge", settings.ENGINE_CHALLENGE_QUEUE), ("practice", settings.ENGINE_PRACTICE_QUEUE)):
+        gauge("queue_depth", broker.llen(queue), queue=queue_class)
+
+def allowed(request) -> bool:
+    """Metrics are exposed to staff users and to clients of METRICS_ALLOWED_NETWORKS, like Prometheus"""
+    if getattr(request, "user", None) is not None and request.user.is_staff:
+        return True
+
+    try:
+        address = ipaddress.ip_address(request.META.get("REMOTE_ADDR", ""))
+    except ValueError:
+        return False
+
+    return any(address in ipaddress.ip_network(network) for network in settings.METRICS_ALLOWED_NETWORKS)
+
+def metrics_view(request):
+    if not allowed(request):
+        return HttpResponse(status=403)
+
+    try:
+        report_queue_depths()
+        body = render("web")
+    except redis.RedisError as e:
+        return HttpResponse(f"# metrics unavailable: {e}\n", status=503, content_type=CONTENT_TYPE)
+
+    return HttpResponse(body, content_type=CONTENT_TYPE)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        try:
+            body, status = render("worker").encode(), 200
+        except redis.RedisError as e:
+            body, status = f"# metrics unavailable: {e}\n".encode(), 503
+
+        self.send_response(status)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(port):
+    """Expose the worker histograms over HTTP, in a background thread"""
+    server = ThreadingHTTPServer(("", port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
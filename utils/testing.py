@@ -0,0 +1,12 @@
+"""
+Helpers shared by the test suites of the apps.
+"""
+
+import redis
+
+def redis_available(url):
+    """Whether a Redis server answers at url, for tests that need a live one"""
+    try:
+        return redis.Redis.from_url(url, socket_connect_timeout=0.5, socket_timeout=0.5).ping()
+    except redis.RedisError:
+        return False
@@ -0,0 +1,43 @@
+from django.test import SimpleTestCase
+from unittest import skipUnless
+from AlgoBattles import settings
+from . import metrics
+from .testing import redis_available
+import uuid
+
+@skipUnless(redis_available(settings.METRICS_REDIS_URL), "requires a live Redis")
+class TestMetrics(SimpleTestCase):
+    def setUp(self):
+        self.component = f"test-{uuid.uuid4().hex[:8]}"
+        metrics.set_component(self.component)
+        self.addCleanup(metrics.set_component, "web")
+        self.addCleanup(self.cleanup)
+
+    def cleanup(self):
+        client = metrics.get_client()
+        for key in client.scan_iter(f"{metrics.KEY_PREFIX}:{self.component}:*"):
+            client.delete(key)
+
+    def test_span_histogram(self):
+        with metrics.span("compile"):
+            pass
+        metrics.observe("judge_phase", 2, phase="compile")
+        metrics.flush()
+
+        text = metrics.render(self.component)
+
+        self.assertIn("# TYPE algobattles_judge_phase_seconds histogram", text)
+        self.assertIn('algobattles_judge_phase_seconds_bucket{phase="compile",le="1.0"} 1', text)
+        self.assertIn('algobattles_judge_phase_seconds_bucket{phase="compile",le="+Inf"} 2', text)
+        self.assertIn('algobattles_judge_phase_seconds_count{phase="compile"} 2', text)
+
+    def test_metrics_endpoint(self):
+        response = self.client.get("/metrics")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+
+    def test_metrics_endpoint_restricted(self):
+        response = self.client.get("/metrics", REMOTE_ADDR="203.0.113.7")
+
+        self.assertEqual(response.status_code, 403)